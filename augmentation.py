@@ -0,0 +1,145 @@
+import os
+import math
+import numpy as np
+import tensorflow as tf
+from image_io import decode_and_resize
+
+# The transform family new_model.py used with ImageDataGenerator
+default_augmentation = {
+    'rotation_range': 20,  # degrees
+    'width_shift_range': 0.2,  # fraction of the width
+    'height_shift_range': 0.2,  # fraction of the height
+    'shear_range': 0.2,  # degrees, like ImageDataGenerator
+    'zoom_range': 0.2,  # zoom in [0.8, 1.2], separately for x and y
+    'horizontal_flip': True,
+}
+
+def random_transforms(batch_size, img_width, img_height, seed, rotation_range=20, width_shift_range=0.2,
+                      height_shift_range=0.2, shear_range=0.2, zoom_range=0.2):
+    """
+    One random affine transform per image, drawn with stateless RNG ops from a [2] int seed.
+    The matrix is the one ImageDataGenerator.apply_affine_transform builds (rotation @ shift @
+    shear @ zoom about the image centre), converted from its (row, col) convention to the
+    (x, y) output-to-input form ImageProjectiveTransformV3 expects.
+    Returns:
+        A (batch_size, 8) float32 tensor of projective transforms.
+    """
+    seeds = tf.random.experimental.stateless_split(seed, 5)
+
+    def uniform(index, limit):
+        return tf.random.stateless_uniform([batch_size], seeds[index], -limit, limit)
+
+    theta = uniform(0, rotation_range * math.pi / 180)
+    tx = uniform(1, height_shift_range) * img_height  # rows
+    ty = uniform(2, width_shift_range) * img_width  # columns
+    shear = uniform(3, shear_range * math.pi / 180)
+    zoom = tf.random.stateless_uniform([batch_size, 2], seeds[4], 1 - zoom_range, 1 + zoom_range)
+    zx, zy = zoom[:, 0], zoom[:, 1]
+
+    return affine_transforms(theta, tx, ty, shear, zx, zy, img_width, img_height)
+
+def affine_transforms(theta, tx, ty, shear, zx, zy, img_width, img_height):
+    """Per-image ImageDataGenerator parameters (angles in radians) -> (batch, 8) projective transforms."""
+    cos, sin = tf.cos(theta), tf.sin(theta)
+    # rotation @ shift @ shear @ zoom, multiplied out in (row, col) coordinates
+    m00 = cos * zx
+    m01 = (-cos * tf.sin(shear) - sin * tf.cos(shear)) * zy
+    m10 = sin * zx
+    m11 = (-sin * tf.sin(shear) + cos * tf.cos(shear)) * zy
+    m02 = cos * tx - sin * ty
+    m12 = sin * tx + cos * ty
+
+    # Move the origin to the image centre and back, like transform_matrix_offset_center
+    o_row, o_col = img_height / 2 - 0.5, img_width / 2 - 0.5
+    m02 = m02 + o_row - m00 * o_row - m01 * o_col
+    m12 = m12 + o_col - m10 * o_row - m11 * o_col
+
+    zeros = tf.zeros_like(theta)
+    # x is the column and y the row, so the row/col entries swap places
+    return tf.stack([m11, m10, m12, m01, m00, m02, zeros, zeros], axis=1)
+
+def augment_batch(images, seed, rotation_range=20, width_shift_range=0.2, height_shift_range=0.2,
+                  shear_range=0.2, zoom_range=0.2, horizontal_flip=True):
+    """
+    Randomly transforms a whole (batch, height, width, 3) float batch in a single op, with bilinear
+    interpolation and nearest-edge fill. The same seed always gives the same result.
+    """
+    shape = tf.shape(images)
+    batch_size, img_height, img_width = shape[0], shape[1], shape[2]
+    transforms = random_transforms(batch_size, tf.cast(img_width, tf.float32), tf.cast(img_height, tf.float32),
+                                   seed, rotation_range, width_shift_range, height_shift_range,
+                                   shear_range, zoom_range)
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=shape[1:3], fill_value=0.0,
+        interpolation='BILINEAR', fill_mode='NEAREST')
+
+    if horizontal_flip:
+        flip_seed = tf.random.experimental.stateless_fold_in(seed, 1)
+        flip = tf.random.stateless_uniform([batch_size], flip_seed) < 0.5
+        images = tf.where(flip[:, None, None, None], tf.reverse(images, axis=[2]), images)
+    return images
+
+def list_image_files(data_dir):
+    """(paths, labels, class_names) under data_dir/<class>/, with classes sorted like flow_from_directory."""
+    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+    class_names = sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+    paths = []
+    labels = []
+    for class_index, class_name in enumerate(class_names):
+        class_path = os.path.join(data_dir, class_name)
+        for image_name in sorted(os.listdir(class_path)):
+            if image_name.lower().endswith(image_extensions):
+                paths.append(os.path.join(class_path, image_name))
+                labels.append(class_index)
+    return paths, labels, class_names
+
+def load_image(path, img_width, img_height):
+    """
+    Reads, decodes and resizes one image file to a [0, 1] float32 tensor. The decode is
+    image_io.decode_and_resize, the same one serving uses, so training and prediction see identical
+    pixels (and large JPEGs are decoded at a reduced scale). cv2 releases the GIL while decoding,
+    so parallel map calls still overlap.
+    """
+    def decode(path_bytes):
+        # bytes when run in a graph, a 0-d array when run eagerly
+        return decode_and_resize(np.asarray(path_bytes).item().decode(), (img_width, img_height))
+
+    image = tf.numpy_function(decode, [path], tf.uint8, stateful=False)
+    image.set_shape((img_height, img_width, 3))
+    return tf.cast(image, tf.float32) / 255.0
+
+def image_dataset(paths, labels, img_width, img_height, batch_size, shuffle=False, augment=None, seed=None):
+    """
+    The tf.data replacement for ImageDataGenerator(rescale=1./255, ...).flow_from_directory.
+    Files are read, decoded and resized in parallel (see load_image), scaled to [0, 1], batched,
+    and then augmented a whole batch at a time.
+    Args:
+        paths: Image file paths.
+        labels: Class index per path.
+        img_width: Width the images are resized to.
+        img_height: Height the images are resized to.
+        batch_size: Images per batch.
+        shuffle: Reshuffle the files every epoch.
+        augment: None for no augmentation, or keyword arguments for augment_batch (e.g. default_augmentation).
+        seed: Seed for shuffling and augmentation; with a seed, every run sees the same batches.
+    Returns:
+        A tf.data.Dataset of (images, labels) batches.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((paths, tf.constant(labels, dtype=tf.int32)))
+    if shuffle:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+
+    def load(path, label):
+        return load_image(path, img_width, img_height), label
+
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=seed is not None or not shuffle)
+    dataset = dataset.batch(batch_size)
+
+    if augment is not None:
+        # One pair of stateless seeds per batch: reproducible with a seed, and different every epoch
+        batch_seeds = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).batch(2)
+        dataset = tf.data.Dataset.zip((dataset, batch_seeds)).map(
+            lambda batch, batch_seed: (augment_batch(batch[0], batch_seed, **augment), batch[1]),
+            num_parallel_calls=tf.data.AUTOTUNE, deterministic=seed is not None)
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from augmentation import default_augmentation, image_dataset, list_image_files
+
+def make_synthetic_split(save_dir, num_images, num_classes=4, width=640, height=480, seed=0):
+    """Writes num_images random JPEGs into save_dir/<class>/ (the layout flow_from_directory reads)."""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    for i in range(num_images):
+        class_dir = os.path.join(save_dir, f'class_{i % num_classes}')
+        os.makedirs(class_dir, exist_ok=True)
+        Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(
+            os.path.join(class_dir, f'{i:06d}.jpg'), quality=90)
+    return save_dir
+
+def images_per_sec(batches, num_batches):
+    """Pulls num_batches from an iterator (after one warm-up batch) and returns images/sec."""
+    next(batches)
+    images = 0
+    start_time = time.perf_counter()
+    for _ in range(num_batches):
+        images += len(next(batches)[0])
+    return images / (time.perf_counter() - start_time)
+
+def run_benchmark(data_dir, batch_size=32, num_batches=20, img_width=224, img_height=224):
+    """
+    Augmented images/sec of ImageDataGenerator.flow_from_directory (the old new_model.py input)
+    against augmentation.image_dataset with the same transform family.
+    """
+    results = {}
+    try:
+        import scipy  # ImageDataGenerator needs it for its affine transforms
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+        datagen = ImageDataGenerator(rescale=1./255, fill_mode='nearest', **default_augmentation)
+        generator = datagen.flow_from_directory(data_dir, target_size=(img_width, img_height),
+                                                batch_size=batch_size, class_mode='sparse', shuffle=True)
+        results['ImageDataGenerator'] = images_per_sec(iter(generator), num_batches)
+    except ImportError:
+        print("scipy is not installed: skipping the ImageDataGenerator baseline")
+
+    paths, labels, _ = list_image_files(data_dir)
+    dataset = image_dataset(paths, labels, img_width, img_height, batch_size, shuffle=True,
+                            augment=default_augmentation, seed=0).repeat()
+    results['tf.data'] = images_per_sec(iter(dataset), num_batches)
+
+    for name, rate in results.items():
+        print(f"{name:>18}: {rate:.1f} augmented images/sec")
+    if len(results) == 2:
+        print(f"Speedup: {results['tf.data'] / results['ImageDataGenerator']:.1f}x")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark augmented images/sec: ImageDataGenerator vs tf.data")
+    parser.add_argument('--data-dir', help="Folder of class sub-folders (defaults to synthetic 640x480 JPEGs)")
+    parser.add_argument('--num-images', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--out', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or make_synthetic_split(tmp_dir, args.num_images)
+        results = run_benchmark(data_dir, args.batch_size, args.batches)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
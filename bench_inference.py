@@ -0,0 +1,84 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+
+import prediction_model
+from inference_backend import KerasBackend
+
+def make_synthetic_images(save_dir, num_images, width=640, height=480, seed=0):
+    """Writes num_images random JPEGs of the given size and returns their paths."""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(num_images):
+        path = os.path.join(save_dir, f'{i:06d}.jpg')
+        Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+def build_untrained_model(img_width=224, img_height=224, num_classes=4):
+    """Same architecture as new_model.py with random weights, for timing without a trained checkpoint."""
+    from tensorflow.keras.applications import ResNet50
+    from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
+    from tensorflow.keras.models import Model
+
+    base_model = ResNet50(weights=None, include_top=False, input_shape=(img_width, img_height, 3))
+    x = GlobalAveragePooling2D()(base_model.output)
+    x = Dropout(0.5)(x)
+    x = Dense(1024, activation='relu')(x)
+    x = Dropout(0.5)(x)
+    predictions = Dense(num_classes, activation='softmax')(x)
+    return Model(inputs=base_model.input, outputs=predictions)
+
+def run_benchmark(image_paths, batch_size=32):
+    """
+    Times the one-image-per-call loop against predict_images.
+    Returns:
+        {'single': {...}, 'batched': {...}} with per-image latency (ms) and images/sec.
+    """
+    img_width, img_height = prediction_model.img_width, prediction_model.img_height
+
+    # Warm up both paths so tracing/graph building isn't counted
+    prediction_model.predict_image(image_paths[0], img_width, img_height)
+    list(prediction_model.predict_images(image_paths[:batch_size], batch_size=batch_size))
+
+    start_time = time.perf_counter()
+    for path in image_paths:
+        prediction_model.predict_image(path, img_width, img_height)
+    single_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in prediction_model.predict_images(image_paths, batch_size=batch_size):
+        pass
+    batched_seconds = time.perf_counter() - start_time
+
+    results = {}
+    for name, seconds in [('single', single_seconds), ('batched', batched_seconds)]:
+        results[name] = {'ms_per_image': 1000 * seconds / len(image_paths),
+                         'images_per_sec': len(image_paths) / seconds}
+        print(f"{name:>8}: {results[name]['ms_per_image']:.1f} ms/image, "
+              f"{results[name]['images_per_sec']:.1f} images/sec")
+    print(f"Speedup: {single_seconds / batched_seconds:.1f}x")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Single-image vs batched inference benchmark")
+    parser.add_argument('--model', help="Trained .keras or .tflite model (defaults to an untrained ResNet50 of the same shape)")
+    parser.add_argument('--images', nargs='*', help="Images to score (defaults to synthetic JPEGs)")
+    parser.add_argument('--synthetic-images', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    if args.model:
+        prediction_model.model_path = args.model
+    else:
+        prediction_model.model = KerasBackend(build_untrained_model())
+
+    if args.images:
+        run_benchmark(args.images, args.batch_size)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_benchmark(make_synthetic_images(tmp_dir, args.synthetic_images), args.batch_size)
@@ -0,0 +1,66 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from data_loader import load_data, load_data_numpy_function
+
+def make_synthetic_split(save_dir, num_images, num_classes=4, img_width=224, img_height=224, seed=0):
+    """Writes num_images random float32 .npy images into save_dir/<class>/ (same layout as preprocess_and_save)."""
+    rng = np.random.default_rng(seed)
+    for i in range(num_images):
+        class_dir = os.path.join(save_dir, f'class_{i % num_classes}')
+        os.makedirs(class_dir, exist_ok=True)
+        image = rng.random((img_height, img_width, 3), dtype=np.float32)
+        np.save(os.path.join(class_dir, f'{i:06d}.npy'), image)
+    return save_dir
+
+def batches_per_sec(dataset, max_batches=None):
+    """Iterates a dataset once and returns (batches, seconds)."""
+    start_time = time.perf_counter()
+    batches = 0
+    for _ in dataset:
+        batches += 1
+        if max_batches and batches >= max_batches:
+            break
+    return batches, time.perf_counter() - start_time
+
+def run_benchmark(data_dir, batch_size=32, epochs=2, max_batches=None, img_width=224, img_height=224):
+    """
+    Times the numpy_function loader against the graph-native loader (with and without an
+    on-disk cache) and returns {name: [batches/sec per epoch]}.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        pipelines = {
+            'numpy_function': lambda: load_data_numpy_function(data_dir, img_width, img_height, batch_size),
+            'graph': lambda: load_data(data_dir, img_width, img_height, batch_size, seed=0),
+            'graph+cache': lambda: load_data(data_dir, img_width, img_height, batch_size, seed=0,
+                                             cache_dir=cache_dir),
+        }
+        for name, build in pipelines.items():
+            dataset = build()
+            rates = []
+            for epoch in range(epochs):
+                batches, seconds = batches_per_sec(dataset, max_batches)
+                rates.append(batches / seconds)
+            results[name] = rates
+            print(f"{name:>15}: " + ", ".join(f"epoch {i + 1} {rate:.1f} batches/sec" for i, rate in enumerate(rates)))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Input pipeline benchmark (batches/sec)")
+    parser.add_argument('--data-dir', help="Preprocessed split to read (defaults to a synthetic one)")
+    parser.add_argument('--synthetic-images', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--max-batches', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.data_dir:
+        run_benchmark(args.data_dir, args.batch_size, args.epochs, args.max_batches)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            make_synthetic_split(tmp_dir, args.synthetic_images)
+            run_benchmark(tmp_dir, args.batch_size, args.epochs, args.max_batches)
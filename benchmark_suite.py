@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+
+from perf_utils import peak_rss_mb
+
+# Offline performance suite: everything runs on synthetic images, so results from different machines
+# and commits can be compared without the dataset. Metrics are flat "<section>.<name>" keys; the unit
+# suffix says which way is better (_per_sec: higher, _ms / _mb: lower), which is what the baseline
+# comparison uses to decide what counts as a regression.
+#
+#   python benchmark_suite.py --out results.json --baseline benchmark_baseline.json
+
+field_photo_size = (5488, 3504)  # width, height of the bundled image.jpg (a full-resolution field photo)
+phone_photo_size = (4000, 3000)  # a typical 12-megapixel phone upload
+model_input_size = (224, 224)
+default_tolerance = 0.10  # a metric more than 10% worse than the baseline is a regression
+
+def make_synthetic_photos(save_dir, num_images, width, height, seed=0):
+    """
+    Writes num_images JPEGs of the given size and returns their paths. The images are smooth
+    (upscaled low-resolution noise) so they compress and decode like photos rather than like noise.
+    """
+    import cv2
+
+    os.makedirs(save_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(num_images):
+        small = rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+        image = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+        path = os.path.join(save_dir, f'{i:06d}.jpg')
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+def make_npy_split(save_dir, num_images, num_classes=4, img_width=224, img_height=224, seed=0):
+    """A preprocessed-style split: float32 .npy images in save_dir/<class>/ (what data_preprocessing.py writes)."""
+    rng = np.random.default_rng(seed)
+    for i in range(num_images):
+        class_dir = os.path.join(save_dir, f'class_{i % num_classes}')
+        os.makedirs(class_dir, exist_ok=True)
+        np.save(os.path.join(class_dir, f'{i:06d}.npy'), rng.random((img_height, img_width, 3), dtype=np.float32))
+    return save_dir
+
+def percentiles_ms(seconds):
+    """p50/p95/p99 of a list of durations, in milliseconds."""
+    values = np.array(seconds) * 1000
+    return {'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99))}
+
+def time_calls(function, items, warmup=1):
+    """Calls function(item) for every item after warmup calls on the first one; returns the per-call seconds."""
+    for _ in range(warmup):
+        function(items[0])
+    durations = []
+    for item in items:
+        start_time = time.perf_counter()
+        function(item)
+        durations.append(time.perf_counter() - start_time)
+    return durations
+
+def full_decode_and_resize(path, target_size):
+    """The reference for image_io.decode_and_resize: the same colour order and resize, from a full decode."""
+    import cv2
+
+    image = cv2.cvtColor(cv2.imread(path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    return cv2.resize(image, target_size, interpolation=cv2.INTER_AREA)
+
+def peak_traced_mb(function, item):
+    """Peak Python/numpy memory (MB) allocated while calling function(item) once; cv2 output arrays are numpy arrays."""
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        function(item)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def bench_decode_resize(photo_sets):
+    """
+    Images/sec of each decode+resize path used in the repo, at each source resolution, plus the
+    reduced-scale JPEG decode (image_io.decode_and_resize) against a full decode: speed and the peak
+    memory of decoding one image.
+    """
+    import tensorflow as tf
+    from augmentation import load_image
+    from data_preprocessing import preprocess_image
+    from image_io import decode_and_resize
+    from prediction_model import load_image_array
+
+    width, height = model_input_size
+    load_tf = tf.function(lambda path: load_image(path, width, height))
+    paths_by_name = {
+        'full_decode': lambda path: full_decode_and_resize(path, (width, height)),  # reference, not used by the repo
+        'decode_and_resize': lambda path: decode_and_resize(path, (width, height)),
+        'preprocess_image': lambda path: preprocess_image(path, (width, height)),  # training .npy files
+        'load_image_array': lambda path: load_image_array(path, width, height),  # serving
+        'tf_load_image': lambda path: load_tf(tf.constant(path)).numpy(),  # tf.data, new_model.py / evaluation.py
+    }
+    metrics = {}
+    for resolution, paths in photo_sets.items():
+        for name, function in paths_by_name.items():
+            durations = time_calls(function, paths)
+            metrics[f'{name}.{resolution}.images_per_sec'] = len(durations) / sum(durations)
+        for name in ('full_decode', 'decode_and_resize'):
+            metrics[f'{name}.{resolution}.peak_mb'] = peak_traced_mb(paths_by_name[name], paths[0])
+        speedup = (metrics[f'decode_and_resize.{resolution}.images_per_sec']
+                   / metrics[f'full_decode.{resolution}.images_per_sec'])
+        print(f"  {resolution}: reduced decode {speedup:.1f}x the speed of a full decode, "
+              f"{metrics[f'decode_and_resize.{resolution}.peak_mb']:.1f} MB vs "
+              f"{metrics[f'full_decode.{resolution}.peak_mb']:.1f} MB peak per image")
+    return metrics
+
+def batches_per_sec(dataset, max_batches):
+    """Iterates dataset for up to max_batches (after one warm-up batch) and returns batches/sec."""
+    iterator = iter(dataset)
+    next(iterator)
+    batches = 0
+    start_time = time.perf_counter()
+    for _ in iterator:
+        batches += 1
+        if batches >= max_batches:
+            break
+    return batches / (time.perf_counter() - start_time)
+
+def bench_loaders(npy_dir, photo_dir, batch_size, max_batches):
+    """Batches/sec of the training input pipelines."""
+    import data_loader
+    import model_building
+    from augmentation import default_augmentation, image_dataset, list_image_files
+
+    width, height = model_input_size
+    model_building.batch_size = batch_size  # its load_data batches with the module setting
+    photo_paths, photo_labels, _ = list_image_files(photo_dir)
+    pipelines = {
+        'data_loader.load_data': lambda: data_loader.load_data(npy_dir, width, height, batch_size, seed=0).repeat(),
+        'model_building.load_data': lambda: model_building.load_data(npy_dir, width, height).repeat(),
+        'new_model.image_dataset': lambda: image_dataset(photo_paths, photo_labels, width, height, batch_size,
+                                                         shuffle=True, augment=default_augmentation, seed=0).repeat(),
+    }
+    return {f'{name}.batches_per_sec': batches_per_sec(build(), max_batches) for name, build in pipelines.items()}
+
+def bench_train_steps(batch_size, steps, models):
+    """Median and p95 train step time of each model on one synthetic batch (compiled with the shared training config)."""
+    import tensorflow as tf
+    from tensorflow.keras.optimizers import Adam
+    from training_config import load_training_config, apply_precision_policy, compile_model, _build_sweep_model
+    from distributed_train import build_model
+
+    width, height = model_input_size
+    training_config = load_training_config(throughput_log=None)
+    apply_precision_policy(training_config)
+    builders = {
+        'cnn': lambda: _build_sweep_model(width, height, 4),  # model_building.py / data_loader.py
+        'resnet50': lambda: build_model(width, height, 4, weights=None),  # new_model.py
+    }
+    rng = np.random.default_rng(0)
+    images = rng.random((batch_size, height, width, 3), dtype=np.float32)
+    labels = rng.integers(0, 4, batch_size)
+
+    metrics = {}
+    for name in models:
+        model = compile_model(builders[name](), training_config, Adam(learning_rate=0.0001))
+        durations = time_calls(lambda _: model.train_on_batch(images, labels), list(range(steps)), warmup=2)
+        metrics[f'{name}.step_p50_ms'] = percentiles_ms(durations)['p50_ms']
+        metrics[f'{name}.step_p95_ms'] = percentiles_ms(durations)['p95_ms']
+        metrics[f'{name}.images_per_sec'] = batch_size * len(durations) / sum(durations)
+        tf.keras.backend.clear_session()
+    return metrics
+
+def bench_inference(photo_paths, batch_size, repeats):
+    """predict_image latency (decode included) and batched model latency, as p50/p95/p99."""
+    import prediction_model
+    from inference_backend import KerasBackend
+    from distributed_train import build_model
+
+    width, height = model_input_size
+    if prediction_model.model is None:
+        prediction_model.model = KerasBackend(build_model(width, height, 4, weights=None))
+    backend = prediction_model.model
+
+    metrics = {}
+    single = time_calls(lambda path: prediction_model.predict_image(path, width, height), photo_paths)
+    metrics.update({f'single.{key}': value for key, value in percentiles_ms(single).items()})
+
+    batch = np.random.default_rng(0).random((batch_size, height, width, 3), dtype=np.float32)
+    batched = time_calls(lambda _: backend.predict(batch), list(range(repeats)))
+    metrics.update({f'batch{batch_size}.{key}': value for key, value in percentiles_ms(batched).items()})
+    metrics[f'batch{batch_size}.images_per_sec'] = batch_size * len(batched) / sum(batched)
+    return metrics
+
+def run_suite(quick=False, sections=None, batch_size=32):
+    """
+    Runs the selected sections ('decode', 'loaders', 'train', 'inference'; all by default).
+    Returns:
+        {'meta': {...}, 'metrics': {'<section>.<name>': value}}
+    """
+    sections = sections or ['decode', 'loaders', 'train', 'inference']
+    scale = 1 if not quick else 0.25
+    results = {'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'platform': platform.platform(),
+                        'python': platform.python_version(), 'cpu_count': os.cpu_count(), 'quick': quick,
+                        'batch_size': batch_size},
+               'metrics': {}}
+    metrics = results['metrics']
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        photo_sets = {
+            f'{model_input_size[0]}x{model_input_size[1]}': make_synthetic_photos(
+                os.path.join(tmp_dir, 'small'), max(4, int(64 * scale)), *model_input_size),
+            'phone_photo': make_synthetic_photos(os.path.join(tmp_dir, 'phone'), max(2, int(8 * scale)),
+                                                 *phone_photo_size),
+            'field_photo': make_synthetic_photos(os.path.join(tmp_dir, 'field'), max(2, int(8 * scale)),
+                                                 *field_photo_size),
+        }
+        for name in sections:
+            start_time = time.perf_counter()
+            if name == 'decode':
+                section = bench_decode_resize(photo_sets)
+            elif name == 'loaders':
+                npy_dir = make_npy_split(os.path.join(tmp_dir, 'npy'), max(batch_size * 2, int(512 * scale)))
+                photo_dir = os.path.join(tmp_dir, 'photos')
+                for i, path in enumerate(make_synthetic_photos(os.path.join(tmp_dir, 'photos_flat'),
+                                                               max(batch_size * 2, int(256 * scale)), 640, 480)):
+                    class_dir = os.path.join(photo_dir, f'class_{i % 4}')
+                    os.makedirs(class_dir, exist_ok=True)
+                    os.replace(path, os.path.join(class_dir, os.path.basename(path)))
+                section = bench_loaders(npy_dir, photo_dir, batch_size, max(4, int(20 * scale)))
+            elif name == 'train':
+                section = bench_train_steps(batch_size, max(3, int(10 * scale)), ['cnn', 'resnet50'])
+            elif name == 'inference':
+                section = bench_inference(photo_sets[f'{model_input_size[0]}x{model_input_size[1]}'], batch_size,
+                                          max(5, int(20 * scale)))
+            else:
+                raise ValueError(f"Unknown benchmark section {name!r}")
+            metrics.update({f'{name}.{key}': value for key, value in section.items()})
+            peak = peak_rss_mb()
+            if peak is not None:
+                metrics[f'{name}.peak_rss_mb'] = peak  # process peak so far, so it includes earlier sections
+            print(f"{name}: done in {time.perf_counter() - start_time:.1f}s")
+    return results
+
+def higher_is_better(metric):
+    return metric.endswith('_per_sec')
+
+def compare(results, baseline, tolerance=default_tolerance):
+    """
+    Compares every metric present in both runs.
+    Returns:
+        A list of (metric, baseline value, new value, relative change) for the regressions, where
+        relative change is how much worse the new value is (0.15 = 15% worse).
+    """
+    regressions = []
+    print(f"{'metric':<55} {'baseline':>12} {'current':>12} {'change':>8}")
+    for metric, value in sorted(results['metrics'].items()):
+        if metric not in baseline['metrics']:
+            print(f"{metric:<55} {'-':>12} {value:>12.2f}    (new)")
+            continue
+        old = baseline['metrics'][metric]
+        if old == 0:
+            continue
+        change = (value - old) / old
+        worse_by = -change if higher_is_better(metric) else change
+        flag = '  REGRESSION' if worse_by > tolerance else ''
+        print(f"{metric:<55} {old:>12.2f} {value:>12.2f} {change:>+8.1%}{flag}")
+        if worse_by > tolerance:
+            regressions.append((metric, old, value, worse_by))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline performance suite: decode/resize, loaders, train steps, "
+                                                 "inference latency and peak RSS, compared against a baseline")
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="Earlier results to compare against; regressions make the exit code 1")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Also write these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=default_tolerance,
+                        help="Relative slowdown that counts as a regression (default 0.10)")
+    parser.add_argument('--sections', nargs='+', choices=['decode', 'loaders', 'train', 'inference'])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--quick', action='store_true', help="Fewer images and steps (noisier)")
+    args = parser.parse_args()
+
+    results = run_suite(args.quick, args.sections, args.batch_size)
+    for path in filter(None, [args.out, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+        print("No regressions")
@@ -0,0 +1,302 @@
+import io
+import sys
+import json
+import zlib
+import struct
+import tarfile
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import prediction_model
+
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+max_member_bytes = 50 * 2**20  # larger (decompressed) members are skipped with an error, so a zip bomb can't fill memory
+
+class _PushbackReader:
+    """Wraps a non-seekable stream so bytes read too far ahead can be handed back."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            data, self.buffer = self.buffer + self.stream.read(), b''
+            return data
+        data = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        while len(data) < n:
+            chunk = self.stream.read(n - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+def _read_exact(reader, n):
+    data = reader.read(n)
+    if len(data) != n:
+        raise ValueError("Archive ended in the middle of a member")
+    return data
+
+def _skip(reader, n, chunk_size=1 << 16):
+    """Reads and drops n bytes without holding them."""
+    while n > 0:
+        n -= len(_read_exact(reader, min(n, chunk_size)))
+
+def _inflate(decompressor, read_chunk, chunk_size=1 << 16):
+    """
+    Inflates a raw deflate stream chunk by chunk until it ends. Output past max_member_bytes is dropped
+    (the stream is still read to its end, so the next member can be found).
+    Returns (data, error).
+    """
+    parts, size = [], 0
+    while not decompressor.eof:
+        chunk = decompressor.unconsumed_tail or read_chunk()
+        out = decompressor.decompress(chunk, chunk_size)  # bounded output per call, whatever the ratio
+        if not chunk and not out:
+            raise ValueError("Archive ended in the middle of a member")
+        size += len(out)
+        if size <= max_member_bytes:
+            parts.append(out)
+    if size > max_member_bytes:
+        return None, f'member larger than {max_member_bytes} bytes'
+    return b''.join(parts), None
+
+def _scan_stored(reader, is_zip64, chunk_size=1 << 16):
+    """
+    Reads a stored member whose sizes follow it in a data descriptor, by scanning for the descriptor
+    signature followed by the crc and sizes of the bytes before it (a stray signature in the data
+    doesn't match those). Output past max_member_bytes is dropped, as in _inflate.
+    Returns (data, error).
+    """
+    sizes_format = '<QQ' if is_zip64 else '<II'
+    descriptor_size = 8 + struct.calcsize(sizes_format)  # signature, crc, two sizes
+    parts, size, crc = [], 0, 0
+    window = b''  # member bytes from offset size on
+    while True:
+        chunk = reader.read(chunk_size)
+        window += chunk
+        position = window.find(b'PK\x07\x08')
+        while 0 <= position <= len(window) - descriptor_size:
+            stored_crc, = struct.unpack('<I', window[position + 4:position + 8])
+            sizes = struct.unpack(sizes_format, window[position + 8:position + descriptor_size])
+            if sizes[0] == sizes[1] == size + position and stored_crc == zlib.crc32(window[:position], crc):
+                reader.unread(window[position + descriptor_size:])
+                if size + position > max_member_bytes:
+                    return None, f'member larger than {max_member_bytes} bytes'
+                return b''.join(parts) + window[:position], None
+            position = window.find(b'PK\x07\x08', position + 1)
+        if not chunk:
+            raise ValueError("Archive ended in the middle of a member")
+        # Keep only the tail a descriptor could still start in
+        done = max(0, len(window) - descriptor_size + 1)
+        crc = zlib.crc32(window[:done], crc)
+        size += done
+        if size <= max_member_bytes:
+            parts.append(window[:done])
+        window = window[done:]
+
+def _zip64_sizes(extra, compressed_size, uncompressed_size):
+    """
+    Reads the real sizes from a ZIP64 extra field when the header holds 0xFFFFFFFF.
+    Returns (compressed_size, uncompressed_size, is_zip64).
+    """
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[position:position + 4])
+        if header_id == 0x0001:
+            values = extra[position + 4:position + 4 + size]
+            if uncompressed_size == 0xFFFFFFFF:
+                uncompressed_size, values = struct.unpack('<Q', values[:8])[0], values[8:]
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = struct.unpack('<Q', values[:8])[0]
+            return compressed_size, uncompressed_size, True
+        position += 4 + size
+    return compressed_size, uncompressed_size, False
+
+def iter_zip_stream(stream, chunk_size=1 << 16):
+    """
+    Reads ZIP members front to back from a non-seekable stream (local headers only, the
+    central directory is never needed). Yields (name, data, error) per file member; a corrupt or
+    oversized member gets an error, and only a member whose end can't be found stops the stream.
+    """
+    reader = _PushbackReader(stream)
+    while True:
+        signature = reader.read(4)
+        if signature != b'PK\x03\x04':
+            return  # central directory (or end of stream): no more members
+        (_, flags, method, _, _, _, compressed_size, uncompressed_size,
+         name_length, extra_length) = struct.unpack('<HHHHHIIIHH', _read_exact(reader, 26))
+        name = _read_exact(reader, name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = _read_exact(reader, extra_length)
+        compressed_size, uncompressed_size, is_zip64 = _zip64_sizes(extra, compressed_size, uncompressed_size)
+
+        data, error = None, None
+        if flags & 0x08 and (flags & 0x01 or method not in (0, 8)):
+            # Sizes follow the data in a descriptor, and the end of this data can't be found
+            problem = 'encrypted member' if flags & 0x01 else f'unsupported compression method {method}'
+            yield name, None, f'{problem}; the rest of the archive could not be read'
+            return
+        elif flags & 0x08 and method == 0:
+            # Sizes follow the data in a descriptor (zipfile writing to a non-seekable stream does this)
+            try:
+                data, error = _scan_stored(reader, is_zip64, chunk_size)
+            except ValueError as e:
+                yield name, None, f'{e}; the rest of the archive could not be read'
+                return
+        elif flags & 0x08 and method == 8:
+            # Sizes follow the data in a descriptor; deflate finds its own end
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            try:
+                data, error = _inflate(decompressor, lambda: reader.read(chunk_size), chunk_size)
+            except zlib.error as e:
+                # The end of a corrupt member can't be found, so nothing after it can be read
+                yield name, None, f'corrupt member: {e}; the rest of the archive could not be read'
+                return
+            reader.unread(decompressor.unused_data)
+            descriptor = _read_exact(reader, 4)
+            # The descriptor signature is optional; ZIP64 descriptors carry 8-byte sizes
+            descriptor_size = 12 if descriptor == b'PK\x07\x08' else 8  # crc + two sizes left
+            if is_zip64:
+                descriptor_size += 8
+            _read_exact(reader, descriptor_size)
+        elif flags & 0x01 or method not in (0, 8) or (method == 0 and compressed_size > max_member_bytes):
+            _skip(reader, compressed_size)
+            if flags & 0x01:
+                error = 'encrypted member'
+            elif method == 0:
+                error = f'member larger than {max_member_bytes} bytes'
+            else:
+                error = f'unsupported compression method {method}'
+        else:
+            remaining = [compressed_size]
+
+            def read_chunk():
+                data = _read_exact(reader, min(remaining[0], chunk_size)) if remaining[0] else b''
+                remaining[0] -= len(data)
+                return data
+
+            if method == 0:
+                data = _read_exact(reader, compressed_size)
+            else:
+                try:
+                    data, error = _inflate(zlib.decompressobj(-zlib.MAX_WBITS), read_chunk, chunk_size)
+                except (zlib.error, ValueError) as e:
+                    data, error = None, f'corrupt member: {e}'
+                _skip(reader, remaining[0])  # the rest of a corrupt member
+
+        if not name.endswith('/'):
+            yield name, data, error
+
+def iter_tar_stream(stream):
+    """Reads TAR (optionally gz/bz2/xz compressed) members in streaming mode. Yields (name, data, error)."""
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if member.isfile():
+                if member.size > max_member_bytes:
+                    yield member.name, None, f'member larger than {max_member_bytes} bytes'
+                else:
+                    yield member.name, archive.extractfile(member).read(), None
+
+def iter_archive(stream):
+    """Detects ZIP vs TAR from the first bytes and yields (name, data, error) for every image member."""
+    reader = _PushbackReader(stream)
+    magic = reader.read(4)
+    reader.unread(magic)
+    members = iter_zip_stream(reader) if magic == b'PK\x03\x04' else iter_tar_stream(reader)
+    for name, data, error in members:
+        if name.lower().endswith(image_extensions) and not name.startswith('__MACOSX/'):
+            yield name, data, error
+
+def _decode(data, img_width, img_height):
+    try:
+        return prediction_model.load_image_array(io.BytesIO(data), img_width, img_height), None
+    except Exception as e:
+        return None, f'could not decode image: {e}'
+
+def score_members(members, predict_batch, class_names, batch_size=32, num_threads=None, max_in_flight=None,
+                  similarity=None):
+    """
+    Decodes (name, data, error) members in a thread pool, scores them batch_size at a time and
+    yields one result dict per member, in archive order, as soon as its batch is done.
+    At most max_in_flight members (default 4 batches) are held in memory at once.
+    With a similarity_index.SimilarityIndex, predict_batch must return the probabilities followed by
+    the embedding in each row; images unlike any training image then get an error instead of a prediction.
+    """
+    img_width, img_height = prediction_model.img_width, prediction_model.img_height
+    max_in_flight = max_in_flight or 4 * batch_size
+    pending = deque()
+    batch = []
+
+    def flush():
+        images = [img_array for _, img_array, _ in batch if img_array is not None]
+        rows = predict_batch(np.stack(images)) if images else np.zeros((0, len(class_names)))
+        matches = iter(similarity.query(rows[:, len(class_names):]) if similarity is not None and images else [])
+        probabilities = iter(rows[:, :len(class_names)])
+        for name, img_array, error in batch:
+            if img_array is None:
+                yield {'name': name, 'error': error}
+                continue
+            probs = next(probabilities)
+            match = next(matches, None)
+            if match is not None and match['is_ood']:
+                yield {'name': name, 'error': "doesn't look like an apple leaf photo",
+                       'ood_score': match['ood_score'], 'ood_threshold': match['ood_threshold']}
+                continue
+            predicted_class = int(np.argmax(probs))
+            result = {'name': name, 'prediction': class_names[predicted_class],
+                      'confidence': float(probs[predicted_class]),
+                      'probabilities': {c: float(p) for c, p in zip(class_names, probs)}}
+            if match is not None:
+                result['ood_score'] = match['ood_score']
+            yield result
+        batch.clear()
+
+    def take_oldest():
+        name, future, error = pending.popleft()
+        if future is None:
+            batch.append((name, None, error))
+        else:
+            img_array, error = future.result()
+            batch.append((name, img_array, error))
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        for name, data, error in members:
+            future = pool.submit(_decode, data, img_width, img_height) if data is not None else None
+            pending.append((name, future, error))
+            while len(pending) >= max_in_flight:
+                take_oldest()
+                if len(batch) == batch_size:
+                    yield from flush()
+        while pending:
+            take_oldest()
+            if len(batch) == batch_size:
+                yield from flush()
+        yield from flush()
+
+def score_archive(stream, predict_batch, class_names, batch_size=32, num_threads=None):
+    """Scores every image in a ZIP/TAR stream without extracting it. Yields result dicts."""
+    return score_members(iter_archive(stream), predict_batch, class_names, batch_size, num_threads)
+
+if __name__ == '__main__':
+    from inference_server import make_predict_batch
+
+    parser = argparse.ArgumentParser(description="Score every image in a ZIP/TAR archive, results as JSON Lines")
+    parser.add_argument('archive', help="Archive path, or - to read from stdin")
+    parser.add_argument('--model', default=prediction_model.model_path)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    prediction_model.model_path = args.model
+    predict_batch = make_predict_batch(prediction_model.get_model(), args.batch_size)
+    stream = sys.stdin.buffer if args.archive == '-' else open(args.archive, 'rb')
+    with stream:
+        class_names = prediction_model.get_class_names()
+        for result in score_archive(stream, predict_batch, class_names, args.batch_size, args.threads):
+            print(json.dumps(result), flush=True)
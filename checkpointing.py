@@ -0,0 +1,339 @@
+import os
+import re
+import json
+import random
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+
+# A checkpoint directory holds the last few checkpoints, one folder each:
+#   ckpt-<global step>/arrays.npz   model variables, optimizer variables (incl. the learning rate
+#                                   ReduceLROnPlateau lowered) and EarlyStopping's best weights
+#   ckpt-<global step>/state.json   epoch and batch position, callback counters, RNG states, run settings
+# A folder only gets its final name once both files are written, so a crash mid-save leaves the
+# previous checkpoint as the latest one. completed.json is written once fit_resumable has finished the
+# run; the next run in the same folder then starts from scratch instead of resuming it.
+
+checkpoint_pattern = re.compile(r'^ckpt-(\d+)$')
+completed_name = 'completed.json'
+
+# Counters each callback resets in on_train_begin and that have to survive a restart
+callback_state_attributes = {
+    'EarlyStopping': ('wait', 'stopped_epoch', 'best', 'best_epoch'),
+    'ReduceLROnPlateau': ('wait', 'cooldown_counter', 'best'),
+    'ModelCheckpoint': ('best',),
+}
+
+def list_checkpoints(checkpoint_dir):
+    """Complete checkpoints in checkpoint_dir as (global step, path), oldest first."""
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    checkpoints = []
+    for name in os.listdir(checkpoint_dir):
+        match = checkpoint_pattern.match(name)
+        path = os.path.join(checkpoint_dir, name)
+        if match and os.path.exists(os.path.join(path, 'state.json')):
+            checkpoints.append((int(match.group(1)), path))
+    return sorted(checkpoints)
+
+def _to_json_number(value):
+    return float(value) if isinstance(value, (np.floating, np.integer)) else value
+
+def _get_rng_state():
+    numpy_state = np.random.get_state()
+    python_state = random.getstate()
+    return {'numpy': [numpy_state[0], numpy_state[1].tolist()] + list(numpy_state[2:]),
+            'python': [python_state[0], list(python_state[1]), python_state[2]],
+            'tensorflow': tf.random.get_global_generator().state.numpy().tolist()}
+
+def _set_rng_state(state):
+    name, keys, *rest = state['numpy']
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), *rest))
+    version, internal, gauss = state['python']
+    random.setstate((version, tuple(internal), gauss))
+    tf.random.get_global_generator().reset(np.array(state['tensorflow'], dtype=np.int64))
+
+def _write_checkpoint(checkpoint_dir, global_step, arrays, state, keep_last):
+    """Runs on the background thread: writes one checkpoint, then deletes all but the newest keep_last."""
+    final_path = os.path.join(checkpoint_dir, f'ckpt-{global_step:09d}')
+    tmp_path = os.path.join(checkpoint_dir, f'.tmp-ckpt-{global_step:09d}')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.savez(os.path.join(tmp_path, 'arrays.npz'), **arrays)
+    with open(os.path.join(tmp_path, 'state.json'), 'w') as f:
+        json.dump(state, f)
+    shutil.rmtree(final_path, ignore_errors=True)
+    os.replace(tmp_path, final_path)
+
+    for _, old_path in list_checkpoints(checkpoint_dir)[:-keep_last]:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+def is_completed(checkpoint_dir):
+    """True if the run checkpointed in checkpoint_dir finished (so it is not resumed)."""
+    return os.path.exists(os.path.join(checkpoint_dir, completed_name))
+
+def model_run_settings(model):
+    """
+    run_settings describing the compiled model: its variable shapes and the optimizer config, so a
+    checkpoint is never restored into a changed architecture or a run with another optimizer.
+    """
+    def without_names(value):
+        # Keras numbers the names of new optimizers (adam, adam_1, ...), so they differ between runs
+        if isinstance(value, dict):
+            return {key: without_names(item) for key, item in value.items() if key != 'name'}
+        return value
+
+    optimizer_config = without_names(model.optimizer.get_config())
+    optimizer_config['class'] = type(model.optimizer).__name__
+    return {'model_variables': [list(variable.shape) for variable in model.variables],
+            'optimizer': json.loads(json.dumps(optimizer_config, default=str))}  # as read back from state.json
+
+def saved_run_settings(checkpoint_dir):
+    """The run_settings of the latest checkpoint in checkpoint_dir, or None if there is none (or the run finished)."""
+    checkpoints = list_checkpoints(checkpoint_dir)
+    if not checkpoints or is_completed(checkpoint_dir):
+        return None
+    with open(os.path.join(checkpoints[-1][1], 'state.json'), 'r') as f:
+        return json.load(f)['run_settings']
+
+class TrainingCheckpointer(tf.keras.callbacks.Callback):
+    """
+    Saves everything needed to continue an interrupted model.fit exactly where it stopped: every
+    save_every_steps batches and at the end of every epoch. The arrays are copied on the training
+    thread (a memory copy) and written to disk on a background thread while training continues.
+    Use it through fit_resumable, which restores the latest checkpoint and restarts mid-epoch.
+    """
+
+    def __init__(self, checkpoint_dir, save_every_steps=500, keep_last=3, callbacks=(), run_settings=None):
+        """
+        Args:
+            checkpoint_dir: Folder the checkpoints are kept in (one per training run).
+            save_every_steps: Batches between checkpoints (epoch ends are always saved). None: epoch ends only.
+            keep_last: How many checkpoints to keep.
+            callbacks: EarlyStopping / ReduceLROnPlateau / ModelCheckpoint instances whose state is saved too.
+            run_settings: JSON-able settings that must match to resume (e.g. batch size, epochs,
+                model_run_settings(model)); a resume with different settings raises ValueError instead of
+                silently mixing two runs.
+        """
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.save_every_steps = save_every_steps
+        self.keep_last = max(1, keep_last)
+        self.tracked_callbacks = list(callbacks)
+        self.run_settings = run_settings or {}
+        self.steps_per_epoch = None  # set by fit_resumable
+        self.step_offset = 0  # batches of the current epoch done before this fit call
+        self.epoch = 0
+        self.global_step = 0
+        self._last_saved_step = 0
+        self._callback_state = None
+        self._callback_arrays = {}
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    # --- state capture and restore ---
+
+    def _capture_callback_state(self):
+        state = {}
+        arrays = {}
+        for index, callback in enumerate(self.tracked_callbacks):
+            attributes = callback_state_attributes.get(type(callback).__name__, ())
+            state[str(index)] = {name: _to_json_number(getattr(callback, name, None)) for name in attributes}
+            for weight_index, weight in enumerate(getattr(callback, 'best_weights', None) or []):
+                arrays[f'callback{index}_best_{weight_index}'] = np.array(weight)
+        return state, arrays
+
+    def _apply_callback_state(self):
+        for index, callback in enumerate(self.tracked_callbacks):
+            for name, value in self._callback_state.get(str(index), {}).items():
+                setattr(callback, name, value)
+            best_weights = [self._callback_arrays[key] for key in sorted(
+                (key for key in self._callback_arrays if key.startswith(f'callback{index}_best_')),
+                key=lambda key: int(key.rsplit('_', 1)[1]))]
+            if best_weights:
+                callback.best_weights = best_weights
+
+    def _optimizer_variables(self):
+        optimizer = self.model.optimizer
+        if not optimizer.built:
+            optimizer.build(self.model.trainable_variables)
+        return optimizer.variables
+
+    def save(self):
+        """Snapshots the current state and queues it to be written (waiting for the previous write first)."""
+        if self._pending is not None:
+            self._pending.result()  # also re-raises a failed write here, on the training thread
+
+        arrays = {f'model_{i}': variable.numpy() for i, variable in enumerate(self.model.variables)}
+        arrays.update({f'optimizer_{i}': variable.numpy() for i, variable in enumerate(self._optimizer_variables())})
+        callback_state, callback_arrays = self._capture_callback_state()
+        arrays.update(callback_arrays)
+        state = {'epoch': self.epoch, 'step': self.step_in_epoch, 'global_step': self.global_step,
+                 'steps_per_epoch': self.steps_per_epoch, 'callbacks': callback_state,
+                 'rng': _get_rng_state(), 'run_settings': self.run_settings}
+
+        self._pending = self._writer.submit(_write_checkpoint, self.checkpoint_dir, self.global_step, arrays, state,
+                                            self.keep_last)
+        self._last_saved_step = self.global_step
+
+    def wait(self):
+        """Blocks until the last queued checkpoint is on disk."""
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def mark_completed(self):
+        """Records that the run finished, once its last checkpoint is on disk."""
+        self.wait()
+        with open(os.path.join(self.checkpoint_dir, completed_name), 'w') as f:
+            json.dump({'global_step': self.global_step, 'run_settings': self.run_settings}, f)
+
+    def restore(self, model):
+        """
+        Loads the latest checkpoint into model (which must be compiled) and this callback.
+        The checkpoints of a finished run are deleted instead, and a new run starts.
+        Returns:
+            (epoch, step) to continue from; (0, 0) if there is no checkpoint yet.
+        """
+        checkpoints = list_checkpoints(self.checkpoint_dir)
+        if is_completed(self.checkpoint_dir):
+            print(f"The run in {self.checkpoint_dir} already finished; starting a new one")
+            for _, path in checkpoints:
+                shutil.rmtree(path, ignore_errors=True)
+            os.remove(os.path.join(self.checkpoint_dir, completed_name))
+            return 0, 0
+        if not checkpoints:
+            return 0, 0
+        global_step, path = checkpoints[-1]
+        with open(os.path.join(path, 'state.json'), 'r') as f:
+            state = json.load(f)
+        if state['run_settings'] != self.run_settings:
+            changed = sorted(key for key in set(state['run_settings']) | set(self.run_settings)
+                             if state['run_settings'].get(key) != self.run_settings.get(key))
+            raise ValueError(f"{path} was saved with different {', '.join(changed)}; "
+                             f"use a different checkpoint folder or the same settings")
+
+        self.set_model(model)
+        with np.load(os.path.join(path, 'arrays.npz')) as arrays:
+            for i, variable in enumerate(model.variables):
+                variable.assign(arrays[f'model_{i}'])
+            for i, variable in enumerate(self._optimizer_variables()):
+                variable.assign(arrays[f'optimizer_{i}'])
+            self._callback_arrays = {key: arrays[key] for key in arrays.files if key.startswith('callback')}
+        self._callback_state = state['callbacks']
+        _set_rng_state(state['rng'])
+
+        self.epoch, self.global_step = state['epoch'], state['global_step']
+        self._last_saved_step = global_step
+        print(f"Resuming from {path}: epoch {state['epoch'] + 1}, batch {state['step']}")
+        return state['epoch'], state['step']
+
+    # --- callback hooks (this callback must come after the ones it tracks) ---
+
+    @property
+    def step_in_epoch(self):
+        return self.global_step - self.epoch * self.steps_per_epoch
+
+    def on_train_begin(self, logs=None):
+        # The tracked callbacks have just reset themselves for the new fit call
+        if self._callback_state is not None:
+            self._apply_callback_state()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.global_step = self.epoch * self.steps_per_epoch + self.step_offset + batch + 1
+        if self.step_in_epoch >= self.steps_per_epoch:
+            return  # on_epoch_end saves this one, after validation
+        if self.save_every_steps and self.global_step // self.save_every_steps > self._last_saved_step // self.save_every_steps:
+            self.save()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.step_offset = 0
+        self.epoch = epoch + 1
+        self.global_step = self.epoch * self.steps_per_epoch
+        self.save()
+
+    def on_train_end(self, logs=None):
+        self._callback_state, self._callback_arrays = self._capture_callback_state()
+        self.wait()
+
+def fit_resumable(model, checkpointer, make_dataset, epochs, steps_per_epoch, callbacks=(), **fit_kwargs):
+    """
+    model.fit that continues from the latest checkpoint in checkpointer.checkpoint_dir.
+    Args:
+        model: A compiled model.
+        checkpointer: The run's TrainingCheckpointer.
+        make_dataset: make_dataset(epoch, step) -> the training batches from that position on, repeating
+            over later epochs (e.g. resumable_dataset). The same position must always give the same batches.
+        epochs: Total number of epochs of the run.
+        steps_per_epoch: Batches per epoch.
+        callbacks: The other callbacks (the tracked ones included).
+        fit_kwargs: Passed to model.fit (validation_data, class_weight, ...).
+    Returns:
+        The History of the fit, covering the epochs run by this call.
+    """
+    start_epoch, start_step = checkpointer.restore(model)
+    checkpointer.steps_per_epoch = steps_per_epoch
+    callbacks = list(callbacks) + [checkpointer]
+    history = None
+
+    def fit(dataset, initial_epoch, last_epoch, steps):
+        nonlocal history
+        result = model.fit(dataset, initial_epoch=initial_epoch, epochs=last_epoch, steps_per_epoch=steps,
+                           callbacks=callbacks, shuffle=False, **fit_kwargs)
+        if history is None:
+            history = result
+        else:
+            for key, values in result.history.items():
+                history.history.setdefault(key, []).extend(values)
+
+    if start_step and start_epoch < epochs:
+        # Finish the interrupted epoch on its own, since Keras epochs can't start part-way through
+        checkpointer.step_offset = start_step
+        fit(make_dataset(start_epoch, start_step), start_epoch, start_epoch + 1, steps_per_epoch - start_step)
+        start_epoch += 1
+    if start_epoch < epochs and not model.stop_training:
+        checkpointer.step_offset = 0
+        fit(make_dataset(start_epoch, 0), start_epoch, epochs, steps_per_epoch)
+    checkpointer.mark_completed()
+    return history
+
+def resumable_dataset(paths, labels, img_width, img_height, batch_size, seed, start_epoch=0, start_step=0,
+                      augment=None):
+    """
+    Training batches whose order and augmentation are a pure function of (seed, epoch, batch), so
+    training can restart at any batch: like augmentation.image_dataset with shuffle=True, but each
+    epoch's shuffle and each batch's augmentation seed are derived statelessly instead of from
+    iterator state. Repeats indefinitely from (start_epoch, start_step); pass steps_per_epoch to fit.
+    Returns:
+        (dataset, steps_per_epoch)
+    """
+    from augmentation import augment_batch, load_image
+
+    num_files = len(paths)
+    steps_per_epoch = -(-num_files // batch_size)
+    paths = tf.constant(paths)
+    labels = tf.constant(labels, dtype=tf.int32)
+
+    def epoch_batches(epoch):
+        epoch_seed = tf.stack([tf.constant(seed, dtype=tf.int64), epoch])
+        order = tf.random.experimental.stateless_shuffle(tf.range(num_files), seed=epoch_seed)
+        first_step = tf.where(epoch == start_epoch, tf.constant(start_step, dtype=tf.int64), 0)
+        order = order[first_step * batch_size:]  # skipped files are never read
+        files = tf.data.Dataset.from_tensor_slices((tf.gather(paths, order), tf.gather(labels, order)))
+        batches = files.map(lambda path, label: (load_image(path, img_width, img_height), label),
+                            num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size)
+        if augment is not None:
+            steps = tf.data.Dataset.range(first_step, steps_per_epoch)
+            batches = tf.data.Dataset.zip((batches, steps)).map(
+                lambda batch, step: (augment_batch(batch[0], tf.random.experimental.stateless_fold_in(epoch_seed, step),
+                                                   **augment), batch[1]),
+                num_parallel_calls=tf.data.AUTOTUNE)
+        return batches
+
+    dataset = tf.data.Dataset.range(start_epoch, np.iinfo(np.int64).max).flat_map(epoch_batches)
+    return dataset.prefetch(tf.data.AUTOTUNE), steps_per_epoch
@@ -1,5 +1,7 @@
 import os
 
+from dataset_catalog import load_catalog
+
 base_split_dir = r'C:\Users\siddh\Projects\New folder\apple_disease_split'  # Replace with your path
 
 print("base_split_dir:", base_split_dir) #Debugging
@@ -9,12 +11,9 @@ for split_name in ['train', 'val', 'test']:
     print(f"--- {split_name.upper()} DIRECTORY ---")
 
     if os.path.exists(split_dir): #Checking to see if the path exists
-        for class_name in os.listdir(split_dir):
-            class_dir = os.path.join(split_dir, class_name)
-            if os.path.isdir(class_dir):  # Make sure it's a directory
-                num_images = len(os.listdir(class_dir))
-                print(f"  {class_name}: {num_images} images")
-            else:
-                print(f"  {class_name} is not a directory") #Debugging
+        # Cached in split_dir; only class folders that changed since the last run are listed again
+        catalog = load_catalog(split_dir, read_dimensions=False)
+        for class_name, num_images in catalog.counts().items():
+            print(f"  {class_name}: {num_images} images")
     else:
-        print(f"  {split_dir} does not exist") #Debugging
\ No newline at end of file
+        print(f"  {split_dir} does not exist") #Debugging
@@ -1,5 +1,11 @@
 import os
-import cv2
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from image_io import read_image_header, decode_reduced
 
 cleaned_dataset_path = r'C:\Users\siddh\Projects\New folder\apple_disease_cleaned' # path to new directory
 original_dataset_path = r'C:\Users\siddh\Downloads\kaggle-apple-disease-dataset\datasets\train' # path to old directory
@@ -7,26 +13,158 @@ original_dataset_path = r'C:\Users\siddh\Downloads\kaggle-apple-disease-dataset\
 # these are the valid paths for different classes of diseases
 valid_classes = ["apple_scab", "black_rot", "cedar_apple_rust", "healthy"]
 
-# this creates the new directory
-os.makedirs(cleaned_dataset_path, exist_ok = True)
-
-# goes through the image path and copies the new files to the new directory
-for folder in valid_classes:
-    new_folder_path = os.path.join(cleaned_dataset_path, folder)
-    old_folder_path = os.path.join(original_dataset_path, folder)
-
-    # checks to see if the folder exists
-    if os.path.exists(old_folder_path):
-        os.makedirs(new_folder_path, exist_ok = True)
-
-        for image in os.listdir(old_folder_path):
-            old_image_path = os.path.join(old_folder_path, image)
-            new_image_path = os.path.join(new_folder_path, image)
-            try:
-                img = cv2.imread(old_image_path)
-                if img is not None:
-                    cv2.imwrite(new_image_path, img)
-            except:
-                print("Image {} not copied".format(image))
-    else:
-        print("Folder {} does not exist in original dataset".format(folder))
\ No newline at end of file
+# formats the training scripts can read
+valid_formats = ('JPEG', 'PNG', 'BMP', 'TIFF', 'WEBP')
+
+# images smaller than this on either side are rejected
+min_image_size = 32
+
+def validate_image(image_path, min_size=min_image_size, decode=False):
+    """
+    Checks an image without a full decode: header, format, size and (for JPEGs) the end marker.
+    With decode=True the image is also decoded at 1/8 resolution, which catches corrupt image data too.
+    Returns:
+        None if the image is usable, otherwise a (reason, detail) tuple.
+    """
+    try:
+        image_format, width, height, complete = read_image_header(image_path)
+    except ValueError as e:
+        return 'unreadable', str(e)
+    except OSError as e:
+        return 'io_error', str(e)
+
+    if image_format not in valid_formats:
+        return 'unsupported_format', image_format
+    if width < min_size or height < min_size:
+        return 'too_small', f'{width}x{height}'
+    if not complete:
+        return 'truncated', 'JPEG end marker missing'
+    if decode and decode_reduced(image_path) is None:
+        return 'decode_failed', 'reduced-resolution decode failed'
+    return None
+
+def _place_file(source_path, target_path, link):
+    """Hardlinks (or byte-copies) source_path to target_path. Returns 'linked', 'copied' or 'unchanged'."""
+    if os.path.exists(target_path):
+        if os.path.samefile(source_path, target_path):
+            return 'unchanged'
+        source_stat, target_stat = os.stat(source_path), os.stat(target_path)
+        if not link and source_stat.st_size == target_stat.st_size and source_stat.st_mtime_ns == target_stat.st_mtime_ns:
+            return 'unchanged'
+        os.remove(target_path)
+
+    if link:
+        try:
+            os.link(source_path, target_path)
+            return 'linked'
+        except OSError:
+            pass  # different drive, or a filesystem without hardlinks: fall back to copying
+    shutil.copy2(source_path, target_path)  # keeps the mtime, so incremental preprocessing still works
+    return 'copied'
+
+def _clean_worker(task):
+    """Runs in a pool process: validates one image and places it in the cleaned dataset."""
+    source_path, target_path, link, min_size, decode = task
+    rejection = validate_image(source_path, min_size, decode)
+    if rejection is not None:
+        return 'rejected', rejection
+    try:
+        return _place_file(source_path, target_path, link), None
+    except OSError as e:
+        return 'rejected', ('io_error', str(e))
+
+def clean_dataset(original_path, cleaned_path, classes=valid_classes, workers=None, link=True,
+                  decode=False, min_size=min_image_size, report_path=None):
+    """
+    Validates every image of the given classes and hardlinks or copies the good ones to cleaned_path/<class>/.
+    The image bytes are never re-encoded, so the cleaned files are identical to the originals.
+    Args:
+        original_path: Directory with one sub-folder of images per class.
+        cleaned_path: Directory to build the cleaned dataset in.
+        classes: Class folders to take from original_path.
+        workers: Number of worker processes (defaults to the number of CPUs).
+        link: Hardlink files when possible instead of copying them.
+        decode: Also decode each image at reduced resolution to catch corrupt image data.
+        min_size: Smallest accepted width/height in pixels.
+        report_path: Where to write the JSON report (defaults to <cleaned_path>_report.json).
+    Returns:
+        The report dict: counts, timing and a list of rejected files with reasons.
+    """
+    start_time = time.perf_counter()
+    os.makedirs(cleaned_path, exist_ok=True)
+
+    tasks = []
+    missing_classes = []
+    for folder in classes:
+        old_folder_path = os.path.join(original_path, folder)
+        if not os.path.isdir(old_folder_path):
+            print("Folder {} does not exist in original dataset".format(folder))
+            missing_classes.append(folder)
+            continue
+
+        new_folder_path = os.path.join(cleaned_path, folder)
+        os.makedirs(new_folder_path, exist_ok=True)
+        for entry in os.scandir(old_folder_path):
+            if entry.is_file():
+                tasks.append((entry.path, os.path.join(new_folder_path, entry.name), link, min_size, decode))
+
+    counts = {'linked': 0, 'copied': 0, 'unchanged': 0, 'rejected': 0}
+    rejected = []
+    total_bytes = 0
+    if tasks:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for task, (outcome, rejection) in zip(tasks, pool.map(_clean_worker, tasks, chunksize=chunksize)):
+                counts[outcome] += 1
+                source_path = task[0]
+                if rejection is not None:
+                    reason, detail = rejection
+                    rejected.append({'path': source_path,
+                                     'class': os.path.basename(os.path.dirname(source_path)),
+                                     'reason': reason, 'detail': detail})
+                    print("Image {} not copied: {} ({})".format(source_path, reason, detail))
+                elif outcome != 'unchanged':
+                    total_bytes += os.path.getsize(source_path)
+
+    elapsed = time.perf_counter() - start_time
+    reasons = {}
+    for item in rejected:
+        reasons[item['reason']] = reasons.get(item['reason'], 0) + 1
+    report = {
+        'source': original_path,
+        'destination': cleaned_path,
+        'params': {'link': link, 'decode': decode, 'min_size': min_size},
+        'counts': dict(counts, total=len(tasks)),
+        'rejected_by_reason': reasons,
+        'missing_classes': missing_classes,
+        'seconds': elapsed,
+        'images_per_sec': len(tasks) / elapsed if elapsed > 0 else 0.0,
+        'mb_per_sec': total_bytes / 2**20 / elapsed if elapsed > 0 else 0.0,
+        'rejected': rejected,
+    }
+
+    report_path = report_path or cleaned_path.rstrip('\\/') + '_report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{original_path}: {counts['linked']} linked, {counts['copied']} copied, {counts['unchanged']} unchanged, "
+          f"{counts['rejected']} rejected in {elapsed:.1f}s ({report['images_per_sec']:.1f} images/sec)")
+    print(f"Report written to {report_path}")
+    return report
+
+# The guard keeps worker processes (which re-import this module on Windows) from re-running the script
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate the raw dataset and hardlink/copy the good images")
+    parser.add_argument('--source', default=original_dataset_path)
+    parser.add_argument('--dest', default=cleaned_dataset_path)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--copy', action='store_true', help="Byte-copy files instead of hardlinking them")
+    parser.add_argument('--decode', action='store_true',
+                        help="Also decode every image at 1/8 resolution (slower, catches corrupt image data)")
+    parser.add_argument('--min-size', type=int, default=min_image_size)
+    parser.add_argument('--report', default=None, help="Report path (defaults to <dest>_report.json)")
+    args = parser.parse_args()
+
+    clean_dataset(args.source, args.dest, valid_classes, args.workers, link=not args.copy,
+                  decode=args.decode, min_size=args.min_size, report_path=args.report)
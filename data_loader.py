@@ -1,9 +1,14 @@
 import os
+import json
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
 from tensorflow.keras.optimizers import Adam
+from shard_dataset import ShardDataset, is_packed
+from image_io import DECODE_PARAMS
+from split_manifest import manifest_files
+from training_config import load_training_config, apply_precision_policy, compile_model, ThroughputLogger
 
 # Define data directories
 base_dir = r'C:\Users\siddh\Projects\New folder\preprocessed_data'
@@ -11,36 +16,160 @@ train_dir = os.path.join(base_dir, 'train')
 val_dir = os.path.join(base_dir, 'val')
 test_dir = os.path.join(base_dir, 'test')
 
+# Set to a manifest from split_manifest.py to take the splits from it instead of the train/val/test
+# folders; all_dir is then the preprocessed tree of the whole cleaned dataset.
+split_manifest = None
+split_fold = None  # cross-validation fold to hold out as validation data
+all_dir = os.path.join(base_dir, 'all')
+
 # Define image parameters
 img_width, img_height = 224, 224
 num_classes = 4  # apple_scab, black_rot, cedar_apple_rust, healthy
 batch_size = 32
 epochs = 10
 
-def load_data(data_dir, img_width, img_height, batch_size):
+def list_files(data_dir, manifest=None, split=None, fold=None):
     """
-    Loads the preprocessed image data from .npy files.
-    Args:
-        data_dir: Path to the directory containing the image data.
-        img_width: Width of the images.
-        img_height: Height of the images.
-        batch_size: The batch size for training.
-    Returns:
-        A tf.data.Dataset object containing the images and labels.
+    Lists the .npy paths and class indices under data_dir/<class>/.
+    With a split manifest (see split_manifest.py), data_dir is the preprocessed tree of the whole
+    cleaned dataset and only the files of the given split/fold are listed.
     """
+    if manifest is not None:
+        image_paths, labels, _ = manifest_files(manifest, split, data_dir, '.npy', fold)
+        return image_paths, labels
+
     image_paths = []
     labels = []
-    class_names = os.listdir(data_dir)
-    num_classes = len(class_names)
+    # Sorted, like shard_dataset.write_shards, so a class gets the same index however it is loaded
+    class_names = sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
 
     for class_index, class_name in enumerate(class_names):
         class_path = os.path.join(data_dir, class_name)
-        if not os.path.isdir(class_path):
-            continue
         for image_name in os.listdir(class_path):
             image_path = os.path.join(class_path, image_name)
             image_paths.append(image_path)
             labels.append(class_index)
+    return image_paths, labels
+
+def npy_layout(image_path):
+    """
+    Reads the header of one .npy file.
+    Returns:
+        (header_size, shape) so the raw float32 payload can be sliced out with tf.strings.substr.
+    """
+    with open(image_path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        header_size = f.tell()
+    if dtype != np.dtype('<f4') or fortran_order:
+        raise ValueError(f"{image_path}: expected a C-ordered little-endian float32 array, got {dtype}")
+    return header_size, shape
+
+def check_cache_dir(cache_dir):
+    """
+    Makes sure the tf.data caches in cache_dir were written from images decoded the current way
+    (image_io.DECODE_PARAMS), and records that decode in a new cache_dir.
+    Raises:
+        ValueError: If cache_dir holds caches of another (or an unrecorded) decode.
+    """
+    meta_path = os.path.join(cache_dir, 'cache_meta.json')
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            decode = json.load(f).get('decode')
+        if decode != DECODE_PARAMS:
+            raise ValueError(f"{cache_dir} caches images decoded differently ({decode}); "
+                             f"delete it or use another cache_dir")
+    elif os.listdir(cache_dir):
+        raise ValueError(f"{cache_dir} holds caches that don't record how the images were decoded; "
+                         f"delete it or use another cache_dir")
+    else:
+        with open(meta_path, 'w') as f:
+            json.dump({'decode': DECODE_PARAMS}, f)
+
+def load_data(data_dir, img_width, img_height, batch_size, seed=None, cache_dir=None, use_snapshot=False,
+              shuffle_buffer=2048, manifest=None, split=None, fold=None):
+    """
+    Loads the preprocessed image data with a graph-only tf.data pipeline (no Python in the loop).
+    Args:
+        data_dir: Path to the directory containing the image data (.npy class folders or packed shards).
+        img_width: Width of the images.
+        img_height: Height of the images.
+        batch_size: The batch size for training.
+        seed: Shuffle seed; the same seed gives the same order in every run.
+        cache_dir: If set, decoded images are cached on disk here after the first epoch.
+        use_snapshot: Use Dataset.snapshot instead of Dataset.cache for the on-disk copy.
+        shuffle_buffer: Shuffle buffer (in images) when shuffling has to happen after decoding.
+        manifest: Optional split manifest; data_dir then holds every class of the whole dataset.
+        split: 'train', 'val' or 'test' (with manifest).
+        fold: Cross-validation fold (with manifest).
+    Returns:
+        A tf.data.Dataset object containing the images and labels.
+    """
+    if is_packed(data_dir) and manifest is None:
+        # Packed shards (see shard_dataset.py): fixed-size uint8 records read sequentially
+        packed = ShardDataset(data_dir)
+        shard_paths = [os.path.join(data_dir, name) for name in packed.shard_files]
+        records = tf.data.FixedLengthRecordDataset(shard_paths, packed.record_bytes)
+        dataset = tf.data.Dataset.zip((records, tf.data.Dataset.from_tensor_slices(packed.labels)))
+        image_shape = packed.image_shape
+
+        def decode(record, label):
+            return tf.reshape(tf.io.decode_raw(record, tf.uint8), image_shape), label
+
+        # Records can only be read in order, so they are shuffled after decoding
+        shuffle_paths = False
+    else:
+        image_paths, labels = list_files(data_dir, manifest, split, fold)
+        if not image_paths:
+            raise ValueError(f"No .npy images found for {split or 'this split'} in {data_dir}")
+        header_size, image_shape = npy_layout(image_paths[0])
+        payload_size = int(np.prod(image_shape)) * 4
+        # Shuffling paths is free; only a cached dataset has to be shuffled after decoding
+        shuffle_paths = cache_dir is None
+
+        def decode(image_path, label):
+            raw = tf.strings.substr(tf.io.read_file(image_path), header_size, payload_size)
+            image = tf.reshape(tf.io.decode_raw(raw, tf.float32, little_endian=True), image_shape)
+            if not shuffle_paths:
+                # The .npy files hold uint8 / 255, so this is exact and caches/shuffles a quarter of the bytes
+                image = tf.cast(tf.round(image * 255.0), tf.uint8)
+            return image, label
+
+        dataset = tf.data.Dataset.from_tensor_slices((image_paths, labels))
+        if shuffle_paths:
+            dataset = dataset.shuffle(len(image_paths), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.map(decode, num_parallel_calls=tf.data.AUTOTUNE, deterministic=seed is not None)
+
+    if cache_dir:
+        check_cache_dir(cache_dir)
+        cache_name = os.path.basename(os.path.normpath(data_dir))
+        if manifest is not None:
+            cache_name = f'{split}' if fold is None else f'{split}-fold{fold}'  # the splits share one data_dir
+        cache_path = os.path.join(cache_dir, cache_name)
+        dataset = dataset.snapshot(cache_path) if use_snapshot else dataset.cache(cache_path)
+
+    if not shuffle_paths:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.batch(batch_size)
+    if not shuffle_paths:
+        # Shuffled as uint8 (~300 MB of buffer at 224x224 instead of ~1.2 GB), normalized per batch
+        dataset = dataset.map(lambda images, labels: (tf.cast(images, tf.float32) / 255.0, labels),
+                              num_parallel_calls=tf.data.AUTOTUNE, deterministic=seed is not None)
+    dataset = dataset.prefetch(tf.data.AUTOTUNE)
+    return dataset
+
+def load_data_numpy_function(data_dir, img_width, img_height, batch_size):
+    """
+    The previous loader, which reads every .npy through tf.numpy_function.
+    Kept as the baseline for bench_input_pipeline.py.
+    """
+    image_paths, labels = list_files(data_dir)
 
     def load_and_preprocess(image_path, label):
         """Loads and preprocesses a single image."""
@@ -68,46 +197,60 @@ def load_data(data_dir, img_width, img_height, batch_size):
 
     return dataset
 
-# Load the training, validation, and test data
-train_data = load_data(train_dir, img_width, img_height, batch_size)
-validation_data = load_data(val_dir, img_width, img_height, batch_size)
-test_data = load_data(test_dir, img_width, img_height, batch_size)
-
-# Build the CNN model
-model = Sequential([
-    Conv2D(32, (3, 3), activation='relu', input_shape=(img_width, img_height, 3)),
-    MaxPooling2D((2, 2)),
-    Conv2D(64, (3, 3), activation='relu'),
-    MaxPooling2D((2, 2)),
-    Conv2D(128, (3, 3), activation='relu'),
-    MaxPooling2D((2, 2)),
-    Flatten(),
-    Dense(512, activation='relu'),
-    Dropout(0.5),
-    Dense(num_classes, activation='softmax')  # Output layer with softmax
-])
-
-# Compile the model
-model.compile(optimizer=Adam(learning_rate=0.0001),
-              loss='sparse_categorical_crossentropy',  # Use sparse_categorical_crossentropy
-              metrics=['accuracy'])
-
-# Print the model summary
-model.summary()
-
-# Train the model
-history = model.fit(
-    train_data,
-    # steps_per_epoch=len(os.listdir(train_dir)) // batch_size,
-    epochs=epochs,
-    validation_data=validation_data,
-    # validation_steps=len(os.listdir(val_dir)) // batch_size
-)
-
-# Evaluate the model on the test set
-loss, accuracy = model.evaluate(test_data)
-print(f"Test Loss: {loss}")
-print(f"Test Accuracy: {accuracy}")
-
-# Save the model
-model.save('apple_disease_model.keras')  # Saves the model in .keras format
\ No newline at end of file
+if __name__ == '__main__':
+    # XLA, steps_per_execution, mixed precision and batch size come from training_config.json (see training_config.py)
+    training_config = load_training_config()
+    batch_size = training_config['batch_size'] or batch_size
+    apply_precision_policy(training_config)
+
+    # Load the training, validation, and test data
+    if split_manifest:
+        train_data = load_data(all_dir, img_width, img_height, batch_size,
+                               manifest=split_manifest, split='train', fold=split_fold)
+        validation_data = load_data(all_dir, img_width, img_height, batch_size,
+                                    manifest=split_manifest, split='val', fold=split_fold)
+        test_data = load_data(all_dir, img_width, img_height, batch_size, manifest=split_manifest, split='test')
+    else:
+        train_data = load_data(train_dir, img_width, img_height, batch_size)
+        validation_data = load_data(val_dir, img_width, img_height, batch_size)
+        test_data = load_data(test_dir, img_width, img_height, batch_size)
+
+    # Build the CNN model
+    model = Sequential([
+        Conv2D(32, (3, 3), activation='relu', input_shape=(img_width, img_height, 3)),
+        MaxPooling2D((2, 2)),
+        Conv2D(64, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Conv2D(128, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Flatten(),
+        Dense(512, activation='relu'),
+        Dropout(0.5),
+        Dense(num_classes, activation='softmax', dtype='float32')  # Output layer with softmax, float32 under mixed precision
+    ])
+
+    # Compile the model
+    compile_model(model, training_config, Adam(learning_rate=0.0001),
+                  loss='sparse_categorical_crossentropy',  # Use sparse_categorical_crossentropy
+                  metrics=['accuracy'])
+
+    # Print the model summary
+    model.summary()
+
+    # Train the model
+    history = model.fit(
+        train_data,
+        # steps_per_epoch=len(os.listdir(train_dir)) // batch_size,
+        epochs=epochs,
+        validation_data=validation_data,
+        # validation_steps=len(os.listdir(val_dir)) // batch_size
+        callbacks=[ThroughputLogger(training_config, batch_size)],
+    )
+
+    # Evaluate the model on the test set
+    loss, accuracy = model.evaluate(test_data)
+    print(f"Test Loss: {loss}")
+    print(f"Test Accuracy: {accuracy}")
+
+    # Save the model
+    model.save('apple_disease_model.keras')  # Saves the model in .keras format
\ No newline at end of file
@@ -1,28 +1,111 @@
 import os
-import cv2
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from image_io import DECODE_PARAMS, decode_and_resize
 
-def preprocess_image(image_path, target_size=(224, 224)):
+# Name of the file (inside each save_dir) that remembers what was already preprocessed
+MANIFEST_NAME = '.preprocess_manifest.json'
+
+def load_resized_image(image_path, target_size=(224, 224)):
+    """
+    Loads and resizes an image to RGB uint8 (also used by the packed shard format). Uses the same
+    decode as serving (image_io.decode_and_resize), so the model trains on the pixels it is later shown.
+    """
     try:
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"Error: Could not load image at {image_path}")
-            return None
-
-        image = cv2.resize(image, target_size)
-        image = image.astype('float32') / 255.0  # Normalize to [0, 1]
-        return image
+        return decode_and_resize(image_path, target_size)
+    except ValueError as e:
+        print(f"Error: Could not load image at {image_path}: {e}")
+        return None
     except Exception as e:
         print(f"Error processing image {image_path}: {e}")
         return None
 
+def preprocess_image(image_path, target_size=(224, 224)):
+    image = load_resized_image(image_path, target_size)
+    if image is None:
+        return None
+    return image.astype('float32') / 255.0  # Normalize to [0, 1]
+
 base_dir = r'C:\Users\siddh\Projects\New folder\apple_disease_split'  # ***CORRECT PATH TO ORIGINAL IMAGES***
 train_dir = os.path.join(base_dir, 'train')
 val_dir = os.path.join(base_dir, 'val')
 test_dir = os.path.join(base_dir, 'test')
 
-def preprocess_and_save(data_dir, save_dir, target_size=(224, 224)):
+def _file_sha1(path, chunk_size=1 << 20):
+    """Hashes a file's bytes without reading it into memory at once."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _load_manifest(manifest_path, params):
+    """Returns the per-file records of the previous run, or {} if they can't be reused."""
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('params') != params:
+        # Different target size/format/decode: every output is stale
+        return {}
+    return manifest.get('files', {})
+
+def _save_manifest(manifest_path, params, files):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'params': params, 'files': files}, f)
+    os.replace(tmp_path, manifest_path)  # never leave a half-written manifest behind
+
+def _is_unchanged(image_path, record, signature, use_hash):
+    """Checks a source file against what was recorded for it on the last run."""
+    if record is None:
+        return False
+    if record['size'] == signature['size'] and record['mtime_ns'] == signature['mtime_ns']:
+        return True
+    if use_hash and 'sha1' in record and record['size'] == signature['size']:
+        # Touched or re-copied but same bytes: keep the old output
+        signature['sha1'] = _file_sha1(image_path)
+        return signature['sha1'] == record['sha1']
+    return False
+
+def _preprocess_worker(task):
+    """Runs in a pool process: preprocesses one image and writes its .npy."""
+    image_path, save_image_path, target_size = task
+    processed_image = preprocess_image(image_path, target_size)
+    if processed_image is None:
+        return False
+    np.save(save_image_path, processed_image)
+    return True
+
+def preprocess_and_save(data_dir, save_dir, target_size=(224, 224), workers=None, use_hash=False):
+    """
+    Preprocesses every image under data_dir/<class>/ into save_dir/<class>/<name>.npy.
+    Images are processed in a pool of worker processes and only sources that are new or
+    changed since the last run (by size/mtime, optionally by content hash) are redone.
+    Args:
+        data_dir: Directory with one sub-folder of images per class.
+        save_dir: Directory to write the .npy files to.
+        target_size: The desired size of the images (width, height).
+        workers: Number of worker processes (defaults to the number of CPUs).
+        use_hash: Also compare a SHA-1 of the file bytes when size/mtime differ.
+    Returns:
+        A dict with the processed/skipped/failed/removed counts and the images/sec rate.
+    """
     os.makedirs(save_dir, exist_ok=True)
+    start_time = time.perf_counter()
+
+    params = {'target_size': list(target_size), 'dtype': 'float32', 'decode': DECODE_PARAMS}
+    manifest_path = os.path.join(save_dir, MANIFEST_NAME)
+    previous = _load_manifest(manifest_path, params)
+    current = {}
+    tasks = []
+    task_keys = []
+    task_signatures = []
+    output_paths = set()  # the .npy of every source image present now (normcased)
 
     for class_name in os.listdir(data_dir):
         class_path = os.path.join(data_dir, class_name)
@@ -35,13 +118,56 @@ def preprocess_and_save(data_dir, save_dir, target_size=(224, 224)):
 
         for image_name in os.listdir(class_path):
             image_path = os.path.join(class_path, image_name)
-            processed_image = preprocess_image(image_path, target_size)
+            save_image_path = os.path.join(save_class_dir, os.path.splitext(image_name)[0] + '.npy')
+            key = class_name + '/' + image_name
+            output_paths.add(os.path.normcase(save_image_path))
+            stat = os.stat(image_path)
+            signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+            record = previous.get(key)
+            if os.path.exists(save_image_path) and _is_unchanged(image_path, record, signature, use_hash):
+                current[key] = dict(record, mtime_ns=signature['mtime_ns'])
+                continue
+
+            if use_hash and 'sha1' not in signature:
+                signature['sha1'] = _file_sha1(image_path)
+            tasks.append((image_path, save_image_path, target_size))
+            task_keys.append(key)
+            task_signatures.append(signature)
+
+    skipped = len(current)
+    failed = 0
+    if tasks:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_preprocess_worker, tasks, chunksize=chunksize)
+            for (image_path, _, _), key, signature, ok in zip(tasks, task_keys, task_signatures, results):
+                if ok:
+                    current[key] = signature
+                else:
+                    failed += 1
+                    print(f"Warning: Image {image_path} could not be preprocessed. Skipping.")
+
+    # Drop outputs whose source image has been removed since the last run (unless a current image,
+    # e.g. a.png replacing a.jpg, or a failed retry, writes to the same .npy)
+    removed = 0
+    for key in set(previous) - set(current):
+        class_name, image_name = key.split('/', 1)
+        stale_path = os.path.join(save_dir, class_name, os.path.splitext(image_name)[0] + '.npy')
+        if os.path.normcase(stale_path) not in output_paths and os.path.exists(stale_path):
+            os.remove(stale_path)
+            removed += 1
+
+    _save_manifest(manifest_path, params, current)
 
-            if processed_image is not None:
-                save_image_path = os.path.join(save_class_dir, os.path.splitext(image_name)[0] + '.npy')
-                np.save(save_image_path, processed_image)
-            else:
-                print(f"Warning: Image {image_path} could not be preprocessed. Skipping.")
+    elapsed = time.perf_counter() - start_time
+    processed = len(tasks) - failed
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"{data_dir}: {processed} processed, {skipped} unchanged, {failed} failed, "
+          f"{removed} removed in {elapsed:.1f}s ({rate:.1f} images/sec)")
+    return {'processed': processed, 'skipped': skipped, 'failed': failed,
+            'removed': removed, 'seconds': elapsed, 'images_per_sec': rate}
 
 # ***CORRECT PATHS TO SAVE PREPROCESSED DATA***
 preprocessed_base_dir = r'C:\Users\siddh\Projects\New folder\preprocessed_data' # Parent folder of train, val, test
@@ -49,8 +175,10 @@ preprocessed_train_dir = os.path.join(preprocessed_base_dir, 'train')
 preprocessed_val_dir = os.path.join(preprocessed_base_dir, 'val')
 preprocessed_test_dir = os.path.join(preprocessed_base_dir, 'test')
 
-preprocess_and_save(train_dir, preprocessed_train_dir)
-preprocess_and_save(val_dir, preprocessed_val_dir)
-preprocess_and_save(test_dir, preprocessed_test_dir)
+# The guard keeps worker processes (which re-import this module on Windows) from re-running the script
+if __name__ == '__main__':
+    preprocess_and_save(train_dir, preprocessed_train_dir)
+    preprocess_and_save(val_dir, preprocessed_val_dir)
+    preprocess_and_save(test_dir, preprocessed_test_dir)
 
-print("Finished preprocessing")
\ No newline at end of file
+    print("Finished preprocessing")
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
 import shutil
-import random
+
+from split_manifest import assign_splits, read_manifest, scan_dataset, summarize, write_manifest
 
 # Define the paths (USE RAW STRINGS)
 cleaned_dataset_path = r'C:\Users\siddh\Projects\New folder\apple_disease_cleaned'
@@ -16,60 +17,70 @@ print("train_dir:", train_dir)
 print("val_dir:", val_dir)
 print("test_dir:", test_dir)
 
-# Create the base directory and subdirectories (train, val, test)
-os.makedirs(train_dir, exist_ok=True)
-os.makedirs(val_dir, exist_ok=True)
-os.makedirs(test_dir, exist_ok=True)
-
-
-def divide_dataset(cleaned_dataset_path, train_dir, val_dir, test_dir, split_ratio):
-    """Divides the dataset into training, validation, and test sets."""
-
-    for folder in os.listdir(cleaned_dataset_path):
-        folder_path = os.path.join(cleaned_dataset_path, folder)
-        if not os.path.isdir(folder_path): #skips the directory if it is not valid
-            print(f"Skipping non-directory: {folder_path}")
-            continue # moves onto the next folder
-
+def _link_or_copy(src_path, dst_path):
+    if os.path.exists(dst_path):
+        return
+    try:
+        os.link(src_path, dst_path)  # no extra disk space, and the cleaned dataset stays intact
+    except OSError:
+        shutil.copy2(src_path, dst_path)
+
+
+def divide_dataset(cleaned_dataset_path, train_dir, val_dir, test_dir, split_ratio, seed=0, manifest_path=None):
+    """
+    Divides the dataset into training, validation, and test sets.
+    The split is a seeded, stratified manifest (see split_manifest.py) written next to the cleaned
+    images; the split folders are then filled with hardlinks (copies where links aren't possible)
+    for the scripts that still read train/val/test folders. Nothing is moved, so this can be re-run.
+    Every file this script puts in a split folder is <split>/<class>/<name> of a manifest row, so on a
+    re-run the previous manifest tells which split files it made; those that now belong elsewhere are
+    removed (links and copies alike), and a split file no manifest row accounts for stops the re-split.
+    """
+    manifest_path = manifest_path or os.path.join(cleaned_dataset_path, 'split_manifest.csv')
+    split_dirs = {'train': train_dir, 'val': val_dir, 'test': test_dir}
+    split_files = [(class_name, image_name, os.path.join(split_dir, class_name, image_name))
+                   for split_dir in split_dirs.values() if os.path.isdir(split_dir)
+                   for class_name in os.listdir(split_dir) if os.path.isdir(os.path.join(split_dir, class_name))
+                   for image_name in os.listdir(os.path.join(split_dir, class_name))]
+    previous = read_manifest(manifest_path) if os.path.exists(manifest_path) else []
+    made_here = {tuple(record['path'].split('/', 1)) for record in previous}
+    # A split made by the old version of this script moved the images, so the split folders may hold the
+    # only copies of images missing from the cleaned folder. Re-splitting would lose them.
+    unknown = [split_path for class_name, image_name, split_path in split_files
+               if (class_name, image_name) not in made_here]
+    if unknown:
+        raise ValueError(f"{len(unknown)} files in the split folders (e.g. {unknown[0]}) are not in {manifest_path}; "
+                         f"move them back into the cleaned dataset (or delete them) before re-splitting")
+    records = scan_dataset(cleaned_dataset_path)
+    if not records:
+        raise ValueError(f"{cleaned_dataset_path} has no images")
+    records = assign_splits(records, seed, split_ratio)
+    write_manifest(manifest_path, records)
+    summarize(records)
+
+    # Remove what a previous split put elsewhere (or made of images since deleted from the cleaned
+    # dataset), so an image is never in two splits
+    wanted = {os.path.join(split_dirs[record['split']], record['class'], os.path.basename(record['path']))
+              for record in records}
+    for _, _, split_path in split_files:
+        if split_path not in wanted:
+            os.remove(split_path)
+
+    for record in records:
         # Create subdirectories for each class in the train, val, and test directories
-        train_class_dir = os.path.join(train_dir, folder)
-        val_class_dir = os.path.join(val_dir, folder)
-        test_class_dir = os.path.join(test_dir, folder)
-        os.makedirs(train_class_dir, exist_ok=True)
-        os.makedirs(val_class_dir, exist_ok=True)
-        os.makedirs(test_class_dir, exist_ok=True)
-
-        # Get the list of image files in the folder and shuffle it
-        image_files = os.listdir(folder_path)
-        random.shuffle(image_files)
-
-        # Calculate the split indices
-        train_count = int(len(image_files) * split_ratio[0])
-        val_count = int(len(image_files) * (split_ratio[0] + split_ratio[1])) # the total number of train and test data
-
-        # Split the images into train, val, and test sets
-        train_images = image_files[:train_count]
-        val_images = image_files[train_count:val_count]
-        test_images = image_files[val_count:]
-
-        # Copy images to the respective directories
-        for image in train_images:
-            src_path = os.path.join(folder_path, image)
-            dst_path = os.path.join(train_class_dir, image)
-            shutil.move(src_path, dst_path)
-
-        for image in val_images:
-            src_path = os.path.join(folder_path, image)
-            dst_path = os.path.join(val_class_dir, image)
-            shutil.move(src_path, dst_path)
+        class_dir = os.path.join(split_dirs[record['split']], record['class'])
+        os.makedirs(class_dir, exist_ok=True)
+        src_path = os.path.join(cleaned_dataset_path, *record['path'].split('/'))
+        _link_or_copy(src_path, os.path.join(class_dir, os.path.basename(src_path)))
 
-        for image in test_images:
-            src_path = os.path.join(folder_path, image)
-            dst_path = os.path.join(test_class_dir, image)
-            shutil.move(src_path, dst_path)
 
+if __name__ == '__main__':
+    # Create the base directory and subdirectories (train, val, test)
+    os.makedirs(train_dir, exist_ok=True)
+    os.makedirs(val_dir, exist_ok=True)
+    os.makedirs(test_dir, exist_ok=True)
 
-# Call the function to divide the dataset
-divide_dataset(cleaned_dataset_path, train_dir, val_dir, test_dir, split_ratio)
+    # Call the function to divide the dataset
+    divide_dataset(cleaned_dataset_path, train_dir, val_dir, test_dir, split_ratio)
 
-print("Finished splitting the dataset.") #Debugging code
\ No newline at end of file
+    print("Finished splitting the dataset.") #Debugging code----
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from image_io import read_image_header
+
+# Name of the file (inside each dataset root) that stores the catalog between runs
+CATALOG_NAME = '.dataset_catalog.json'
+CATALOG_VERSION = 1
+
+# Files counted as images (flow_from_directory-style folders of images, one folder per class)
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+def _scan_class(class_path, previous, read_dimensions):
+    """
+    Lists one class folder with os.scandir and returns {name: [size, mtime_ns, width, height]}.
+    Files whose size and mtime match the previous catalog keep their recorded dimensions.
+    """
+    files = {}
+    for entry in os.scandir(class_path):
+        if not entry.name.lower().endswith(image_extensions) or not entry.is_file():
+            continue
+        stat = entry.stat()
+        record = previous.get(entry.name)
+        if (record is not None and record[0] == stat.st_size and record[1] == stat.st_mtime_ns
+                and (record[2] is not None or not read_dimensions)):
+            files[entry.name] = record
+            continue
+        width = height = None  # not read
+        if read_dimensions:
+            try:
+                _, width, height, _ = read_image_header(entry.path)
+            except (OSError, ValueError):
+                width = height = 0  # unreadable images are still counted; data_clean.py reports them
+        files[entry.name] = [stat.st_size, stat.st_mtime_ns, width, height]
+    return files
+
+class DatasetCatalog:
+    """
+    File counts, sizes and image dimensions of a <root>/<class>/<image> dataset.
+    Built in parallel with os.scandir and saved in <root>/.dataset_catalog.json. A refresh only
+    rescans class folders whose modification time changed (adding, removing or renaming a file
+    changes its folder's mtime), so on an unchanged dataset it costs one stat per class.
+    """
+
+    def __init__(self, root, classes=None):
+        self.root = root
+        self.classes = classes or {}  # class name -> {'mtime_ns': int, 'files': {name: [size, mtime_ns, width, height]}}
+
+    @property
+    def class_names(self):
+        """Sorted, the order flow_from_directory assigns class indices in."""
+        return sorted(self.classes)
+
+    def _missing_dimensions(self, class_name):
+        return any(record[2] is None for record in self.classes[class_name]['files'].values())
+
+    def refresh(self, read_dimensions=True, num_threads=None):
+        """Rescans changed class folders. Returns the names of the classes that were rescanned or removed."""
+        current = {}
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                current[entry.name] = entry.stat().st_mtime_ns
+
+        stale = [name for name, mtime_ns in current.items()
+                 if name not in self.classes or self.classes[name]['mtime_ns'] != mtime_ns
+                 or (read_dimensions and self._missing_dimensions(name))]
+        if stale:
+            with ThreadPoolExecutor(max_workers=num_threads or min(32, (os.cpu_count() or 1) * 4)) as pool:
+                scans = pool.map(lambda name: _scan_class(os.path.join(self.root, name),
+                                                          self.classes.get(name, {}).get('files', {}),
+                                                          read_dimensions), stale)
+                for name, files in zip(stale, scans):
+                    self.classes[name] = {'mtime_ns': current[name], 'files': files}
+        removed = sorted(set(self.classes) - set(current))
+        for name in removed:
+            del self.classes[name]
+        return stale + removed
+
+    def save(self):
+        catalog_path = os.path.join(self.root, CATALOG_NAME)
+        tmp_path = catalog_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CATALOG_VERSION, 'classes': self.classes}, f)
+        os.replace(tmp_path, catalog_path)
+
+    def counts(self):
+        return {name: len(self.classes[name]['files']) for name in self.class_names}
+
+    def total(self):
+        return sum(self.counts().values())
+
+    def class_weights(self):
+        """Inverse-frequency weights keyed by class index (sorted class order), as Keras' class_weight expects."""
+        counts = self.counts()
+        total = sum(counts.values())
+        return {index: total / (len(counts) * counts[name])
+                for index, name in enumerate(self.class_names) if counts[name]}
+
+    def bytes_per_class(self):
+        return {name: sum(record[0] for record in self.classes[name]['files'].values()) for name in self.class_names}
+
+    def dimension_histogram(self, class_name=None):
+        """Counts of each 'WIDTHxHEIGHT' (or 'unknown'), for one class or the whole dataset, most common first."""
+        names = [class_name] if class_name else self.class_names
+        histogram = {}
+        for name in names:
+            for record in self.classes[name]['files'].values():
+                key = f'{record[2]}x{record[3]}' if record[2] else 'unknown'  # None: not read, 0: unreadable
+                histogram[key] = histogram.get(key, 0) + 1
+        return dict(sorted(histogram.items(), key=lambda item: -item[1]))
+
+def load_catalog(root, refresh=True, read_dimensions=True, save=True):
+    """
+    Loads the saved catalog of a dataset root and brings it up to date.
+    Args:
+        root: Dataset folder with one sub-folder per class.
+        refresh: Rescan class folders whose mtime changed since the catalog was saved.
+        read_dimensions: Read image headers for new or changed files (needed for dimension_histogram).
+        save: Write the catalog back if anything was rescanned.
+    Returns:
+        A DatasetCatalog.
+    """
+    catalog = DatasetCatalog(root)
+    try:
+        with open(os.path.join(root, CATALOG_NAME), 'r') as f:
+            saved = json.load(f)
+        if saved.get('version') == CATALOG_VERSION:
+            catalog.classes = saved['classes']
+    except (OSError, ValueError):
+        pass  # no catalog yet (or a broken one): everything gets scanned
+
+    if refresh and catalog.refresh(read_dimensions) and save:
+        catalog.save()
+    return catalog
+
+def print_summary(catalog, top_dimensions=3):
+    counts = catalog.counts()
+    sizes = catalog.bytes_per_class()
+    weights = catalog.class_weights()
+    for index, name in enumerate(catalog.class_names):
+        top = ", ".join(f"{dims} ({n})" for dims, n in list(catalog.dimension_histogram(name).items())[:top_dimensions])
+        print(f"  {name}: {counts[name]} images, {sizes[name] / 2**20:.1f} MB, "
+              f"weight {weights.get(index, 0.0):.3f}, sizes: {top}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show (and update) the cached catalog of a dataset folder")
+    parser.add_argument('roots', nargs='+', help="Dataset folders with one sub-folder per class")
+    parser.add_argument('--no-dimensions', action='store_true', help="Don't read image headers for new files")
+    args = parser.parse_args()
+
+    for root in args.roots:
+        print(f"--- {root} ---")
+        print_summary(load_catalog(root, read_dimensions=not args.no_dimensions))
@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+# Data-parallel training of the new_model.py network across processes/machines with
+# tf.distribute.MultiWorkerMirroredStrategy. Every worker runs this script with its own TF_CONFIG:
+#
+#   TF_CONFIG='{"cluster": {"worker": ["host1:12345", "host2:12345"]}, "task": {"type": "worker", "index": 0}}'
+#   python distributed_train.py --worker
+#
+# Worker 0 is the chief: it saves the model and writes the throughput result. For testing on one
+# machine, --workers N starts N local worker processes with the TF_CONFIGs filled in, and
+# --scaling 1,2,4 does that for each count and reports the scaling efficiency.
+#
+# Training optimises what new_model.py does: the same inverse-proportion class weights, a validation pass
+# after every epoch driving EarlyStopping and ReduceLROnPlateau with new_model.py's settings, and the
+# weights of the epoch with the lowest val_loss are the ones saved. --synthetic and --scaling runs only
+# measure throughput: no validation, and nothing is saved.
+
+# ***CORRECT PATH TO THE SPLIT IMAGES***
+base_dir = r'C:\Users\siddh\Projects\New folder\apple_disease_split'
+train_dir = os.path.join(base_dir, 'train')
+val_dir = os.path.join(base_dir, 'val')
+
+num_classes = 4
+per_worker_batch_size = 32  # the global batch is this times the number of workers
+base_learning_rate = 0.0001  # for one worker; scaled linearly with the global batch
+model_path = 'distributed_model.keras'  # not new_model.py's best_apple_disease_model.keras, which serving uses
+
+def build_model(img_width, img_height, num_classes, weights='imagenet'):
+    """The new_model.py network: ResNet50 + GlobalAveragePooling2D/Dropout/Dense(1024)/Dropout/Dense."""
+    from tensorflow.keras.applications import ResNet50
+    from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
+    from tensorflow.keras.models import Model
+
+    base_model = ResNet50(weights=weights, include_top=False, input_shape=(img_width, img_height, 3))
+    x = GlobalAveragePooling2D()(base_model.output)
+    x = Dropout(0.5)(x)
+    x = Dense(1024, activation='relu')(x)
+    x = Dropout(0.5)(x)
+    predictions = Dense(num_classes, activation='softmax', dtype='float32')(x)
+    return Model(inputs=base_model.input, outputs=predictions)
+
+def make_input_fn(paths, labels, global_batch_size, img_width, img_height, seed, synthetic=False):
+    """
+    Builds each worker's input pipeline for distribute_datasets_from_function. Files are sharded by
+    worker before anything is read, so every worker decodes and augments only its own 1/N of the split.
+    """
+    import tensorflow as tf
+    from augmentation import default_augmentation, image_dataset
+
+    def input_fn(input_context):
+        batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+        if synthetic:
+            images = tf.random.stateless_uniform((len(paths), img_height, img_width, 3), [seed or 0, 0])
+            dataset = tf.data.Dataset.from_tensor_slices((images, tf.constant(labels, dtype=tf.int32)))
+            dataset = dataset.shard(input_context.num_input_pipelines, input_context.input_pipeline_id)
+            return dataset.batch(batch_size).repeat().prefetch(tf.data.AUTOTUNE)
+
+        shard = slice(input_context.input_pipeline_id, None, input_context.num_input_pipelines)
+        dataset = image_dataset(paths[shard], labels[shard], img_width, img_height, batch_size, shuffle=True,
+                                augment=default_augmentation, seed=seed)
+        return dataset.repeat()  # every worker must run the same number of steps
+
+    return input_fn
+
+def class_weight_vector(labels, num_classes):
+    """new_model.py's inverse-proportion class weights, as a vector indexed by class."""
+    counts = np.bincount(np.asarray(labels, dtype=np.int64), minlength=num_classes)
+    return (counts.sum() / (num_classes * np.maximum(counts, 1))).astype(np.float32)
+
+def make_train_step(strategy, model, optimizer, global_batch_size, class_weights=None):
+    """
+    A compiled step that runs one batch on every replica, all-reduces the gradients and returns the
+    mean loss and the number of correct predictions across all workers.
+    Keras' model.fit can't take MultiWorkerMirroredStrategy inputs yet, so this is the custom loop
+    tf.distribute documents for multi-worker training.
+    Args:
+        class_weights: Loss weight per class (as model.fit's class_weight), or None for unweighted.
+    """
+    import tensorflow as tf
+
+    loss_fn = tf.keras.losses.SparseCategoricalCrossentropy(reduction='none')
+    scale_loss = getattr(optimizer, 'scale_loss', None)  # set for the mixed_float16 loss scale optimizer
+    weights = None if class_weights is None else tf.constant(class_weights, dtype=tf.float32)
+
+    def replica_step(images, labels):
+        with tf.GradientTape() as tape:
+            probabilities = model(images, training=True)
+            per_example_loss = loss_fn(labels, probabilities)
+            if weights is not None:
+                per_example_loss *= tf.gather(weights, labels)
+            loss = tf.nn.compute_average_loss(per_example_loss, global_batch_size=global_batch_size)
+            scaled_loss = scale_loss(loss) if scale_loss else loss
+        gradients = tape.gradient(scaled_loss, model.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        predicted = tf.argmax(probabilities, axis=-1, output_type=tf.int32)
+        return loss, tf.reduce_sum(tf.cast(predicted == labels, tf.float32))
+
+    @tf.function
+    def train_step(iterator):
+        images, labels = next(iterator)
+        loss, correct = strategy.run(replica_step, args=(images, labels))
+        return strategy.reduce('SUM', loss, axis=None), strategy.reduce('SUM', correct, axis=None)
+
+    return train_step
+
+def make_evaluate(strategy, model):
+    """
+    Returns evaluate(dataset) -> (val_loss, val_accuracy) over every worker's dataset. Each worker runs
+    its own shard of the validation split, then one all-reduce sums the totals, so every worker gets the
+    same numbers and the callbacks take the same decisions everywhere. (Like model.fit, unweighted.)
+    """
+    import tensorflow as tf
+
+    loss_fn = tf.keras.losses.SparseCategoricalCrossentropy(reduction='sum')
+
+    @tf.function
+    def evaluate_batch(images, labels):
+        probabilities = model(images, training=False)
+        predicted = tf.argmax(probabilities, axis=-1, output_type=tf.int32)
+        labels = tf.cast(labels, tf.int32)
+        return tf.stack([loss_fn(labels, probabilities), tf.reduce_sum(tf.cast(predicted == labels, tf.float32)),
+                         tf.cast(tf.size(labels), tf.float32)])
+
+    @tf.function
+    def all_reduce(totals):
+        return strategy.reduce('SUM', strategy.run(tf.identity, args=(totals,)), axis=None)
+
+    def evaluate(dataset):
+        totals = np.zeros(3, dtype=np.float32)
+        if dataset is not None:
+            for images, labels in dataset:
+                totals += evaluate_batch(images, labels).numpy()
+        totals = all_reduce(tf.constant(totals)).numpy()
+        return totals[0] / max(totals[2], 1), totals[1] / max(totals[2], 1)
+
+    return evaluate
+
+def run_worker(args):
+    """Trains on this worker's shard. Returns the chief's result dict (None on other workers)."""
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+    from augmentation import image_dataset, list_image_files
+    from split_manifest import manifest_files
+    from training_config import load_training_config, apply_precision_policy
+
+    if args.threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+        tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+
+    training_config = load_training_config()
+    apply_precision_policy(training_config)
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    resolver = strategy.cluster_resolver
+    task_index = resolver.task_id if resolver is not None and resolver.task_type else 0
+    is_chief = task_index == 0
+    num_workers = strategy.num_replicas_in_sync
+
+    val_paths = val_labels = ()
+    if args.synthetic:
+        paths = [''] * args.synthetic
+        labels = [i % num_classes for i in range(args.synthetic)]
+    elif args.manifest:
+        paths, labels, _ = manifest_files(args.manifest, 'train')
+        val_paths, val_labels, _ = manifest_files(args.manifest, 'val')
+    else:
+        paths, labels, _ = list_image_files(args.data_dir)
+        if args.val_dir:
+            val_paths, val_labels, _ = list_image_files(args.val_dir)
+
+    global_batch_size = args.batch_size * num_workers
+    learning_rate = base_learning_rate * global_batch_size / per_worker_batch_size  # linear scaling rule
+    steps_per_epoch = args.steps_per_epoch or max(1, len(paths) // global_batch_size)
+    if is_chief:
+        print(f"{num_workers} workers, global batch {global_batch_size}, learning rate {learning_rate:g}, "
+              f"{steps_per_epoch} steps per epoch")
+
+    dataset = strategy.distribute_datasets_from_function(
+        make_input_fn(paths, labels, global_batch_size, args.img_size, args.img_size, args.seed, bool(args.synthetic)))
+    with strategy.scope():
+        model = build_model(args.img_size, args.img_size, num_classes, None if args.weights == 'none' else args.weights)
+        optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+        if training_config['mixed_precision'] == 'mixed_float16':
+            optimizer = tf.keras.optimizers.LossScaleOptimizer(optimizer)
+        train_step = make_train_step(strategy, model, optimizer, global_batch_size,
+                                     None if args.synthetic else class_weight_vector(labels, num_classes))
+        model.compile(optimizer=optimizer)  # ReduceLROnPlateau changes model.optimizer's learning rate
+
+    validate = not args.synthetic and len(val_paths) > 0
+    if validate:
+        evaluate = make_evaluate(strategy, model)
+        shard = slice(task_index, None, num_workers)
+        val_dataset = (image_dataset(val_paths[shard], val_labels[shard], args.img_size, args.img_size,
+                                     args.batch_size) if len(val_paths[shard]) else None)
+        # new_model.py's callbacks; the best weights are tracked here, as its ModelCheckpoint(save_best_only) does
+        callbacks = [EarlyStopping(monitor='val_loss', patience=7),
+                     ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=5, min_lr=0.00001)]
+        for callback in callbacks:
+            callback.set_model(model)
+            callback.on_train_begin()
+        best_loss, best_weights = float('inf'), None
+    elif not args.synthetic and is_chief:
+        print("No validation images: training for all epochs and saving the last weights")
+
+    records = []
+    iterator = iter(dataset)
+    for epoch in range(args.epochs):
+        start_time = time.perf_counter()
+        total_loss = 0.0
+        correct = 0.0
+        for _ in range(steps_per_epoch):
+            loss, batch_correct = train_step(iterator)
+            total_loss += float(loss)
+            correct += float(batch_correct)
+        seconds = time.perf_counter() - start_time
+        images = steps_per_epoch * global_batch_size
+        record = {'epoch': epoch + 1, 'seconds': seconds, 'images_per_sec': images / seconds,
+                  'loss': total_loss / steps_per_epoch, 'accuracy': correct / images}
+        records.append(record)
+        if validate:
+            val_loss, val_accuracy = evaluate(val_dataset)
+            record.update(val_loss=float(val_loss), val_accuracy=float(val_accuracy))
+            if val_loss < best_loss:
+                best_loss, best_weights = val_loss, model.get_weights()
+        if is_chief:
+            validation = f", val_loss {record['val_loss']:.4f}, val_accuracy {record['val_accuracy']:.4f}" if validate else ''
+            print(f"Epoch {epoch + 1}/{args.epochs}: loss {record['loss']:.4f}, accuracy {record['accuracy']:.4f}"
+                  f"{validation}, {seconds:.1f}s, {record['images_per_sec']:.1f} images/sec")
+            if training_config['throughput_log']:
+                with open(training_config['throughput_log'], 'a') as f:
+                    f.write(json.dumps(dict(record, run=f'distributed-{num_workers}', batch_size=global_batch_size,
+                                            config={'mixed_precision': training_config['mixed_precision']})) + '\n')
+        if validate:
+            for callback in callbacks:
+                callback.on_epoch_end(epoch, dict(record))
+            if model.stop_training:
+                break
+
+    if validate and best_weights is not None:
+        model.set_weights(best_weights)
+        if is_chief:
+            print(f"Keeping the weights of the epoch with the lowest val_loss ({best_loss:.4f})")
+
+    # Every worker has to take part in saving; only the chief's copy is kept
+    if args.model_path and not args.synthetic:
+        if is_chief:
+            model.save(args.model_path)
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                model.save(os.path.join(tmp_dir, 'worker.keras'))
+
+    if not is_chief:
+        return None
+    # The first epoch includes graph building and collective setup, so the later epochs are the steady state
+    steady = records[1:] or records
+    result = {'workers': num_workers, 'global_batch_size': global_batch_size, 'learning_rate': learning_rate,
+              'images_per_sec': sum(r['images_per_sec'] for r in steady) / len(steady),
+              'epoch_seconds': [r['seconds'] for r in records], 'final_loss': records[-1]['loss']}
+    if validate:
+        result['best_val_loss'] = float(best_loss)
+    if args.result_path:
+        with open(args.result_path, 'w') as f:
+            json.dump(result, f)
+    return result
+
+def _free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+def launch_local(num_workers, worker_args, timeout=None):
+    """
+    Runs num_workers worker processes on this machine, splitting the CPU cores between them.
+    Returns the chief's result dict.
+    """
+    cluster = {'worker': [f'localhost:{port}' for port in _free_ports(num_workers)]}
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_path = os.path.join(tmp_dir, 'result.json')
+        processes = []
+        for index in range(num_workers):
+            env = dict(os.environ, TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}),
+                       CUDA_VISIBLE_DEVICES='')
+            command = [sys.executable, os.path.abspath(__file__), '--worker', '--threads', str(threads),
+                       '--result-path', result_path] + worker_args
+            processes.append(subprocess.Popen(command, env=env))
+
+        # A worker that dies leaves the others blocked in a collective forever, so the first failure
+        # (or the timeout) stops them all
+        start_time = time.perf_counter()
+        try:
+            while True:
+                codes = [process.poll() for process in processes]
+                failed = [index for index, code in enumerate(codes) if code not in (None, 0)]
+                if failed:
+                    raise RuntimeError(f"Workers {failed} failed")
+                if all(code == 0 for code in codes):
+                    break
+                if timeout is not None and time.perf_counter() - start_time > timeout:
+                    raise subprocess.TimeoutExpired(command, timeout)
+                time.sleep(0.5)
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+        with open(result_path, 'r') as f:
+            return json.load(f)
+
+def scaling_report(worker_counts, worker_args, report_path=None):
+    """Trains with each worker count and reports throughput and efficiency relative to one worker."""
+    results = [launch_local(count, worker_args) for count in worker_counts]
+    baseline = results[0]['images_per_sec'] / results[0]['workers']
+    print("workers  images/sec  speedup  efficiency")
+    for result in results:
+        result['speedup'] = result['images_per_sec'] / baseline
+        result['efficiency'] = result['speedup'] / result['workers']
+        print(f"{result['workers']:>7}  {result['images_per_sec']:>10.1f}  {result['speedup']:>6.2f}x  "
+              f"{result['efficiency']:>9.0%}")
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Multi-worker data-parallel training (MultiWorkerMirroredStrategy)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--worker', action='store_true', help="Run as one worker (TF_CONFIG must be set)")
+    mode.add_argument('--workers', type=int, help="Launch this many local worker processes")
+    mode.add_argument('--scaling', help="Comma-separated local worker counts to compare, e.g. 1,2,4")
+    parser.add_argument('--data-dir', default=train_dir)
+    parser.add_argument('--val-dir', default=val_dir, help="Validation images, evaluated after every epoch")
+    parser.add_argument('--manifest', help="Train on the 'train' split of this split manifest instead of --data-dir")
+    parser.add_argument('--synthetic', type=int, default=0, help="Use this many random images instead of real data")
+    parser.add_argument('--batch-size', type=int, default=per_worker_batch_size, help="Per-worker batch size")
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--steps-per-epoch', type=int, default=None)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--weights', default='imagenet', help="'imagenet' or 'none'")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--model-path', default=model_path)
+    parser.add_argument('--threads', type=int, default=None, help="TensorFlow threads per worker")
+    parser.add_argument('--result-path', help=argparse.SUPPRESS)
+    parser.add_argument('--report', help="Where --scaling writes its JSON report")
+    args = parser.parse_args()
+    if args.scaling or args.synthetic:
+        args.model_path = ''  # throughput runs: nothing is saved
+
+    # Everything after the mode flags is passed through to the worker processes
+    passthrough = []
+    for name in ('data_dir', 'val_dir', 'manifest', 'synthetic', 'batch_size', 'epochs', 'steps_per_epoch', 'img_size',
+                 'weights', 'seed', 'model_path'):
+        value = getattr(args, name)
+        if value is not None:
+            passthrough += ['--' + name.replace('_', '-'), str(value)]
+
+    if args.scaling:
+        scaling_report([int(count) for count in args.scaling.split(',')], passthrough, args.report)
+    elif args.workers:
+        print(launch_local(args.workers, passthrough))
+    else:
+        run_worker(args)
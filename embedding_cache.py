@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from image_io import DECODE_PARAMS
+
+# An embedding store is a folder with:
+#   meta.json        backbone name, input size, image decode, embedding size and row count
+#   hashes.txt       image sha1 of each row, one per line, appended together with the rows
+#   embeddings.bin   float32 rows, appended as new images are seen (read through np.memmap)
+# Rows are keyed by the hash of the image bytes, so renamed/re-split images are never recomputed
+# and one store serves every head-training run that uses the same backbone and input size.
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class EmbeddingStore:
+    def __init__(self, store_dir, backbone_name, img_width, img_height, dim):
+        self.store_dir = store_dir
+        self.meta = {'backbone': backbone_name, 'input': [img_width, img_height], 'dim': dim, 'dtype': 'float32',
+                     'decode': DECODE_PARAMS}
+        self.dim = dim
+        self.data_path = os.path.join(store_dir, 'embeddings.bin')
+        self.hashes_path = os.path.join(store_dir, 'hashes.txt')
+        self.meta_path = os.path.join(store_dir, 'meta.json')
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.index = {}  # sha1 -> row
+        self._hashes_bytes = 0  # length of the lines of self.index in hashes.txt
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('decode') != DECODE_PARAMS:
+                raise ValueError(f"{store_dir} was filled from images decoded differently ({saved.get('decode')}); "
+                                 f"use a new folder so the embeddings match what the model is served")
+            if {key: saved.get(key) for key in self.meta} != self.meta:
+                raise ValueError(f"{store_dir} holds {saved['backbone']} embeddings for {saved['input']} inputs; "
+                                 f"use a different folder for {backbone_name} at {[img_width, img_height]}")
+            self._load_index()
+        self._memmap = None
+
+    def _load_index(self):
+        if not os.path.exists(self.hashes_path):
+            return
+        with open(self.hashes_path, 'rb') as f:
+            lines = f.read().decode('ascii').split('\n')[:-1]  # drops a line a crashed run left unfinished
+        rows = os.path.getsize(self.data_path) // (self.dim * 4) if os.path.exists(self.data_path) else 0
+        for sha1 in lines[:rows]:
+            self.index[sha1] = len(self.index)
+            self._hashes_bytes += len(sha1) + 1
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, sha1):
+        return sha1 in self.index
+
+    def add(self, hashes, embeddings):
+        """
+        Appends rows for new hashes (hashes already in the store are skipped). Only the new rows and
+        their hashes are written, so filling a store costs I/O linear in its size.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        new_rows = {}
+        for sha1, row in zip(hashes, embeddings):
+            if sha1 not in self.index and sha1 not in new_rows:
+                new_rows[sha1] = row
+        if not new_rows:
+            return
+        # Rows first, then their hashes: a crash in between leaves rows without hashes, which are ignored
+        with open(self.data_path, 'ab') as f:
+            f.truncate(len(self.index) * self.dim * 4)  # drop rows a crashed run wrote but never indexed
+            f.seek(0, 2)
+            for row in new_rows.values():
+                f.write(row.tobytes())
+        new_lines = ''.join(sha1 + '\n' for sha1 in new_rows).encode('ascii')
+        with open(self.hashes_path, 'ab') as f:
+            f.truncate(self._hashes_bytes)  # likewise for hashes of rows that were never written
+            f.seek(0, 2)
+            f.write(new_lines)
+        for sha1 in new_rows:
+            self.index[sha1] = len(self.index)
+        self._hashes_bytes += len(new_lines)
+
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(self.meta, count=len(self.index)), f)
+        os.replace(tmp_path, self.meta_path)
+        self._memmap = None
+
+    def get(self, hashes):
+        """Embeddings for the given hashes, as a (len(hashes), dim) float32 array."""
+        if self._memmap is None:
+            self._memmap = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(len(self.index), self.dim))
+        return np.asarray(self._memmap[[self.index[sha1] for sha1 in hashes]])
+
+def build_backbone(img_width=224, img_height=224, weights='imagenet'):
+    """ResNet50 without its top, average-pooled to one 2048-d vector per image (new_model.py's base + GAP)."""
+    from tensorflow.keras.applications import ResNet50
+
+    return ResNet50(weights=weights, include_top=False, pooling='avg', input_shape=(img_width, img_height, 3))
+
+def extract_embeddings(paths, store, backbone, img_width=224, img_height=224, batch_size=32, num_threads=None):
+    """
+    Makes sure every image in paths has a row in the store, running the backbone only on images
+    whose bytes haven't been seen before.
+    Returns:
+        The sha1 of each path, in order (the keys to read the rows back with store.get).
+    """
+    import tensorflow as tf
+    from augmentation import image_dataset
+
+    with ThreadPoolExecutor(max_workers=num_threads or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        hashes = list(pool.map(file_sha1, paths))
+
+    missing = {}
+    for path, sha1 in zip(paths, hashes):
+        if sha1 not in store and sha1 not in missing:
+            missing[sha1] = path
+    if missing:
+        print(f"Extracting embeddings for {len(missing)} new images ({len(paths) - len(missing)} cached)")
+        forward = tf.function(lambda x: backbone(x, training=False))
+        missing_hashes = list(missing)
+        dataset = image_dataset(list(missing.values()), [0] * len(missing), img_width, img_height, batch_size)
+        start = 0
+        for images, _ in dataset:
+            embeddings = forward(images).numpy()
+            store.add(missing_hashes[start:start + len(embeddings)], embeddings)  # saved per batch, so a crash loses little
+            start += len(embeddings)
+    return hashes
+
+def build_head(num_classes, dim=2048):
+    """The new_model.py classification head on its own, taking pooled backbone features."""
+    from tensorflow.keras.layers import Dense, Dropout, Input
+    from tensorflow.keras.models import Model
+
+    features = Input(shape=(dim,))
+    x = Dropout(0.5, name='head_dropout_1')(features)
+    x = Dense(1024, activation='relu', name='head_dense')(x)
+    x = Dropout(0.5, name='head_dropout_2')(x)
+    predictions = Dense(num_classes, activation='softmax', dtype='float32', name='head_output')(x)
+    return Model(inputs=features, outputs=predictions)
+
+def attach_head(backbone, head):
+    """Backbone + trained head as one image-to-probabilities model (what prediction_model.py loads)."""
+    from tensorflow.keras.models import Model
+
+    return Model(inputs=backbone.input, outputs=head(backbone.output))
+
+def unfreeze_top_blocks(backbone, num_blocks):
+    """
+    Makes only the last num_blocks ResNet residual blocks (conv5_block3, conv5_block2, ...) trainable.
+    BatchNormalization layers stay frozen so their statistics aren't wrecked by small batches.
+    Returns the names of the unfrozen blocks.
+    """
+    from tensorflow.keras.layers import BatchNormalization
+
+    blocks = []
+    for layer in backbone.layers:
+        parts = layer.name.split('_')
+        if len(parts) > 2 and parts[1].startswith('block'):
+            block = parts[0] + '_' + parts[1]
+            if block not in blocks:
+                blocks.append(block)
+    trainable_blocks = set(blocks[-num_blocks:]) if num_blocks > 0 else set()
+
+    backbone.trainable = True
+    for layer in backbone.layers:
+        parts = layer.name.split('_')
+        in_block = len(parts) > 2 and parts[0] + '_' + parts[1] in trainable_blocks
+        layer.trainable = in_block and not isinstance(layer, BatchNormalization)
+    return sorted(trainable_blocks)
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+# ***CORRECT PATH TO THE SPLIT IMAGES***
+base_dir = r'C:\Users\siddh\Projects\New folder\apple_disease_split'
+test_dir = os.path.join(base_dir, 'test')
+
+class StreamingEvaluator:
+    """
+    Accumulates classification metrics batch by batch, so the whole evaluation is one pass over the
+    data and only O(classes^2 + bins) numbers are kept, however large the split.
+    """
+
+    def __init__(self, class_names, num_bins=15, epsilon=1e-7):
+        """
+        Args:
+            class_names: Class names in model output order.
+            num_bins: Equal-width confidence bins for the calibration error (ECE).
+            epsilon: Probabilities are clipped to [epsilon, 1 - epsilon] for the loss, as Keras does.
+        """
+        self.class_names = list(class_names)
+        self.num_bins = num_bins
+        self.epsilon = epsilon
+        num_classes = len(self.class_names)
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)  # rows: true class, columns: predicted
+        self.loss_sum = 0.0
+        self.count = 0
+        self.bin_count = np.zeros(num_bins, dtype=np.int64)
+        self.bin_confidence = np.zeros(num_bins, dtype=np.float64)
+        self.bin_correct = np.zeros(num_bins, dtype=np.int64)
+
+    def update(self, probabilities, labels):
+        """Adds one batch: (batch, classes) probabilities and (batch,) integer labels."""
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        labels = np.asarray(labels, dtype=np.int64)
+        predicted = np.argmax(probabilities, axis=1)
+        confidence = probabilities[np.arange(len(labels)), predicted]
+        correct = predicted == labels
+
+        true_probability = np.clip(probabilities[np.arange(len(labels)), labels], self.epsilon, 1 - self.epsilon)
+        self.loss_sum += float(-np.log(true_probability).sum())
+        self.count += len(labels)
+        np.add.at(self.confusion, (labels, predicted), 1)
+
+        bins = np.minimum((confidence * self.num_bins).astype(np.int64), self.num_bins - 1)
+        self.bin_count += np.bincount(bins, minlength=self.num_bins)
+        self.bin_confidence += np.bincount(bins, weights=confidence, minlength=self.num_bins)
+        self.bin_correct += np.bincount(bins, weights=correct, minlength=self.num_bins).astype(np.int64)
+
+    def result(self):
+        """The metrics so far as a JSON-able dict."""
+        true_counts = self.confusion.sum(axis=1)
+        predicted_counts = self.confusion.sum(axis=0)
+        hits = np.diag(self.confusion)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(predicted_counts > 0, hits / predicted_counts, 0.0)
+            recall = np.where(true_counts > 0, hits / true_counts, 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+            bin_accuracy = np.where(self.bin_count > 0, self.bin_correct / self.bin_count, 0.0)
+            bin_confidence = np.where(self.bin_count > 0, self.bin_confidence / self.bin_count, 0.0)
+        count = max(self.count, 1)
+        present = true_counts > 0  # macro averages skip classes with no examples in the split
+
+        return {
+            'count': self.count,
+            'loss': self.loss_sum / count,
+            'accuracy': float(hits.sum() / count),
+            'confusion_matrix': self.confusion.tolist(),
+            'per_class': {name: {'precision': float(precision[i]), 'recall': float(recall[i]), 'f1': float(f1[i]),
+                                 'support': int(true_counts[i])}
+                          for i, name in enumerate(self.class_names)},
+            'macro_avg': {'precision': float(precision[present].mean()) if present.any() else 0.0,
+                          'recall': float(recall[present].mean()) if present.any() else 0.0,
+                          'f1': float(f1[present].mean()) if present.any() else 0.0},
+            'ece': float(np.sum(self.bin_count / count * np.abs(bin_accuracy - bin_confidence))),
+            'calibration_bins': [{'lower': i / self.num_bins, 'upper': (i + 1) / self.num_bins,
+                                  'count': int(self.bin_count[i]), 'accuracy': float(bin_accuracy[i]),
+                                  'confidence': float(bin_confidence[i])} for i in range(self.num_bins)],
+            'class_names': self.class_names,
+        }
+
+def evaluate_model(backend, batches, class_names, num_bins=15):
+    """
+    Runs the model over the batches once and computes every metric from that single pass.
+    Args:
+        backend: Anything with predict(images) -> probabilities (inference_backend / model_bundle).
+        batches: Iterable of (images, labels) batches, e.g. an augmentation.image_dataset.
+        class_names: Class names in model output order.
+        num_bins: Calibration bins.
+    Returns:
+        The StreamingEvaluator result, plus 'seconds' and 'images_per_sec'.
+    """
+    evaluator = StreamingEvaluator(class_names, num_bins)
+    start_time = time.perf_counter()
+    for images, labels in batches:
+        evaluator.update(backend.predict(np.asarray(images)), np.asarray(labels))
+    seconds = time.perf_counter() - start_time
+
+    report = evaluator.result()
+    report['seconds'] = seconds
+    report['images_per_sec'] = report['count'] / seconds if seconds > 0 else 0.0
+    return report
+
+def print_report(report):
+    print(f"Test Loss: {report['loss']}")
+    print(f"Test Accuracy: {report['accuracy']}")
+    print(f"Expected calibration error: {report['ece']:.4f}")
+    print(f"{'class':<20} {'precision':>9} {'recall':>9} {'f1':>9} {'support':>8}")
+    for name, metrics in report['per_class'].items():
+        print(f"{name:<20} {metrics['precision']:>9.3f} {metrics['recall']:>9.3f} {metrics['f1']:>9.3f} "
+              f"{metrics['support']:>8}")
+    macro = report['macro_avg']
+    print(f"{'macro avg':<20} {macro['precision']:>9.3f} {macro['recall']:>9.3f} {macro['f1']:>9.3f}")
+
+def write_report(report, report_path):
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {report_path}")
+
+def save_plots(report, out_dir):
+    """
+    Writes confusion_matrix.png and reliability.png to out_dir without opening a window.
+    Returns:
+        The paths written (none if matplotlib isn't installed).
+    """
+    try:
+        import matplotlib
+    except ImportError:
+        print("matplotlib is not installed: skipping the plots")
+        return []
+    matplotlib.use('Agg')  # no display needed (servers, CI, ssh sessions)
+    import matplotlib.pyplot as plt
+
+    os.makedirs(out_dir, exist_ok=True)
+    class_names = report['class_names']
+    confusion = np.array(report['confusion_matrix'])
+
+    fig, ax = plt.subplots(figsize=(10, 8))
+    image = ax.imshow(confusion, cmap='Blues')
+    fig.colorbar(image, ax=ax)
+    ax.set_xticks(range(len(class_names)), labels=class_names, rotation=45, ha='right')
+    ax.set_yticks(range(len(class_names)), labels=class_names)
+    for row in range(len(class_names)):
+        for col in range(len(class_names)):
+            ax.text(col, row, str(confusion[row, col]), ha='center', va='center',
+                    color='white' if confusion[row, col] > confusion.max() / 2 else 'black')
+    ax.set_xlabel("Predicted Label")
+    ax.set_ylabel("True Label")
+    ax.set_title("Confusion Matrix")
+    fig.tight_layout()
+    confusion_path = os.path.join(out_dir, 'confusion_matrix.png')
+    fig.savefig(confusion_path, dpi=100)
+    plt.close(fig)
+
+    bins = report['calibration_bins']
+    centres = [(b['lower'] + b['upper']) / 2 for b in bins]
+    fig, ax = plt.subplots(figsize=(6, 6))
+    ax.bar(centres, [b['accuracy'] for b in bins], width=1 / len(bins), edgecolor='black', label="Accuracy")
+    ax.plot([0, 1], [0, 1], linestyle='--', color='gray', label="Perfect calibration")
+    ax.set_xlabel("Confidence")
+    ax.set_ylabel("Accuracy")
+    ax.set_title(f"Reliability (ECE {report['ece']:.3f})")
+    ax.legend()
+    fig.tight_layout()
+    reliability_path = os.path.join(out_dir, 'reliability.png')
+    fig.savefig(reliability_path, dpi=100)
+    plt.close(fig)
+    return [confusion_path, reliability_path]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate a model on a split in one pass: loss, accuracy, "
+                                                 "confusion matrix, precision/recall/F1 and calibration")
+    parser.add_argument('--model', default='best_apple_disease_model.keras', help=".keras, .tflite or .bundle model")
+    parser.add_argument('--data-dir', default=test_dir, help="Folder of class sub-folders")
+    parser.add_argument('--manifest', help="Evaluate on a split of this split manifest instead of --data-dir")
+    parser.add_argument('--split', default='test', help="Split to take from --manifest")
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--bins', type=int, default=15, help="Calibration bins")
+    parser.add_argument('--out', default='evaluation_report.json')
+    parser.add_argument('--plots', metavar='DIR', help="Also write confusion matrix and reliability PNGs here")
+    args = parser.parse_args()
+
+    from augmentation import image_dataset, list_image_files
+
+    if args.manifest:
+        from split_manifest import manifest_files
+        paths, labels, class_names = manifest_files(args.manifest, args.split)
+    else:
+        paths, labels, class_names = list_image_files(args.data_dir)
+
+    img_width = img_height = args.img_size
+    if args.model.endswith('.bundle'):
+        from model_bundle import load_bundle
+        backend = load_bundle(args.model)
+        class_names = backend.class_names
+        img_width, img_height = backend.img_width, backend.img_height
+    else:
+        from inference_backend import load_backend
+        backend = load_backend(args.model)
+
+    report = evaluate_model(backend, image_dataset(paths, labels, img_width, img_height, args.batch_size),
+                            class_names, args.bins)
+    report['model'] = args.model
+    print_report(report)
+    print(f"{report['count']} images in {report['seconds']:.1f}s ({report['images_per_sec']:.1f} images/sec)")
+    write_report(report, args.out)
+    if args.plots:
+        for path in save_plots(report, args.plots):
+            print(f"Wrote {path}")
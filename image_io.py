@@ -0,0 +1,169 @@
+import io
+import struct
+from contextlib import nullcontext
+
+# JPEG start-of-frame markers carry the image size (C4, C8 and CC are not frames)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# How decode_and_resize turns a file into model pixels. Training (data_preprocessing, augmentation) and
+# serving (prediction_model, the server) all go through it; anything cached from its output records
+# these so it is rebuilt if they ever change.
+DECODE_PARAMS = {'color_order': 'RGB', 'resize': 'area', 'jpeg_dct_scaling': True}
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':  # markers may be padded with extra 0xFF bytes
+            byte = f.read(1)
+        if not byte:
+            raise ValueError("no frame header before end of file")
+        marker = byte[0]
+        if marker == 0xD9 or marker == 0xDA:
+            raise ValueError("no frame header before image data")
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue  # standalone markers have no length
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            raise ValueError("truncated marker segment")
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in _SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                raise ValueError("truncated frame header")
+            _, height, width = struct.unpack('>BHH', data)
+            return width, height
+        f.seek(length - 2, 1)
+
+def _jpeg_is_complete(f, file_size):
+    """A complete JPEG ends with the EOI marker (some writers pad a few bytes after it)."""
+    f.seek(max(0, file_size - 64))
+    tail = f.read().rstrip(b'\x00\r\n ')
+    return tail.endswith(b'\xff\xd9')
+
+def _open_source(source):
+    """A binary file object for a path, encoded bytes or an already open file."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, 'read'):
+        source.seek(0)
+        return nullcontext(source)  # the caller's file is left open
+    return open(source, 'rb')
+
+def read_image_header(image_path):
+    """
+    Reads an image's format and size from its header without decoding the pixels.
+    JPEG and PNG are parsed directly; other formats fall back to PIL, which also only reads the header.
+    Args:
+        image_path: A file path, the encoded bytes or a binary file object.
+    Returns:
+        (format, width, height, complete), where complete is False for a JPEG missing its end marker.
+    Raises:
+        ValueError: If the file is empty, not an image or has a broken header.
+    """
+    with _open_source(image_path) as f:
+        head = f.read(32)
+        if not head:
+            raise ValueError("empty file")
+        f.seek(0, 2)
+        file_size = f.tell()
+
+        if head.startswith(b'\xff\xd8'):
+            width, height = _jpeg_size(f)
+            return 'JPEG', width, height, _jpeg_is_complete(f, file_size)
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            if head[12:16] != b'IHDR':
+                raise ValueError("PNG without IHDR chunk")
+            width, height = struct.unpack('>II', head[16:24])
+            return 'PNG', width, height, True
+
+    from PIL import Image, UnidentifiedImageError
+    try:
+        with _open_source(image_path) as f, Image.open(f) as img:
+            return img.format, img.width, img.height, True
+    except UnidentifiedImageError:
+        raise ValueError("not a recognised image format")
+
+def decode_reduced(image_path, reduction=8):
+    """
+    Decodes an image at 1/reduction of its size (reduction 1, 2, 4 or 8), returning a BGR uint8 array or None.
+    For JPEGs the scaling happens inside the decoder (libjpeg DCT scaling), so this is much cheaper
+    than a full decode and still touches every compressed byte.
+    """
+    import cv2
+
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+             4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+    return cv2.imread(image_path, flags[reduction])
+
+def _read_bytes(source):
+    with _open_source(source) as f:
+        return f.read()
+
+def reduction_for(width, height, min_width, min_height):
+    """The largest JPEG DCT scale-down (8, 4, 2 or 1) that keeps the image at least min_width x min_height."""
+    for reduction in (8, 4, 2):
+        # libjpeg rounds scaled sizes up
+        if -(-width // reduction) >= min_width and -(-height // reduction) >= min_height:
+            return reduction
+    return 1
+
+def decode_at_least(source, min_width, min_height):
+    """
+    Decodes an image to an RGB uint8 array at the smallest size that is still at least
+    min_width x min_height. JPEGs are scaled down inside the decoder (libjpeg 1/2, 1/4 or 1/8 DCT
+    scaling), which skips most of the work and memory of a full decode; other formats decode in full.
+    Args:
+        source: A file path, the encoded bytes or a binary file object.
+        min_width: Smallest acceptable width.
+        min_height: Smallest acceptable height.
+    Returns:
+        (image, original (width, height))
+    Raises:
+        ValueError: If the image can't be read or decoded.
+    """
+    import cv2
+    import numpy as np
+
+    try:
+        data = _read_bytes(source)
+    except OSError as e:
+        raise ValueError(f"could not read image: {e}")
+    if not data:
+        raise ValueError("empty file")
+    try:
+        image_format, width, height, _ = read_image_header(data)
+        reduction = reduction_for(width, height, min_width, min_height) if image_format == 'JPEG' else 1
+    except ValueError:
+        reduction = 1  # unusual header: let the decoder decide whether it can read the file
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+             4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags[reduction])
+    if image is None:
+        raise ValueError("could not decode image")
+    if reduction == 1:
+        width, height = image.shape[1], image.shape[0]
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (width, height)
+
+def decode_and_resize(source, target_size=(224, 224)):
+    """
+    The one decode used for model input, in training and in serving, so both see identical pixels:
+    decode at the smallest JPEG scale still covering target_size, then area-resize the rest of the way.
+    Args:
+        source: A file path, the encoded bytes or a binary file object.
+        target_size: Output (width, height).
+    Returns:
+        An RGB uint8 array of shape (height, width, 3).
+    Raises:
+        ValueError: If the image can't be read or decoded.
+    """
+    import cv2
+
+    width, height = target_size
+    image, _ = decode_at_least(source, width, height)
+    if image.shape[1] == width and image.shape[0] == height:
+        return image
+    # Area averaging when shrinking; when enlarging it behaves like bilinear
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
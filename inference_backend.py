@@ -0,0 +1,68 @@
+import os
+import threading
+import numpy as np
+
+class KerasBackend:
+    """Runs a Keras model through a tf.function (model(x, training=False)), traced once per batch shape."""
+
+    def __init__(self, keras_model):
+        import tensorflow as tf
+
+        self.model = keras_model
+        self._forward = tf.function(lambda x: keras_model(x, training=False))
+
+    def predict(self, images):
+        return self._forward(np.asarray(images, dtype=np.float32)).numpy()
+
+class TFLiteBackend:
+    """
+    Runs a .tflite model exported by model_export.py. Float32 images go in and float32
+    probabilities come out; int8 models are quantized/dequantized here.
+    """
+
+    def __init__(self, model_path=None, model_content=None, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=model_path, model_content=model_content,
+                                       num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input_detail['shape'][0])
+        self._lock = threading.Lock()  # an Interpreter must not be invoked from two threads at once
+
+    def predict(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        with self._lock:
+            if len(images) != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input_detail['index'], images.shape)
+                self.interpreter.allocate_tensors()
+                self.input_detail = self.interpreter.get_input_details()[0]
+                self.output_detail = self.interpreter.get_output_details()[0]
+                self._batch_size = len(images)
+
+            if self.input_detail['dtype'] != np.float32:
+                scale, zero_point = self.input_detail['quantization']
+                info = np.iinfo(self.input_detail['dtype'])
+                images = np.clip(np.round(images / scale + zero_point), info.min, info.max)
+                images = images.astype(self.input_detail['dtype'])
+            self.interpreter.set_tensor(self.input_detail['index'], images)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail['index'])
+
+        if self.output_detail['dtype'] != np.float32:
+            scale, zero_point = self.output_detail['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+def load_backend(model_path, num_threads=None):
+    """Picks the runtime from the file extension: .tflite runs on the TFLite interpreter, anything else on Keras."""
+    if model_path.endswith('.tflite'):
+        return TFLiteBackend(model_path, num_threads=num_threads)
+
+    from tensorflow.keras.models import load_model
+    return KerasBackend(load_model(model_path))
@@ -0,0 +1,557 @@
+import io
+import os
+import json
+import zlib
+import time
+import base64
+import queue
+import tarfile
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlsplit
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.parser import BytesHeaderParser, BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+import prediction_model
+from bulk_scoring import _PushbackReader, iter_archive, image_extensions, score_members
+from prediction_cache import PredictionCache, model_fingerprint
+from tiled_inference import predict_tiled
+from ndvi_engine import analyze_files, default_nir_band, default_red_band, preview_png
+from similarity_index import embedding_backend, load_index
+
+max_upload_bytes = 20 * 2**20
+ndvi_workers = None  # worker processes of the NDVI pool (None: one per CPU)
+_ndvi_pool = None
+_ndvi_pool_lock = threading.Lock()
+
+def ndvi_pool():
+    """
+    The NDVI worker pool, shared by all requests and started on first use. Workers are spawned, not
+    forked: a fork of this multithreaded TensorFlow process can deadlock in the child.
+    """
+    global _ndvi_pool
+    with _ndvi_pool_lock:
+        if _ndvi_pool is None:
+            _ndvi_pool = ProcessPoolExecutor(max_workers=ndvi_workers or os.cpu_count() or 1,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return _ndvi_pool
+
+def _discard_ndvi_pool(pool):
+    """Drops a pool whose worker died, so the next request starts a new one."""
+    global _ndvi_pool
+    with _ndvi_pool_lock:
+        if _ndvi_pool is pool:
+            _ndvi_pool = None
+    pool.shutdown(wait=False)
+
+class MicroBatcher:
+    """
+    Collects single-image requests from many threads and runs them through the model together.
+    A batch is sent as soon as it has max_batch_size images or the oldest image has waited max_wait_ms.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=10):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, img_array):
+        """Queues one (height, width, 3) image; the returned Future resolves to its probabilities."""
+        future = Future()
+        self._queue.put((img_array, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                probabilities = self.predict_batch(np.stack([img_array for img_array, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, future), probs in zip(batch, probabilities):
+                future.set_result(probs)
+
+def batch_buckets(max_batch_size):
+    """Padded batch sizes: powers of two up to max_batch_size, so only a few shapes are ever traced."""
+    buckets = [1]
+    while buckets[-1] < max_batch_size:
+        buckets.append(min(buckets[-1] * 2, max_batch_size))
+    return buckets
+
+def make_predict_batch(backend, max_batch_size):
+    """Runs a batch through the backend, zero-padded up to the nearest bucket size."""
+    buckets = batch_buckets(max_batch_size)
+
+    def predict_batch(images):
+        size = next(bucket for bucket in buckets if bucket >= len(images))
+        padded = np.zeros((size,) + images.shape[1:], dtype=np.float32)
+        padded[:len(images)] = images
+        return backend.predict(padded)[:len(images)]
+
+    return predict_batch
+
+def parse_multipart(content_type, body):
+    """Splits a multipart/form-data body into {field name: [(filename, bytes), ...]}."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        fields.setdefault(name, []).append((part.get_filename(), part.get_payload(decode=True)))
+    return fields
+
+class _LimitedReader:
+    """Exposes exactly Content-Length bytes of the request body as a stream."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.stream.read(n) if n else b''
+        self.remaining -= len(data)
+        return data
+
+class MultipartStream:
+    """
+    Reads a multipart/form-data body part by part straight from the request stream, so an upload of any
+    size is never held in memory. parts() yields (headers, reader) per part; reader.read(n) returns the
+    part's bytes up to the next boundary. A part that isn't read to its end is skipped.
+    """
+
+    def __init__(self, stream, content_type, chunk_size=1 << 16):
+        boundary = BytesHeaderParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n').get_boundary()
+        if not boundary:
+            raise ValueError("multipart/form-data without a boundary")
+        self.stream = stream
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        self.chunk_size = chunk_size
+        self.buffer = b'\r\n'  # so the first boundary looks like every other delimiter
+        self.eof = False
+        self.part_done = False  # the preamble before the first boundary is skipped like an unread part
+
+    def _fill(self, size):
+        while len(self.buffer) < size and not self.eof:
+            chunk = self.stream.read(self.chunk_size)
+            self.eof = not chunk
+            self.buffer += chunk
+
+    def read(self, n=-1):
+        """Reads up to n bytes of the current part (all of it if n is negative); b'' at its end."""
+        if n is None or n < 0:
+            return b''.join(iter(lambda: self.read(self.chunk_size), b''))
+        if self.part_done:
+            return b''
+        self._fill(n + len(self.delimiter))
+        end = self.buffer.find(self.delimiter)
+        if end == -1:
+            if self.eof:
+                raise ValueError("multipart body ended in the middle of a part")
+            end = len(self.buffer) - len(self.delimiter) + 1  # the delimiter may start in the unread bytes
+        else:
+            self.part_done = end <= n
+        data, self.buffer = self.buffer[:min(n, end)], self.buffer[min(n, end):]
+        return data
+
+    def parts(self):
+        while True:
+            while self.read(self.chunk_size):
+                pass
+            self._fill(len(self.delimiter) + 2)
+            if not self.buffer.startswith(self.delimiter):
+                raise ValueError("malformed multipart body")
+            self.buffer = self.buffer[len(self.delimiter):]
+            if self.buffer.startswith(b'--'):
+                return  # closing delimiter
+            header_end = self.buffer.find(b'\r\n\r\n')
+            while header_end == -1:
+                if self.eof or len(self.buffer) > 65536:
+                    raise ValueError("malformed multipart part headers")
+                self._fill(len(self.buffer) + self.chunk_size)
+                header_end = self.buffer.find(b'\r\n\r\n')
+            # The boundary line's own CRLF comes first, then the part's headers
+            headers = BytesHeaderParser(policy=HTTP).parsebytes(self.buffer[:header_end + 4].split(b'\r\n', 1)[1])
+            self.buffer = self.buffer[header_end + 4:]
+            self.part_done = False
+            yield headers, self
+
+def _iter_uploaded_files(multipart):
+    """
+    Turns the 'images' (or 'image') parts of a streamed multipart upload into (name, data, error)
+    members; archives are expanded member by member as they are read.
+    """
+    for headers, part in multipart.parts():
+        if headers.get_param('name', header='content-disposition') not in ('images', 'image'):
+            continue
+        filename = headers.get_filename() or 'upload'
+        reader = _PushbackReader(part)
+        magic = reader.read(4)
+        reader.unread(magic)
+        if magic == b'PK\x03\x04' or filename.lower().endswith(('.tar', '.tar.gz', '.tgz')):
+            try:
+                for name, member_data, error in iter_archive(reader):
+                    yield f'{filename}/{name}', member_data, error
+            except (ValueError, tarfile.TarError, zlib.error, EOFError) as e:
+                yield filename, None, f'could not read archive: {e}'
+        elif filename.lower().endswith(image_extensions) or filename == 'upload':
+            data = reader.read(max_upload_bytes + 1)
+            if len(data) > max_upload_bytes:
+                yield filename, None, f'image larger than {max_upload_bytes} bytes'
+            else:
+                yield filename, data, None
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    # Set by serve()
+    batcher = None
+    predict_batch = None
+    embed_batch = None  # with similarity: probabilities followed by the embedding, one row per image
+    cache = None
+    similarity = None  # a similarity_index.SimilarityIndex: the batcher then also returns embeddings
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_ood(self, match):
+        """Not like any training image: no diagnosis or treatment for it."""
+        self._send_json(422, {
+            'error': "This doesn't look like an apple leaf photo. Please upload a clear photo of a single leaf.",
+            'ood_score': match['ood_score'],
+            'ood_threshold': match['ood_threshold'],
+            'similar_cases': match['similar'],
+        })
+
+    def do_OPTIONS(self):
+        # CORS preflight from the frontend dev server
+        self.send_response(204)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Authorization, Content-Type')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/api/health':
+            batcher = self.batcher
+            self._send_json(200, {
+                'status': 'ok',
+                'model_loaded': True,
+                'requests': batcher.requests,
+                'batches': batcher.batches,
+                'avg_batch_size': batcher.requests / batcher.batches if batcher.batches else 0.0,
+                'cache': self.cache.stats() if self.cache is not None else None,
+            })
+        else:
+            self._send_json(404, {'error': f'Unknown endpoint {self.path}'})
+
+    def _read_image_field(self):
+        """Reads the 'image' field of a multipart upload; returns (bytes, error)."""
+        length = int(self.headers.get('Content-Length', 0))
+        if length > max_upload_bytes:
+            return None, (413, f'Upload larger than {max_upload_bytes} bytes')
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.startswith('multipart/form-data'):
+            return None, (400, 'Expected multipart/form-data with an "image" field')
+        fields = parse_multipart(content_type, self.rfile.read(length))
+        if not fields.get('image'):
+            return None, (400, 'Missing "image" field')
+        return fields['image'][0][1], None
+
+    def _bulk_upload(self):
+        """
+        Streams per-image results back as JSON Lines while the upload is still being read.
+        A raw ZIP/TAR request body and a multipart upload (the frontend's repeated 'images' field,
+        images or archives) are both read part by part and member by member, never held in memory.
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        content_type = self.headers.get('Content-Type', '')
+        body = _LimitedReader(self.rfile, length)
+        if content_type.startswith('multipart/form-data'):
+            try:
+                members = _iter_uploaded_files(MultipartStream(body, content_type))
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+        else:
+            members = iter_archive(body)
+
+        # No Content-Length: the body ends when the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        try:
+            predict_batch = self.embed_batch if self.similarity is not None else self.predict_batch
+            for result in score_members(members, predict_batch, prediction_model.get_class_names(),
+                                        self.batcher.max_batch_size, similarity=self.similarity):
+                self.wfile.write((json.dumps(result) + '\n').encode('utf-8'))
+                self.wfile.flush()
+        except (ValueError, tarfile.TarError, zlib.error, EOFError) as e:
+            self.wfile.write((json.dumps({'error': f'Could not read archive: {e}'}) + '\n').encode('utf-8'))
+        self.close_connection = True
+
+    def _predict_tiled(self):
+        """Like /api/predict/, but for high-resolution photos: scored as a batch of leaf tiles, plus a heatmap."""
+        image_bytes, error = self._read_image_field()
+        if error:
+            self._send_json(*error)
+            return
+        class_names = prediction_model.get_class_names()
+        match = None
+        if self.similarity is not None:
+            # The OOD check looks at the whole photo, as /api/predict/ does, before any tile is scored
+            try:
+                img_array = prediction_model.load_image_array(
+                    io.BytesIO(image_bytes), prediction_model.img_width, prediction_model.img_height)
+            except Exception as e:
+                self._send_json(400, {'error': f'Could not decode image: {e}'})
+                return
+            try:
+                row = self.batcher.submit(img_array).result()
+            except Exception as e:
+                self._send_json(500, {'error': f'Prediction failed: {e}'})
+                return
+            match = self.similarity.query(row[len(class_names):])[0]
+            if match['is_ood']:
+                self._send_ood(match)
+                return
+        try:
+            # The tiles are already a batch, so they skip the micro-batcher
+            result = predict_tiled(image_bytes, SimpleNamespace(predict=self.predict_batch), class_names,
+                                   max_batch_size=self.batcher.max_batch_size)
+        except Exception as e:
+            self._send_json(400, {'error': f'Could not decode image: {e}'})
+            return
+        advice = prediction_model.get_treatment_table()[result['class_index']]
+        payload = {
+            'prediction': result['class_name'],
+            'confidence': result['confidence'],
+            'class_names': class_names,
+            'probabilities': result['probabilities'],
+            'treatments': advice['treatments'],
+            'general_advice': advice['general_advice'],
+            'tiles': result['tiles'],
+            'heatmap': result['heatmap'],
+        }
+        if match is not None:
+            payload['ood_score'] = match['ood_score']
+            payload['similar_cases'] = match['similar']
+        self._send_json(200, payload)
+
+    def _ndvi_analysis(self):
+        """
+        NDVI statistics of a multispectral raster (see ndvi_engine). The frontend's multipart 'image'
+        field and a raw TIFF/.npy request body are both streamed to disk, so multi-GB orthomosaics work
+        too. red_band and nir_band may be given as form fields or in the query string.
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        content_type = self.headers.get('Content-Type', '')
+        options = dict(parse_qsl(urlsplit(self.path).query))
+        body = _LimitedReader(self.rfile, length)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            raster_path = os.path.join(tmp_dir, 'raster')
+            try:
+                with open(raster_path, 'wb') as f:
+                    if content_type.startswith('multipart/form-data'):
+                        has_image = False
+                        for headers, part in MultipartStream(body, content_type).parts():
+                            name = headers.get_param('name', header='content-disposition')
+                            if name == 'image' and not has_image:
+                                for chunk in iter(lambda: part.read(1 << 20), b''):
+                                    f.write(chunk)
+                                has_image = True
+                            elif name in ('red_band', 'nir_band'):
+                                options[name] = part.read(64).decode('ascii', 'replace')
+                        if not has_image:
+                            self._send_json(400, {'error': 'Missing "image" field'})
+                            return
+                    else:
+                        for chunk in iter(lambda: body.read(1 << 20), b''):
+                            f.write(chunk)
+            except ValueError as e:
+                self._send_json(400, {'error': f'Could not read the upload: {e}'})
+                return
+            pool = ndvi_pool()
+            try:
+                red_band = int(options.get('red_band', default_red_band))
+                nir_band = int(options.get('nir_band', default_nir_band))
+                result, preview = analyze_files([raster_path], red_band, nir_band, workers=ndvi_workers or os.cpu_count() or 1,
+                                                pool=pool)
+            except ValueError as e:
+                self._send_json(400, {'error': f'NDVI analysis failed: {e}'})
+                return
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    _discard_ndvi_pool(pool)
+                self._send_json(500, {'error': f'NDVI analysis failed: {e}'})
+                return
+        result['preview_png'] = base64.b64encode(preview_png(preview)).decode('ascii')
+        self._send_json(200, result)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.rstrip('/')
+        if path == '/api/bulk-upload':
+            self._bulk_upload()
+            return
+        if path == '/api/predict-tiled':
+            self._predict_tiled()
+            return
+        if path == '/api/ndvi-analysis':
+            self._ndvi_analysis()
+            return
+        if path != '/api/predict':
+            self._send_json(404, {'error': f'Unknown endpoint {self.path}'})
+            return
+
+        image_bytes, error = self._read_image_field()
+        if error:
+            self._send_json(*error)
+            return
+        probabilities = self.cache.get(image_bytes) if self.cache is not None else None
+        if probabilities is None:
+            try:
+                img_array = prediction_model.load_image_array(
+                    io.BytesIO(image_bytes), prediction_model.img_width, prediction_model.img_height)
+            except Exception as e:
+                self._send_json(400, {'error': f'Could not decode image: {e}'})
+                return
+
+            try:
+                probabilities = self.batcher.submit(img_array).result()
+            except Exception as e:
+                # The whole micro-batch failed; every request in it gets an answer
+                self._send_json(500, {'error': f'Prediction failed: {e}'})
+                return
+            if self.cache is not None:
+                self.cache.put(image_bytes, probabilities)
+        class_names = prediction_model.get_class_names()
+        match = None
+        if self.similarity is not None:
+            # Rows from the batcher (and the cache) are the probabilities followed by the embedding
+            probabilities, embedding = probabilities[:len(class_names)], probabilities[len(class_names):]
+            match = self.similarity.query(embedding)[0]
+            if match['is_ood']:
+                self._send_ood(match)
+                return
+        predicted_class = int(np.argmax(probabilities))
+        advice = prediction_model.get_treatment_table()[predicted_class]
+        payload = {
+            'prediction': class_names[predicted_class],
+            'confidence': float(probabilities[predicted_class]),
+            'class_names': class_names,
+            'probabilities': {name: float(p) for name, p in zip(class_names, probabilities)},
+            'treatments': advice['treatments'],
+            'general_advice': advice['general_advice'],
+        }
+        if match is not None:
+            payload['ood_score'] = match['ood_score']
+            payload['similar_cases'] = match['similar']
+        self._send_json(200, payload)
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too noisy under load
+
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default backlog of 5 resets connections under concurrent load
+
+def serve(host='127.0.0.1', port=8000, max_batch_size=32, max_wait_ms=10, cache=None, similarity=None):
+    backend = prediction_model.get_model()
+    predict_batch = make_predict_batch(backend, max_batch_size)
+    prediction_model.get_treatment_table()  # compile the advice table before serving
+
+    batch_predict_batch = predict_batch
+    if similarity is not None:
+        if not hasattr(backend, 'model'):
+            raise ValueError("similar cases need the embeddings of a Keras model; serve the .keras model")
+        if similarity.class_names != prediction_model.get_class_names():
+            raise ValueError(f"the similarity index classes {similarity.class_names} don't match the model's")
+        # Single-image requests get probabilities and embedding from one forward pass
+        embedder = embedding_backend(backend.model)
+        batch_predict_batch = make_predict_batch(
+            SimpleNamespace(predict=lambda images: np.concatenate(embedder.predict_with_embeddings(images), axis=1)),
+            max_batch_size)
+
+    # Warm up: trace every bucket size before the first real request arrives
+    for size in batch_buckets(max_batch_size):
+        images = np.zeros((size, prediction_model.img_height, prediction_model.img_width, 3), dtype=np.float32)
+        predict_batch(images)
+        if batch_predict_batch is not predict_batch:
+            batch_predict_batch(images)
+
+    InferenceHandler.batcher = MicroBatcher(batch_predict_batch, max_batch_size, max_wait_ms)
+    InferenceHandler.predict_batch = staticmethod(predict_batch)
+    InferenceHandler.embed_batch = staticmethod(batch_predict_batch)
+    InferenceHandler.cache = cache
+    InferenceHandler.similarity = similarity
+    server = InferenceServer((host, port), InferenceHandler)
+    print(f"Serving /api/predict/, /api/predict-tiled/, /api/bulk-upload/, /api/ndvi-analysis/ and /api/health/ "
+          f"on http://{host}:{port} (max batch {max_batch_size}, max wait {max_wait_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local inference server for the frontend's /api/predict/")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--model', default=prediction_model.model_path)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--no-cache', action='store_true', help="Disable the prediction cache")
+    parser.add_argument('--cache-size', type=int, default=10000, help="Entries kept in memory")
+    parser.add_argument('--cache-ttl', type=float, default=None, help="Seconds before a cached prediction expires")
+    parser.add_argument('--cache-db', default=None,
+                        help="SQLite file for a cache that survives restarts (can be shared between models; "
+                             "only expired rows are deleted, so set --cache-ttl to bound its size)")
+    parser.add_argument('--ndvi-workers', type=int, default=None, help="Processes per NDVI request (default: all CPUs)")
+    parser.add_argument('--similarity-index', help="Index from similarity_index.py: adds similar cases to "
+                                                   "/api/predict/ and rejects photos unlike any training image")
+    args = parser.parse_args()
+
+    prediction_model.model_path = args.model
+    ndvi_workers = args.ndvi_workers
+    similarity = load_index(args.similarity_index, args.model) if args.similarity_index else None
+    cache = None
+    if not args.no_cache:
+        # With an index the cached rows also hold the embedding, so they get their own version
+        model_version = model_fingerprint(args.model) + ('+embeddings' if similarity is not None else '')
+        cache = PredictionCache(model_version, args.cache_size, args.cache_ttl, args.cache_db)
+    serve(args.host, args.port, args.max_batch_size, args.max_wait_ms, cache, similarity)
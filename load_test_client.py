@@ -0,0 +1,71 @@
+import time
+import uuid
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+def encode_multipart(field_name, filename, data):
+    """Builds a multipart/form-data body with one file field; returns (content_type, body)."""
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return f'multipart/form-data; boundary={boundary}', body
+
+def post_image(url, content_type, body):
+    """Sends one prediction request and returns its latency in seconds."""
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    start_time = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start_time
+
+def run_load_test(url, image_path, num_requests=200, concurrency=16):
+    """
+    Fires num_requests POSTs at the server from `concurrency` threads.
+    Returns:
+        A dict with p50/p99 latency (ms), requests/sec and the error count.
+    """
+    with open(image_path, 'rb') as f:
+        content_type, body = encode_multipart('image', image_path, f.read())
+
+    latencies = []
+    errors = 0
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(post_image, url, content_type, body) for _ in range(num_requests)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                print(f"Request failed: {e}")
+    elapsed = time.perf_counter() - start_time
+
+    latencies_ms = np.array(latencies) * 1000
+    results = {
+        'requests': num_requests,
+        'errors': errors,
+        'concurrency': concurrency,
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else None,
+        'requests_per_sec': len(latencies) / elapsed,
+    }
+    if latencies:
+        print(f"{len(latencies)} ok / {errors} failed at concurrency {concurrency}: "
+              f"p50 {results['p50_ms']:.1f} ms, p99 {results['p99_ms']:.1f} ms, "
+              f"{results['requests_per_sec']:.1f} requests/sec")
+    else:
+        print(f"All {num_requests} requests failed")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test for inference_server.py")
+    parser.add_argument('--url', default='http://127.0.0.1:8000/api/predict/')
+    parser.add_argument('--image', default='image.jpg')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    run_load_test(args.url, args.image, args.requests, args.concurrency)
@@ -4,6 +4,10 @@ import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout, Input
 from tensorflow.keras.optimizers import Adam
+from shard_dataset import ShardDataset, is_packed
+from perf_utils import peak_rss_mb
+from split_manifest import manifest_files
+from training_config import load_training_config, apply_precision_policy, compile_model, ThroughputLogger
 
 # ***CORRECT PATH TO THE PARENT OF PREPROCESSED DATA FOLDERS***
 base_dir = r'C:\Users\siddh\Projects\New folder\preprocessed_data'  # <--- IMPORTANT: Verify this path!
@@ -16,75 +20,180 @@ img_width, img_height = 224, 224
 num_classes = 4  # apple_scab, black_rot, cedar_apple_rust, healthy
 batch_size = 32  # You can adjust this if you have memory issues
 epochs = 10
+memory_limit_mb = None  # e.g. 2048 to stream each split within a RAM budget; None loads whole splits into RAM
 
-def load_data(data_dir, img_width, img_height): # Removed batch_size here
-    images = []
-    labels = []
-    class_names = os.listdir(data_dir)
+# Set to a manifest from split_manifest.py to take the splits from it instead of the train/val/test
+# folders; all_dir is then the preprocessed tree of the whole cleaned dataset.
+split_manifest = None
+split_fold = None  # cross-validation fold to hold out as validation data
+all_dir = os.path.join(base_dir, 'all')
 
+def list_files(data_dir, manifest=None, split=None, fold=None):
+    """Lists the .npy paths and class indices under data_dir (or of one manifest split) without loading anything."""
+    if manifest is not None:
+        image_paths, labels, _ = manifest_files(manifest, split, data_dir, '.npy', fold)
+        return image_paths, labels
+
+    image_paths = []
+    labels = []
+    # Only folders count as classes (save_dir also holds the preprocessing manifest); sorted like every other loader
+    class_names = sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
     for class_index, class_name in enumerate(class_names):
         class_path = os.path.join(data_dir, class_name)
-        if not os.path.isdir(class_path):
-            continue
         for image_name in os.listdir(class_path):
-            image_path = os.path.join(class_path, image_name)
-            try:
-                image = np.load(image_path)  # Load directly using NumPy
-                images.append(image)
-                labels.append(class_index)
-            except Exception as e:
-                print(f"Error loading image {image_path}: {e}")
+            image_paths.append(os.path.join(class_path, image_name))
+            labels.append(class_index)
+    return image_paths, labels
+
+def stream_data(data_dir, img_width, img_height, memory_limit_mb, chunk_size=None, prefetch_batches=2,
+                manifest=None, split=None, fold=None, seed=None):
+    """
+    Streams a split from its .npy files without ever holding the whole split in RAM.
+    Files are read chunk by chunk and shuffled through a buffer sized to fit the budget.
+    Args:
+        data_dir: Path to the directory containing the image data.
+        img_width: Width of the images.
+        img_height: Height of the images.
+        memory_limit_mb: Memory ceiling for the chunk, shuffle buffer and prefetched batches.
+        chunk_size: Number of images read from disk at a time (defaults to batch_size).
+        prefetch_batches: Number of ready batches kept ahead of the model.
+        manifest, split, fold: Read one split of a split manifest (see list_files).
+        seed: Shuffle seed; the same seed gives the same order in every run.
+    Returns:
+        A tf.data.Dataset object containing the images and labels.
+    """
+    image_paths, labels = list_files(data_dir, manifest, split, fold)
+    chunk_size = chunk_size or batch_size
+
+    image_bytes = img_width * img_height * 3 * 4  # float32
+    reserved_bytes = (chunk_size + (prefetch_batches + 1) * batch_size) * image_bytes
+    shuffle_buffer = (memory_limit_mb * 2**20 - reserved_bytes) // image_bytes
+    if shuffle_buffer < batch_size:
+        raise ValueError(f"memory_limit_mb={memory_limit_mb} is too small for batch_size={batch_size}; "
+                         f"need at least {(reserved_bytes + batch_size * image_bytes) / 2**20:.0f} MB")
+    shuffle_buffer = int(min(shuffle_buffer, len(image_paths)))
+    print(f"Streaming {len(image_paths)} images from {data_dir} "
+          f"(shuffle buffer {shuffle_buffer} images, budget {memory_limit_mb} MB)")
+
+    rng = np.random.default_rng(seed)
+
+    def generator():
+        # Visit the files in a new random order every epoch; only chunk_size images are read at once
+        order = rng.permutation(len(image_paths))
+        for start in range(0, len(order), chunk_size):
+            # A new array per chunk: from_generator keeps the yielded views, so reusing one would
+            # overwrite images still waiting in the shuffle buffer
+            chunk = np.empty((chunk_size, img_height, img_width, 3), dtype=np.float32)
+            filled = []
+            for i in order[start:start + chunk_size]:
+                try:
+                    chunk[len(filled)] = np.load(image_paths[i])
+                    filled.append(labels[i])
+                except Exception as e:
+                    print(f"Error loading image {image_paths[i]}: {e}")
+            for row, label in enumerate(filled):
+                yield chunk[row], label
+
+    dataset = tf.data.Dataset.from_generator(generator, output_signature=(
+        tf.TensorSpec(shape=(img_height, img_width, 3), dtype=tf.float32),
+        tf.TensorSpec(shape=(), dtype=tf.int32),
+    ))
+    dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.prefetch(prefetch_batches)  # fixed, so AUTOTUNE can't grow past the budget
+    return dataset
+
+def load_data(data_dir, img_width, img_height, memory_limit_mb=None, manifest=None, split=None, fold=None,
+              seed=None): # Removed batch_size here
+    if is_packed(data_dir) and manifest is None:
+        # Packed shards (see shard_dataset.py) are read through np.memmap, no per-image file opens
+        return ShardDataset(data_dir).to_tf_dataset(batch_size, seed=seed)
+    if memory_limit_mb is not None:
+        return stream_data(data_dir, img_width, img_height, memory_limit_mb,
+                           manifest=manifest, split=split, fold=fold, seed=seed)
+
+    images = []
+    labels = []
+    image_paths, image_labels = list_files(data_dir, manifest, split, fold)
+
+    for image_path, class_index in zip(image_paths, image_labels):
+        try:
+            image = np.load(image_path)  # Load directly using NumPy
+            images.append(image)
+            labels.append(class_index)
+        except Exception as e:
+            print(f"Error loading image {image_path}: {e}")
 
     images = np.array(images)
     labels = np.array(labels)
 
     dataset = tf.data.Dataset.from_tensor_slices((images, labels))
-    dataset = dataset.shuffle(len(images))
+    dataset = dataset.shuffle(len(images), seed=seed)
     dataset = dataset.batch(batch_size) # Batching added here
     dataset = dataset.prefetch(tf.data.AUTOTUNE)
     return dataset
 
-# Load the data (batch size is handled within load_data now)
-train_data = load_data(train_dir, img_width, img_height)
-validation_data = load_data(val_dir, img_width, img_height)
-test_data = load_data(test_dir, img_width, img_height)
-
-# ... (rest of the model building, compilation, training, and evaluation code remains the same)
-
-# Build the CNN model
-model = Sequential([
-    Input(shape=(img_width, img_height, 3)),
-    Conv2D(32, (3, 3), activation='relu'),
-    MaxPooling2D((2, 2)),
-    Conv2D(64, (3, 3), activation='relu'),
-    MaxPooling2D((2, 2)),
-    Conv2D(128, (3, 3), activation='relu'),
-    MaxPooling2D((2, 2)),
-    Flatten(),
-    Dense(512, activation='relu'),
-    Dropout(0.5),
-    Dense(num_classes, activation='softmax')
-])
-
-# Compile the model
-model.compile(optimizer=Adam(learning_rate=0.0001),
-              loss='sparse_categorical_crossentropy',
-              metrics=['accuracy'])
-
-# Print the model summary
-model.summary()
-
-# Train the model
-history = model.fit(
-    train_data,
-    epochs=epochs,
-    validation_data=validation_data,
-)
-
-# Evaluate the model
-loss, accuracy = model.evaluate(test_data)
-print(f"Test Loss: {loss}")
-print(f"Test Accuracy: {accuracy}")
-
-# Save the model
-model.save('apple_disease_model.keras')
\ No newline at end of file
+if __name__ == '__main__':
+    # XLA, steps_per_execution, mixed precision and batch size come from training_config.json (see training_config.py)
+    training_config = load_training_config()
+    batch_size = training_config['batch_size'] or batch_size
+    apply_precision_policy(training_config)
+
+    # Load the data (batch size is handled within load_data now)
+    if split_manifest:
+        train_data = load_data(all_dir, img_width, img_height, memory_limit_mb, split_manifest, 'train', split_fold)
+        validation_data = load_data(all_dir, img_width, img_height, memory_limit_mb, split_manifest, 'val', split_fold)
+        test_data = load_data(all_dir, img_width, img_height, memory_limit_mb, split_manifest, 'test')
+    else:
+        train_data = load_data(train_dir, img_width, img_height, memory_limit_mb)
+        validation_data = load_data(val_dir, img_width, img_height, memory_limit_mb)
+        test_data = load_data(test_dir, img_width, img_height, memory_limit_mb)
+
+    # ... (rest of the model building, compilation, training, and evaluation code remains the same)
+
+    # Build the CNN model
+    model = Sequential([
+        Input(shape=(img_width, img_height, 3)),
+        Conv2D(32, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Conv2D(64, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Conv2D(128, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Flatten(),
+        Dense(512, activation='relu'),
+        Dropout(0.5),
+        Dense(num_classes, activation='softmax', dtype='float32')  # probabilities stay float32 under mixed precision
+    ])
+
+    # Compile the model
+    compile_model(model, training_config, Adam(learning_rate=0.0001),
+                  loss='sparse_categorical_crossentropy',
+                  metrics=['accuracy'])
+
+    # Print the model summary
+    model.summary()
+
+    # Train the model
+    # Report peak RSS after every epoch so the streaming budget can be checked
+    def report_peak_rss(epoch, logs):
+        peak = peak_rss_mb()
+        budget = f" (budget {memory_limit_mb} MB)" if memory_limit_mb else ""
+        print(f"Peak RSS after epoch {epoch + 1}: " + (f"{peak:.0f} MB" if peak is not None else "unavailable") + budget)
+
+    peak_rss_logger = tf.keras.callbacks.LambdaCallback(on_epoch_end=report_peak_rss)
+
+    history = model.fit(
+        train_data,
+        epochs=epochs,
+        validation_data=validation_data,
+        callbacks=[peak_rss_logger, ThroughputLogger(training_config, batch_size)],
+    )
+
+    # Evaluate the model
+    loss, accuracy = model.evaluate(test_data)
+    print(f"Test Loss: {loss}")
+    print(f"Test Accuracy: {accuracy}")
+
+    # Save the model
+    model.save('apple_disease_model.keras')
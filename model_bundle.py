@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import zipfile
+import argparse
+import tempfile
+from image_io import DECODE_PARAMS
+
+# A bundle is one zip file holding everything a serving node needs:
+#   bundle.json       class names, input spec and preprocessing parameters
+#   treatments.json   advice payloads, a list indexed by class index
+#   model.keras / model.tflite
+BUNDLE_EXTENSION = '.bundle'
+BUNDLE_FORMAT_VERSION = 1
+
+# Same order as flow_from_directory / model_single.py
+default_class_names = ['apple_scab', 'black_rot', 'cedar_apple_rust', 'healthy']
+
+def render_advice(class_name, info):
+    """The treatment text prediction_model.py and new_model.py print for a class (info=None: no data)."""
+    if info is None:
+        return f"No treatment information found for {class_name}"
+
+    lines = ["", "Treatment Suggestions:"]
+    for treatment in info["treatments"]:
+        lines.append(f"- {treatment['name']}: {treatment['description']}")
+        lines.append(f"  Long-term Effectiveness: {treatment['long_term_effectiveness']}")
+        lines.append("  Sources:")
+        for source in treatment['sources']:
+            lines.append(f"    - {source}")
+        lines.append("")
+
+    general_advice = info.get("general_advice", [])
+    if general_advice:
+        lines.append("General Advice:")
+        for advice_item in general_advice:
+            lines.append(f"- {advice_item['advice']}")
+            for link in advice_item.get("links", []):
+                lines.append(f"  - Learn more: {link}")
+            lines.append("")
+    return "\n".join(lines)
+
+def compile_treatments(treatment_data, class_names):
+    """Turns treatments.json (keyed by class name) into a list indexed by class index."""
+    table = []
+    for class_name in class_names:
+        info = treatment_data.get(class_name)
+        table.append({
+            'class_name': class_name,
+            'treatments': info["treatments"] if info else [],
+            'general_advice': info.get("general_advice", []) if info else [],
+            'text': render_advice(class_name, info),
+        })
+    return table
+
+def build_bundle(model_path, out_path, class_names=default_class_names, treatments_path='treatments.json',
+                 img_width=224, img_height=224):
+    """
+    Packs a .keras or .tflite model with its class map, input spec and pre-compiled treatment table.
+    class_names must be in the model's output order (sorted folder names for flow_from_directory models).
+    """
+    with open(treatments_path, 'r') as f:
+        treatment_data = json.load(f)
+
+    model_file = 'model.tflite' if model_path.endswith('.tflite') else 'model.keras'
+    metadata = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'source_model': os.path.basename(model_path),
+        'model_file': model_file,
+        'class_names': list(class_names),
+        'input': {'width': img_width, 'height': img_height, 'channels': 3, 'dtype': 'float32'},
+        # What prediction_model.load_image_array does: image_io.decode_and_resize, scaled to [0, 1]
+        'preprocessing': dict(DECODE_PARAMS, scale=1.0 / 255.0),
+    }
+
+    with zipfile.ZipFile(out_path, 'w') as bundle:
+        bundle.writestr('bundle.json', json.dumps(metadata, indent=2))
+        bundle.writestr('treatments.json', json.dumps(compile_treatments(treatment_data, class_names)))
+        bundle.write(model_path, model_file)  # stored: weights barely compress and this keeps loading fast
+    print(f"Wrote {out_path} ({len(class_names)} classes, {model_file})")
+    return out_path
+
+class ModelBundle:
+    """A loaded bundle: the inference backend plus class names and advice, all read from one file."""
+
+    def __init__(self, metadata, treatments, backend):
+        self.metadata = metadata
+        self.class_names = metadata['class_names']
+        self.img_width = metadata['input']['width']
+        self.img_height = metadata['input']['height']
+        self.treatments = treatments
+        self.backend = backend
+
+    def predict(self, images):
+        return self.backend.predict(images)
+
+    def advice(self, class_index):
+        """The pre-compiled advice payload for a class index."""
+        return self.treatments[class_index]
+
+def load_bundle(bundle_path, num_threads=None):
+    from inference_backend import KerasBackend, TFLiteBackend
+
+    with zipfile.ZipFile(bundle_path) as bundle:
+        metadata = json.loads(bundle.read('bundle.json'))
+        if metadata['format_version'] > BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"{bundle_path}: bundle format {metadata['format_version']} is newer than this code")
+        treatments = json.loads(bundle.read('treatments.json'))
+        model_bytes = bundle.read(metadata['model_file'])
+
+    if metadata['model_file'].endswith('.tflite'):
+        backend = TFLiteBackend(model_content=model_bytes, num_threads=num_threads)
+    else:
+        from tensorflow.keras.models import load_model
+
+        # Keras can only load a .keras model from a path
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_path = os.path.join(tmp_dir, 'model.keras')
+            with open(model_path, 'wb') as f:
+                f.write(model_bytes)
+            backend = KerasBackend(load_model(model_path))
+    return ModelBundle(metadata, treatments, backend)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack a trained model into a self-describing serving bundle")
+    parser.add_argument('model', help=".keras or .tflite model")
+    parser.add_argument('--out', help="Bundle path (defaults to the model name with " + BUNDLE_EXTENSION + ")")
+    parser.add_argument('--treatments', default='treatments.json')
+    parser.add_argument('--class-names', nargs='+', default=default_class_names,
+                        help="Class names in model output order")
+    parser.add_argument('--class-names-from', help="Read class names from a training folder (sorted, as flow_from_directory does)")
+    args = parser.parse_args()
+
+    class_names = args.class_names
+    if args.class_names_from:
+        class_names = sorted(name for name in os.listdir(args.class_names_from)
+                             if os.path.isdir(os.path.join(args.class_names_from, name)))
+    out_path = args.out or os.path.splitext(args.model)[0] + BUNDLE_EXTENSION
+    build_bundle(args.model, out_path, class_names, args.treatments)
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+
+from inference_backend import KerasBackend, TFLiteBackend
+from prediction_model import load_image_array, img_width, img_height
+
+# ***CORRECT PATHS TO THE SPLIT IMAGES***
+base_dir = r'C:\Users\siddh\Projects\New folder\apple_disease_split'
+val_dir = os.path.join(base_dir, 'val')
+test_dir = os.path.join(base_dir, 'test')
+
+def list_images(data_dir):
+    """(path, class index) pairs with classes in sorted order, like flow_from_directory."""
+    class_names = sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+    samples = []
+    for class_index, class_name in enumerate(class_names):
+        class_path = os.path.join(data_dir, class_name)
+        for image_name in sorted(os.listdir(class_path)):
+            samples.append((os.path.join(class_path, image_name), class_index))
+    return samples
+
+def representative_dataset(data_dir, num_samples=200, seed=0):
+    """Calibration images for int8 quantization: a seeded random sample of the split."""
+    samples = list_images(data_dir)
+    random.Random(seed).shuffle(samples)
+
+    def generator():
+        for image_path, _ in samples[:num_samples]:
+            try:
+                img_array = load_image_array(image_path, img_width, img_height)
+            except Exception as e:
+                print(f"Skipping calibration image {image_path}: {e}")
+                continue
+            yield [img_array[np.newaxis]]
+
+    return generator
+
+def export_tflite(model_path, out_dir, calibration_dir, num_samples=200):
+    """
+    Writes <name>_float16.tflite and <name>_int8.tflite next to each other in out_dir.
+    The int8 model is fully quantized (int8 weights, activations and I/O), calibrated on
+    num_samples images from calibration_dir.
+    Returns:
+        {'float16': path, 'int8': path}
+    """
+    import tensorflow as tf
+    from tensorflow.keras.models import load_model
+
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    model = load_model(model_path)
+
+    exported = {}
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        model.export(saved_model_dir)  # SavedModel is the most reliable converter input for Keras 3 models
+
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+        exported['float16'] = os.path.join(out_dir, f'{name}_float16.tflite')
+        with open(exported['float16'], 'wb') as f:
+            f.write(converter.convert())
+
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(calibration_dir, num_samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+        exported['int8'] = os.path.join(out_dir, f'{name}_int8.tflite')
+        with open(exported['int8'], 'wb') as f:
+            f.write(converter.convert())
+
+    for kind, path in exported.items():
+        print(f"Wrote {kind} model: {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+    return exported
+
+def evaluate_backend(backend, samples, batch_size=32, latency_samples=50):
+    """Accuracy over the samples (batched) and single-image latency (ms) on the first latency_samples."""
+    correct = 0
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        images = np.stack([load_image_array(path, img_width, img_height) for path, _ in chunk])
+        labels = np.array([label for _, label in chunk])
+        correct += int(np.sum(np.argmax(backend.predict(images), axis=1) == labels))
+
+    images = [load_image_array(path, img_width, img_height)[np.newaxis] for path, _ in samples[:latency_samples]]
+    backend.predict(images[0])  # warm-up
+    latencies = []
+    for img_array in images:
+        start_time = time.perf_counter()
+        backend.predict(img_array)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+
+    return {'accuracy': correct / len(samples),
+            'latency_ms_p50': float(np.percentile(latencies, 50)),
+            'latency_ms_p99': float(np.percentile(latencies, 99))}
+
+def accuracy_latency_report(model_path, exported, data_dir, report_path=None, batch_size=32):
+    """Compares the Keras model with its TFLite exports on a split and optionally saves the report as JSON."""
+    from tensorflow.keras.models import load_model
+
+    samples = list_images(data_dir)
+    backends = {'keras': (model_path, lambda: KerasBackend(load_model(model_path)))}
+    for kind, path in exported.items():
+        backends[kind] = (path, lambda path=path: TFLiteBackend(path))
+
+    report = {}
+    for kind, (path, load) in backends.items():
+        report[kind] = evaluate_backend(load(), samples, batch_size)
+        report[kind]['size_mb'] = os.path.getsize(path) / 2**20
+        print(f"{kind:>8}: accuracy {report[kind]['accuracy']:.4f}, "
+              f"p50 {report[kind]['latency_ms_p50']:.1f} ms, p99 {report[kind]['latency_ms_p99']:.1f} ms, "
+              f"{report[kind]['size_mb']:.1f} MB")
+
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export float16/int8 TFLite models and compare them with Keras")
+    parser.add_argument('--model', default='best_apple_disease_model.keras')
+    parser.add_argument('--out-dir', default='exported_models')
+    parser.add_argument('--val-dir', default=val_dir, help="Calibration images for int8")
+    parser.add_argument('--test-dir', default=test_dir, help="Split used for the accuracy/latency report")
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--no-report', action='store_true')
+    args = parser.parse_args()
+
+    exported = export_tflite(args.model, args.out_dir, args.val_dir, args.calibration_samples)
+    if not args.no_report:
+        accuracy_latency_report(args.model, exported, args.test_dir,
+                                os.path.join(args.out_dir, 'export_report.json'))
@@ -0,0 +1,474 @@
+import os
+import math
+import time
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# NDVI for multispectral orchard imagery: NDVI = (NIR - Red) / (NIR + Red), from -1 to 1, high for dense green
+# canopy. Orthomosaics are several GB, so they are never loaded: every band is memory-mapped straight
+# from the file (uncompressed TIFF, .npy or a raw band stack) and the raster is cut into tiles that
+# worker processes read and reduce independently. Each tile returns only small per-zone sums, so memory
+# is bounded by workers x tile size whatever the size of the raster, and time scales with the cores used.
+#
+#   python ndvi_engine.py ortho.tif --red-band 2 --nir-band 4 --out ndvi.json --preview ndvi.png
+
+default_red_band = 0  # R, G, B, NIR band order (a 4-band orthomosaic)
+default_nir_band = 3
+tile_size = 1024  # pixels per tile side; a worker holds about 40 bytes per pixel of one tile
+zone_size = 256  # pixels per side of the square zones the statistics are also reported for
+preview_size = 512  # long side of the downsampled NDVI preview
+vegetation_threshold = 0.2  # NDVI below this is bare soil, water, shadow or man-made surface
+healthy_ndvi = 0.6  # canopy NDVI of a vigorous, fully leafed-out orchard
+stressed_ndvi = 0.4  # canopy NDVI below this points to stress, disease or defoliation
+
+# TIFF field types -> struct codes (the ones that can hold the tags read here)
+_TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 6: 'b', 7: 'B', 8: 'h', 9: 'i', 11: 'f', 12: 'd', 16: 'Q', 17: 'q'}
+_TIFF_SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+def _read_tiff_pages(path):
+    """Reads the tags of every page (IFD) of a classic or BigTIFF file; returns (byte order, [tags])."""
+    with open(path, 'rb') as f:
+        head = f.read(16)
+        if head[:2] not in (b'II', b'MM'):
+            raise ValueError("not a TIFF file")
+        order = '<' if head[:2] == b'II' else '>'
+        version = struct.unpack(order + 'H', head[2:4])[0]
+        if version == 42:
+            offset_code, count_code, offset = 'I', 'H', struct.unpack(order + 'I', head[4:8])[0]
+        elif version == 43:
+            offset_code, count_code, offset = 'Q', 'Q', struct.unpack(order + 'Q', head[8:16])[0]
+        else:
+            raise ValueError(f"unknown TIFF version {version}")
+        offset_size, count_size = struct.calcsize(offset_code), struct.calcsize(count_code)
+        entry_size = 4 + 2 * offset_size  # tag, type, count, value or offset
+
+        pages = []
+        seen = set()
+        while offset and offset not in seen:
+            seen.add(offset)
+            f.seek(offset)
+            num_entries = struct.unpack(order + count_code, f.read(count_size))[0]
+            entries = f.read(num_entries * entry_size)
+            next_offset = struct.unpack(order + offset_code, f.read(offset_size))[0]
+            tags = {}
+            for i in range(num_entries):
+                entry = entries[i * entry_size:(i + 1) * entry_size]
+                tag, field_type = struct.unpack(order + 'HH', entry[:4])
+                count = struct.unpack(order + offset_code, entry[4:4 + offset_size])[0]
+                code = _TIFF_TYPES.get(field_type)
+                if code is None:
+                    continue
+                size = struct.calcsize(code) * count
+                data = entry[4 + offset_size:]
+                if size > offset_size:  # the value doesn't fit in the entry, which holds its offset instead
+                    f.seek(struct.unpack(order + offset_code, data)[0])
+                    data = f.read(size)
+                if field_type == 2:
+                    tags[tag] = data[:size].rstrip(b'\x00').decode('latin-1')
+                else:
+                    tags[tag] = np.frombuffer(data[:size], dtype=np.dtype(order + code)).tolist()
+            pages.append(tags)
+            offset = next_offset
+    return order, pages
+
+def _tiff_bands(path):
+    """Band specs of an uncompressed, stripped TIFF: one band per page and/or per sample."""
+    order, pages = _read_tiff_pages(path)
+    bands = []
+    nodata = None
+    for tags in pages:
+        if tags.get(254, [0])[0] & 0b101:  # reduced-resolution overview or transparency mask
+            continue
+        if tags.get(259, [1])[0] != 1:
+            raise ValueError("compressed TIFF; memory-mapping needs an uncompressed one "
+                             "(e.g. gdal_translate -co COMPRESS=NONE -co TILED=NO)")
+        if 322 in tags:
+            raise ValueError("tiled TIFF; memory-mapping needs a stripped one (gdal_translate -co TILED=NO)")
+        width, height = tags[256][0], tags[257][0]
+        samples = tags.get(277, [1])[0]
+        bits = tags.get(258, [1])[0]
+        sample_format = _TIFF_SAMPLE_FORMATS.get(tags.get(339, [1])[0])
+        if sample_format is None or bits % 8:
+            raise ValueError(f"unsupported TIFF sample type ({bits} bits, format {tags.get(339)})")
+        dtype = np.dtype(f'{order}{sample_format}{bits // 8}').str
+        offsets, counts = np.array(tags[273], dtype=np.int64), np.array(tags[279], dtype=np.int64)
+        planar = tags.get(284, [1])[0] == 2
+        if 42113 in tags and nodata is None:  # GDAL_NODATA
+            nodata = float(tags[42113])
+
+        planes = np.split(np.arange(len(offsets)), samples) if planar else [np.arange(len(offsets))]
+        for strips in planes:
+            if np.any(offsets[strips[1:]] != offsets[strips[:-1]] + counts[strips[:-1]]):
+                raise ValueError("TIFF strips are not stored contiguously; rewrite it with gdal_translate")
+        if planar:
+            bands += [{'path': path, 'offset': int(offsets[strips[0]]), 'dtype': dtype, 'shape': [height, width],
+                       'channel': None} for strips in planes]
+        else:
+            shape = [height, width] if samples == 1 else [height, width, samples]
+            bands += [{'path': path, 'offset': int(offsets[0]), 'dtype': dtype, 'shape': shape,
+                       'channel': None if samples == 1 else channel} for channel in range(samples)]
+    return bands, nodata
+
+def _stack_bands(path, offset, dtype, shape, interleave):
+    """Band specs of a (bands, height, width) 'band' or (height, width, bands) 'pixel' interleaved stack."""
+    dtype = np.dtype(dtype)
+    if len(shape) == 2:
+        return [{'path': path, 'offset': offset, 'dtype': dtype.str, 'shape': list(shape), 'channel': None}]
+    if interleave == 'band':
+        num_bands, height, width = shape
+        return [{'path': path, 'offset': offset + band * height * width * dtype.itemsize, 'dtype': dtype.str,
+                 'shape': [height, width], 'channel': None} for band in range(num_bands)]
+    return [{'path': path, 'offset': offset, 'dtype': dtype.str, 'shape': list(shape), 'channel': channel}
+            for channel in range(shape[2])]
+
+def _raster_bands(path, raw_shape, raw_dtype, interleave):
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+        if magic == b'\x93NUMPY':
+            f.seek(0)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            if fortran_order or dtype.hasobject or len(shape) not in (2, 3):
+                raise ValueError(f".npy band stack must be a C-ordered 2-D or 3-D numeric array, not {shape}")
+            if interleave is None and len(shape) == 3:
+                interleave = 'band' if shape[0] < shape[2] else 'pixel'
+            return _stack_bands(path, f.tell(), dtype, shape, interleave), None
+    if magic[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+        return _tiff_bands(path)
+    if raw_shape is None:
+        raise ValueError("not a TIFF or .npy band stack (NDVI needs a near-infrared band, which RGB photos "
+                         "don't have); for a raw band stack give its shape")
+    expected = int(np.prod(raw_shape)) * np.dtype(raw_dtype).itemsize
+    if os.path.getsize(path) < expected:
+        raise ValueError(f"raw file is smaller than {raw_shape} {raw_dtype} samples")
+    if interleave == 'pixel':
+        num_bands, height, width = raw_shape
+        raw_shape = (height, width, num_bands)
+    return _stack_bands(path, 0, raw_dtype, tuple(raw_shape), interleave or 'band'), None
+
+def open_raster(path, raw_shape=None, raw_dtype='uint16', interleave=None):
+    """
+    Describes the bands of a raster file without reading its pixels.
+    Args:
+        path: An uncompressed multi-page or multi-sample TIFF (classic or BigTIFF), a .npy band stack,
+            or a headerless raw band stack (then raw_shape is needed).
+        raw_shape: (bands, height, width) of a raw file.
+        raw_dtype: Sample type of a raw file.
+        interleave: 'band' (bands, height, width) or 'pixel' (height, width, bands) for .npy and raw
+            files; for a .npy file it is guessed from the shape if not given.
+    Returns:
+        (bands, nodata): a list of band specs (plain dicts, cheap to send to worker processes) and the
+        nodata value recorded in the file, or None.
+    Raises:
+        ValueError: If the file can't be memory-mapped.
+    """
+    try:
+        bands, nodata = _raster_bands(path, raw_shape, raw_dtype, interleave)
+        file_size = os.path.getsize(path)
+    except (struct.error, KeyError, IndexError, TypeError, OSError) as e:
+        raise ValueError(f"could not read {os.path.basename(path)}: corrupt or truncated raster ({e!r})")
+    for band in bands:
+        if band['offset'] + int(np.prod(band['shape'])) * np.dtype(band['dtype']).itemsize > file_size:
+            raise ValueError(f"{os.path.basename(path)} is truncated: its pixel data runs past the end of the file")
+    return bands, nodata
+
+def _band_size(band):
+    return band['shape'][0], band['shape'][1]
+
+def _read_window(band, y0, y1, x0, x1, dtype=np.float32):
+    """Reads one window of a band through a memory map (only the pages under the window are touched)."""
+    array = np.memmap(band['path'], dtype=np.dtype(band['dtype']), mode='r', offset=band['offset'],
+                      shape=tuple(band['shape']))
+    window = array[y0:y1, x0:x1] if band['channel'] is None else array[y0:y1, x0:x1, band['channel']]
+    window = np.array(window, dtype=dtype)  # a copy, so the map can be closed
+    del array
+    return window
+
+def _blocks(array, block, fill):
+    """array padded with fill to whole blocks and viewed as (rows, block, cols, block)."""
+    height, width = array.shape
+    rows, cols = -(-height // block), -(-width // block)
+    if (rows * block, cols * block) != (height, width):
+        array = np.pad(array, ((0, rows * block - height), (0, cols * block - width)), constant_values=fill)
+    return array.reshape(rows, block, cols, block)
+
+def ndvi_tile(task):
+    """
+    Runs in a worker process: NDVI of one tile, reduced to per-zone sums, preview blocks and
+    (with a label raster) per-tree sums.
+    """
+    red_band, nir_band, label_band, (y0, y1, x0, x1), zone, preview_factor, nodata, vegetation = task
+    red = _read_window(red_band, y0, y1, x0, x1)
+    nir = _read_window(nir_band, y0, y1, x0, x1)
+    total = nir + red
+    valid = np.isfinite(total) & (total > 0)
+    if nodata is not None:
+        valid &= (red != nodata) & (nir != nodata)
+    ndvi = np.zeros_like(total)
+    np.divide(nir - red, total, out=ndvi, where=valid)
+    del red, nir, total
+    vegetated = valid & (ndvi >= vegetation)
+
+    zone_valid = _blocks(valid, zone, False)
+    zone_vegetated = _blocks(vegetated, zone, False)
+    zone_ndvi = _blocks(ndvi, zone, 0)
+    zones = {
+        'count': zone_valid.sum(axis=(1, 3)),
+        'sum': zone_ndvi.sum(axis=(1, 3), dtype=np.float64),
+        'sum_sq': np.square(zone_ndvi, dtype=np.float64).sum(axis=(1, 3)),
+        'min': np.where(zone_valid, zone_ndvi, np.inf).min(axis=(1, 3)),
+        'max': np.where(zone_valid, zone_ndvi, -np.inf).max(axis=(1, 3)),
+        'vegetated': zone_vegetated.sum(axis=(1, 3)),
+        'vegetated_sum': np.where(zone_vegetated, zone_ndvi, 0).sum(axis=(1, 3), dtype=np.float64),
+    }
+    preview = (_blocks(ndvi, preview_factor, 0).sum(axis=(1, 3), dtype=np.float64),
+               _blocks(valid, preview_factor, False).sum(axis=(1, 3)))
+
+    trees = None
+    if label_band is not None:
+        labels = _read_window(label_band, y0, y1, x0, x1, dtype=np.int64)
+        in_tree = valid & (labels > 0)  # label 0 is background
+        tree_labels = labels[in_tree]
+        values = ndvi[in_tree]
+        tree_vegetated = vegetated[in_tree]
+        if tree_labels.size and tree_labels.max() < 4 * tree_labels.size:
+            index, ids = tree_labels, None  # compact ids: count straight into id-indexed bins
+        else:
+            ids, index = np.unique(tree_labels, return_inverse=True)
+        sums = [np.bincount(index, weights) for weights in
+                (None, values, np.square(values, dtype=np.float64), tree_vegetated,
+                 np.where(tree_vegetated, values, 0))]
+        if ids is None:
+            ids = np.flatnonzero(sums[0])
+            sums = [column[ids] for column in sums]
+        trees = (ids, *sums)
+    return (y0 // zone, x0 // zone), zones, (y0 // preview_factor, x0 // preview_factor), preview, trees
+
+def _mean_std(count, total, total_sq):
+    mean = total / count
+    return mean, math.sqrt(max(0.0, total_sq / count - mean * mean))
+
+def _grid(values, present):
+    """A 2-D array as nested lists with None where present is False (JSON-able)."""
+    return [[float(v) if p else None for v, p in zip(row, row_present)] for row, row_present in zip(values, present)]
+
+def health_assessment(canopy_mean, vegetation_fraction):
+    """'healthy', 'moderate stress', 'severe stress' or 'no vegetation' from the canopy NDVI."""
+    if vegetation_fraction < 0.01 or canopy_mean is None:
+        return 'no vegetation'
+    if canopy_mean >= healthy_ndvi:
+        return 'healthy'
+    if canopy_mean >= stressed_ndvi:
+        return 'moderate stress'
+    return 'severe stress'
+
+def analyze_raster(bands, red_band=default_red_band, nir_band=default_nir_band, labels=None, nodata=None,
+                   tile=tile_size, zone=zone_size, preview=preview_size, vegetation=vegetation_threshold,
+                   workers=None, pool=None):
+    """
+    NDVI statistics of a memory-mapped raster, computed tile by tile in a process pool.
+    Args:
+        bands: Band specs from open_raster (bands of several files may be concatenated).
+        red_band: Index of the red band.
+        nir_band: Index of the near-infrared band.
+        labels: Optional band spec of a tree label raster of the same size (0 = no tree), for per-tree statistics.
+        nodata: Sample value to ignore (besides pixels where NIR + Red <= 0).
+        tile: Tile side in pixels (rounded up to whole zones and preview blocks).
+        zone: Zone side in pixels.
+        preview: Long side of the preview.
+        vegetation: NDVI from which a pixel counts as canopy.
+        workers: Worker processes (defaults to the number of CPUs; 1 runs in this process).
+        pool: An existing ProcessPoolExecutor to run the tiles on instead of a new one per call
+            (a server keeps one; workers should then be its size).
+    Returns:
+        (result, preview): result is a JSON-able dict with 'ndvi_statistics' (mean/std/min/max over all
+        valid pixels), 'canopy', 'health_assessment', 'message', 'zones' grids, 'trees' (with labels)
+        and 'timings'; preview is a float32 NDVI image (NaN where there is no data).
+    Raises:
+        ValueError: If the bands are missing or of different sizes.
+    """
+    start_time = time.perf_counter()
+    for name, index in (('red_band', red_band), ('nir_band', nir_band)):
+        if not 0 <= index < len(bands):
+            raise ValueError(f"the raster has {len(bands)} band(s); {name} {index} is out of range")
+    red, nir = bands[red_band], bands[nir_band]
+    height, width = _band_size(red)
+    if _band_size(nir) != (height, width) or (labels is not None and _band_size(labels) != (height, width)):
+        raise ValueError("the red, near-infrared and label rasters must be the same size")
+
+    preview_factor = max(1, -(-max(height, width) // preview))
+    step = math.lcm(zone, preview_factor)
+    tile = max(step, -(-tile // step) * step)  # tiles made of whole zones and preview blocks
+    windows = [(y, min(y + tile, height), x, min(x + tile, width))
+               for y in range(0, height, tile) for x in range(0, width, tile)]
+    tasks = [(red, nir, labels, window, zone, preview_factor, nodata, vegetation) for window in windows]
+
+    zone_rows, zone_cols = -(-height // zone), -(-width // zone)
+    zones = {key: np.zeros((zone_rows, zone_cols), dtype=np.float64)
+             for key in ('count', 'sum', 'sum_sq', 'vegetated', 'vegetated_sum')}
+    zones['min'] = np.full((zone_rows, zone_cols), np.inf)
+    zones['max'] = np.full((zone_rows, zone_cols), -np.inf)
+    preview_sum = np.zeros((-(-height // preview_factor), -(-width // preview_factor)))
+    preview_count = np.zeros_like(preview_sum)
+    tree_parts = []
+
+    def merge(result):
+        (zone_y, zone_x), tile_zones, (preview_y, preview_x), (block_sum, block_count), trees = result
+        rows, cols = tile_zones['count'].shape
+        target = np.s_[zone_y:zone_y + rows, zone_x:zone_x + cols]
+        for key in ('count', 'sum', 'sum_sq', 'vegetated', 'vegetated_sum'):
+            zones[key][target] += tile_zones[key]
+        zones['min'][target] = np.minimum(zones['min'][target], tile_zones['min'])
+        zones['max'][target] = np.maximum(zones['max'][target], tile_zones['max'])
+        rows, cols = block_sum.shape
+        preview_sum[preview_y:preview_y + rows, preview_x:preview_x + cols] += block_sum
+        preview_count[preview_y:preview_y + rows, preview_x:preview_x + cols] += block_count
+        if trees is not None:
+            tree_parts.append(trees)
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    chunksize = max(1, len(tasks) // (workers * 8))
+    if pool is not None:
+        for result in pool.map(ndvi_tile, tasks, chunksize=chunksize):
+            merge(result)
+    elif workers == 1:
+        for task in tasks:
+            merge(ndvi_tile(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(ndvi_tile, tasks, chunksize=chunksize):
+                merge(result)
+
+    count = zones['count'].sum()
+    if count == 0:
+        raise ValueError("no valid pixels (NIR + Red is zero or nodata everywhere)")
+    mean, std = _mean_std(count, zones['sum'].sum(), zones['sum_sq'].sum())
+    vegetated = zones['vegetated'].sum()
+    vegetation_fraction = float(vegetated / count)
+    canopy_mean = float(zones['vegetated_sum'].sum() / vegetated) if vegetated else None
+    assessment = health_assessment(canopy_mean, vegetation_fraction)
+
+    has_data = zones['count'] > 0
+    has_canopy = zones['vegetated'] >= 0.1 * zone * zone  # zones with at least 10% canopy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        zone_mean = zones['sum'] / zones['count']
+        zone_canopy = zones['vegetated_sum'] / zones['vegetated']
+        zone_fraction = zones['vegetated'] / zones['count']
+        preview_image = (preview_sum / preview_count).astype(np.float32)
+    stressed_zones = int((has_canopy & (zone_canopy < stressed_ndvi)).sum())
+
+    if canopy_mean is None:
+        message = f"No vegetation found (no pixel reaches NDVI {vegetation})."
+    else:
+        message = (f"Canopy NDVI {canopy_mean:.2f} over {vegetation_fraction:.0%} of the area; "
+                   f"{stressed_zones} of {int(has_canopy.sum())} planted zones below {stressed_ndvi}")
+        message += " - inspect those first." if stressed_zones else "."
+
+    result = {
+        'ndvi_statistics': {'mean': float(mean), 'std': float(std), 'min': float(zones['min'].min()),
+                            'max': float(zones['max'].max())},
+        'canopy': {'mean': canopy_mean, 'vegetation_fraction': vegetation_fraction,
+                   'vegetation_threshold': vegetation},
+        'health_assessment': assessment,
+        'message': message,
+        'size': [int(width), int(height)],
+        'zones': {'size': zone, 'rows': zone_rows, 'cols': zone_cols, 'stressed': stressed_zones,
+                  'mean': _grid(zone_mean, has_data), 'canopy_mean': _grid(zone_canopy, has_canopy),
+                  'vegetation_fraction': _grid(zone_fraction, has_data)},
+    }
+    if labels is not None:
+        result['trees'] = _tree_statistics(tree_parts)
+    seconds = time.perf_counter() - start_time
+    result['timings'] = {'seconds': seconds, 'megapixels_per_sec': width * height / 1e6 / seconds,
+                         'tiles': len(tasks), 'workers': workers}
+    return result, preview_image
+
+def _tree_statistics(parts):
+    """Combines the per-tile tree sums (a tree may span several tiles) into one record per tree."""
+    if not parts:
+        return []
+    ids, *columns = (np.concatenate(column) for column in zip(*parts))
+    tree_ids, index = np.unique(ids, return_inverse=True)
+    count, total, total_sq, vegetated, vegetated_sum = (np.bincount(index, column) for column in columns)
+    mean = total / count
+    std = np.sqrt(np.maximum(0, total_sq / count - mean * mean))
+    trees = []
+    for i, n, m, sd, v, v_sum in zip(tree_ids, count, mean, std, vegetated, vegetated_sum):
+        canopy_mean = float(v_sum / v) if v else None
+        trees.append({'id': int(i), 'pixels': int(n), 'mean': float(m), 'std': float(sd), 'canopy_mean': canopy_mean,
+                      'vegetation_fraction': float(v / n),
+                      'health_assessment': health_assessment(canopy_mean, float(v / n))})
+    return trees
+
+def preview_png(preview):
+    """The preview as PNG bytes: red (NDVI <= 0) through yellow to green (NDVI 1), black where there is no data."""
+    import cv2
+
+    level = np.clip(np.nan_to_num(preview, nan=0.0), 0, 1)
+    rgb = np.stack([np.interp(level, [0, 0.5, 1], [215, 255, 26]),
+                    np.interp(level, [0, 0.5, 1], [48, 255, 150]),
+                    np.interp(level, [0, 0.5, 1], [39, 191, 65])], axis=-1).astype(np.uint8)
+    rgb[np.isnan(preview)] = 0
+    ok, png = cv2.imencode('.png', cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    return png.tobytes()
+
+def analyze_files(paths, red_band=default_red_band, nir_band=default_nir_band, labels_path=None, **options):
+    """open_raster + analyze_raster for one or more files whose bands are taken in order (e.g. red.tif nir.tif)."""
+    bands = []
+    nodata = None
+    for path in paths:
+        file_bands, file_nodata = open_raster(path)
+        bands += file_bands
+        nodata = nodata if nodata is not None else file_nodata
+    labels = open_raster(labels_path)[0][0] if labels_path else None
+    options.setdefault('nodata', nodata)
+    return analyze_raster(bands, red_band, nir_band, labels, **options)
+
+# The guard keeps worker processes (which re-import this module on Windows) from re-running the script
+if __name__ == '__main__':
+    import json
+
+    parser = argparse.ArgumentParser(description="Tiled, multi-process NDVI analysis of multispectral rasters")
+    parser.add_argument('rasters', nargs='+', help="TIFF, .npy or raw band stack(s); bands are numbered across files")
+    parser.add_argument('--red-band', type=int, default=default_red_band)
+    parser.add_argument('--nir-band', type=int, default=default_nir_band)
+    parser.add_argument('--labels', help="Tree label raster (same size, 0 = no tree) for per-tree statistics")
+    parser.add_argument('--raw-shape', type=int, nargs=3, metavar=('BANDS', 'HEIGHT', 'WIDTH'),
+                        help="Shape of a headerless raw band stack")
+    parser.add_argument('--raw-dtype', default='uint16')
+    parser.add_argument('--interleave', choices=['band', 'pixel'])
+    parser.add_argument('--nodata', type=float)
+    parser.add_argument('--tile-size', type=int, default=tile_size)
+    parser.add_argument('--zone-size', type=int, default=zone_size)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--out', help="Write the full result (zones, trees) as JSON here")
+    parser.add_argument('--preview', help="Write the NDVI preview PNG here")
+    args = parser.parse_args()
+
+    bands = []
+    nodata = args.nodata
+    for path in args.rasters:
+        file_bands, file_nodata = open_raster(path, args.raw_shape, args.raw_dtype, args.interleave)
+        bands += file_bands
+        nodata = nodata if nodata is not None else file_nodata
+    labels = open_raster(args.labels)[0][0] if args.labels else None
+    result, preview = analyze_raster(bands, args.red_band, args.nir_band, labels, nodata, args.tile_size,
+                                     args.zone_size, workers=args.workers)
+
+    stats = result['ndvi_statistics']
+    print(f"NDVI mean {stats['mean']:.3f}, std {stats['std']:.3f}, range {stats['min']:.3f} to {stats['max']:.3f}")
+    print(f"{result['health_assessment']}: {result['message']}")
+    timings = result['timings']
+    print(f"{result['size'][0]}x{result['size'][1]} in {timings['seconds']:.1f}s "
+          f"({timings['megapixels_per_sec']:.1f} megapixels/sec, {timings['tiles']} tiles, {timings['workers']} workers)")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f)
+        print(f"Wrote {args.out}")
+    if args.preview:
+        with open(args.preview, 'wb') as f:
+            f.write(preview_png(preview))
+        print(f"Wrote {args.preview}")
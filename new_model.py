@@ -1,16 +1,21 @@
 import os
 import numpy as np
-import tensorflow as tf
 from tensorflow.keras.applications import ResNet50
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Input
-from tensorflow.keras.models import Model
+from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCheckpoint
-from sklearn.metrics import confusion_matrix, classification_report  # Import classification_report
-import matplotlib.pyplot as plt
-import seaborn as sns
 import json
+from split_manifest import manifest_files
+from augmentation import default_augmentation, image_dataset, list_image_files
+from training_config import load_training_config, apply_precision_policy, compile_model, ThroughputLogger
+from embedding_cache import EmbeddingStore, attach_head, build_backbone, build_head, extract_embeddings, unfreeze_top_blocks
+from checkpointing import TrainingCheckpointer, fit_resumable, resumable_dataset, saved_run_settings, model_run_settings
+from evaluation import evaluate_model, print_report, write_report, save_plots
+from inference_backend import KerasBackend
+from image_io import decode_and_resize
+from similarity_index import build_index, embedding_backend
+from prediction_cache import model_fingerprint
 
 # ***CORRECT PATH TO THE PARENT OF PREPROCESSED DATA FOLDERS***
 base_dir = r'C:\Users\siddh\Projects\New folder\apple_disease_split'  # <--- IMPORTANT: Verify this path!
@@ -18,138 +23,88 @@ train_dir = os.path.join(base_dir, 'train')
 val_dir = os.path.join(base_dir, 'val')
 test_dir = os.path.join(base_dir, 'test')
 
+# Set to a manifest from split_manifest.py to take the splits from it instead of the train/val/test
+# folders (the images are then read straight from the cleaned dataset)
+split_manifest = None
+split_fold = None  # cross-validation fold to hold out as validation data
+
 # Define image parameters
 img_width, img_height = 224, 224
 num_classes = 4  # apple_scab, black_rot, cedar_apple_rust, healthy
 batch_size = 32  # You can adjust this if you have memory issues
 epochs = 20
+seed = None  # e.g. 42 for the same shuffling and augmentation in every run
+
+# Train only the head on cached ResNet50 features (see embedding_cache.py), optionally followed by
+# fine-tuning the top fine_tune_blocks residual blocks on augmented images
+use_embedding_cache = False
+embedding_store_dir = r'C:\Users\siddh\Projects\New folder\embedding_store'  # reused across runs
+fine_tune_blocks = 0
+fine_tune_epochs = 5
+
+# Checkpoint the full training run (weights, optimizer, callbacks, data position) in the background so an
+# interrupted run continues where it stopped when the script is started again (a finished run starts over;
+# a changed model, optimizer or epochs raises instead of resuming). None to turn off.
+checkpoint_dir = r'C:\Users\siddh\Projects\New folder\training_checkpoints'  # one folder per training run
+checkpoint_every_steps = 500  # plus one at the end of every epoch
+keep_checkpoints = 3
+
+# The trained model (best val_loss epoch), as evaluation.py and the inference server load it
+best_model_path = 'best_apple_disease_model.keras'
 
-# Data generators (using flow_from_directory - recommended)
-train_datagen = ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=0.2,
-    horizontal_flip=True,
-    fill_mode='nearest'
-)
-
-val_datagen = ImageDataGenerator(rescale=1./255)
-test_datagen = ImageDataGenerator(rescale=1./255)
-
-train_generator = train_datagen.flow_from_directory(
-    train_dir,
-    target_size=(img_width, img_height),
-    batch_size=batch_size,
-    class_mode='sparse',
-    shuffle=True  # Shuffle training data
-)
-
-validation_generator = val_datagen.flow_from_directory(
-    val_dir,
-    target_size=(img_width, img_height),
-    batch_size=batch_size,
-    class_mode='sparse',
-    shuffle=False  # Don't shuffle validation data
-)
-
-test_generator = test_datagen.flow_from_directory(
-    test_dir,
-    target_size=(img_width, img_height),
-    batch_size=batch_size,
-    class_mode='sparse',
-    shuffle=False  # Important: Don't shuffle test data for confusion matrix
-)
-
-
-# Load pre-trained ResNet50
-base_model = ResNet50(weights='imagenet', include_top=False, input_shape=(img_width, img_height, 3))
-
-# Add custom classification layers
-x = base_model.output
-x = GlobalAveragePooling2D()(x)
-x = Dropout(0.5)(x)
-x = Dense(1024, activation='relu')(x)
-x = Dropout(0.5)(x)
-predictions = Dense(num_classes, activation='softmax')(x)
-
-model = Model(inputs=base_model.input, outputs=predictions)
-
-# Compile the model
-model.compile(optimizer=Adam(learning_rate=0.0001),
-              loss='sparse_categorical_crossentropy',
-              metrics=['accuracy'])
-
-# Callbacks
-early_stopping = EarlyStopping(monitor='val_loss', patience=7, restore_best_weights=True)  # Increased patience
-reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=5, min_lr=0.00001)  # Reduced min_lr
-model_checkpoint = ModelCheckpoint(
-    filepath='best_apple_disease_model.keras',
-    monitor='val_loss',
-    save_best_only=True,
-    save_weights_only=False,
-    verbose=1
-)
-
-# Class weights to handle imbalance
-total_samples = sum([len(files) for r, d, files in os.walk(train_dir)])
-class_weights = {}
-for i, class_name in enumerate(os.listdir(train_dir)):
-    class_path = os.path.join(train_dir, class_name)
-    num_samples = len(os.listdir(class_path))
-    class_weights[i] = total_samples / (num_classes * num_samples)  # Inverse proportion
-
-# Train the model with class weights and ModelCheckpoint
-history = model.fit(
-    train_generator,
-    epochs=epochs,
-    validation_data=validation_generator,
-    callbacks=[early_stopping, reduce_lr, model_checkpoint],
-    class_weight=class_weights
-)
-
-# Evaluate the model
-loss, accuracy = model.evaluate(test_generator)
-print(f"Test Loss: {loss}")
-print(f"Test Accuracy: {accuracy}")
-
-# Confusion Matrix
-y_probs = model.predict(test_generator)
-y_pred = np.argmax(y_probs, axis=1)
-y_true = test_generator.classes  # Directly from generator
-
-class_names = list(train_generator.class_indices.keys()) # Get class names from generator
-
-cm = confusion_matrix(y_true, y_pred)
-
-
-plt.figure(figsize=(10, 8))
-sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=class_names, yticklabels=class_names)
-plt.xlabel("Predicted Label")
-plt.ylabel("True Label")
-plt.title("Confusion Matrix")
-plt.show()
-
-# Load treatment data
-with open("treatments.json", "r") as f:
-    treatment_data = json.load(f)
+# Test-set metrics are written here instead of being shown in a window
+evaluation_report_path = 'evaluation_report.json'
+evaluation_plot_dir = 'evaluation_plots'
+
+# The training images' embeddings, for "similar cases" and rejecting photos that are not apple leaves
+# (see similarity_index.py). None to skip building it.
+similarity_index_path = 'similarity_index.npz'
 
 # Prediction and advice function
-def predict_and_advise(image_path, model, img_width, img_height, treatment_data, class_names):
+def predict_and_advise(image_path, model, img_width, img_height, treatment_data, class_names, cache=None,
+                       index=None):
+    """
+    Predicts the disease in one image and prints the matching treatment advice.
+    If a prediction_cache.PredictionCache is given, an image whose bytes were already scored by
+    the same model version is answered from the cache instead of running the model again.
+    If a similarity_index.SimilarityIndex is given, the most similar training images are printed too,
+    and an image unlike any of them (not an apple leaf photo) is rejected before any advice is given.
+    Returns the predicted class name, or None on error or rejection.
+    """
     try:
-        img = tf.keras.preprocessing.image.load_img(image_path, target_size=(img_width, img_height))
-        img_array = tf.keras.preprocessing.image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array /= 255.0
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+
+        def load_array():
+            img_array = decode_and_resize(image_bytes, (img_width, img_height)).astype(np.float32)
+            img_array = np.expand_dims(img_array, axis=0)
+            img_array /= 255.0
+            return img_array
 
-        prediction = model.predict(img_array)
+        def run_model():
+            return model.predict(load_array())[0]
+
+        match = None
+        if index is not None:
+            # One pass gives the probabilities and the embedding (the cache only holds probabilities)
+            probabilities, embeddings = embedding_backend(model).predict_with_embeddings(load_array())
+            prediction = probabilities[0]
+            match = index.query(embeddings)[0]
+            if match['is_ood']:
+                print(f"Rejected: this doesn't look like an apple leaf photo (OOD score {match['ood_score']:.3f} "
+                      f"> {match['ood_threshold']:.3f}). Please take a clear photo of a single leaf.")
+                return None
+        else:
+            prediction = cache.get_or_compute(image_bytes, run_model) if cache is not None else run_model()
         predicted_class = np.argmax(prediction)
 
         predicted_class_name = class_names[predicted_class]
 
         print(f"Predicted class: {predicted_class_name}")
+        if match is not None:
+            print("Most similar training images:")
+            for case in match['similar'][:5]:
+                print(f"- {case['class_name']} ({case['similarity']:.2f}): {case['path']}")
 
         if predicted_class_name in treatment_data:
             treatments = treatment_data[predicted_class_name]["treatments"]
@@ -175,9 +130,167 @@ def predict_and_advise(image_path, model, img_width, img_height, treatment_data,
         else:
             print(f"No treatment information found for {predicted_class_name}")
 
+        return predicted_class_name
+
     except Exception as e:
         print(f"Error in prediction and advice: {e}")
+        return None
+
+if __name__ == '__main__':
+    # XLA, steps_per_execution, mixed precision and batch size come from training_config.json (see training_config.py)
+    training_config = load_training_config()
+    batch_size = training_config['batch_size'] or batch_size
+    apply_precision_policy(training_config)
+    throughput_logger = ThroughputLogger(training_config, batch_size)
+
+    # Data pipelines: files are decoded in parallel by tf.data and the training batches get the
+    # ImageDataGenerator transform family (rotation, shift, shear, zoom, flip) as batched tensor ops
+    def list_split(split, directory):
+        if split_manifest:
+            return manifest_files(split_manifest, split, fold=split_fold)
+        return list_image_files(directory)
+
+    train_paths, train_labels, class_names = list_split('train', train_dir)
+    val_paths, val_labels, _ = list_split('val', val_dir)
+    test_paths, test_labels, _ = list_split('test', test_dir)
+
+    train_generator = image_dataset(train_paths, train_labels, img_width, img_height, batch_size,
+                                    shuffle=True, augment=default_augmentation, seed=seed)  # Shuffle training data
+    validation_generator = image_dataset(val_paths, val_labels, img_width, img_height, batch_size)  # Don't shuffle validation data
+    test_generator = image_dataset(test_paths, test_labels, img_width, img_height, batch_size)  # Important: Don't shuffle test data for confusion matrix
+
+
+    # Callbacks
+    early_stopping = EarlyStopping(monitor='val_loss', patience=7, restore_best_weights=True)  # Increased patience
+    reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=5, min_lr=0.00001)  # Reduced min_lr
+    model_checkpoint = ModelCheckpoint(
+        filepath=best_model_path,
+        monitor='val_loss',
+        save_best_only=True,
+        save_weights_only=False,
+        verbose=1
+    )
+
+    # Class weights to handle imbalance
+    # (counted from the training labels, so they line up with the class indices for folders and manifests alike)
+    class_counts = np.bincount(train_labels, minlength=num_classes)
+    total_samples = int(class_counts.sum())
+    class_weights = {}
+    for i, num_samples in enumerate(class_counts):
+        class_weights[i] = total_samples / (num_classes * num_samples)  # Inverse proportion
+
+    if use_embedding_cache:
+        # The frozen backbone runs once per image ever; the head then trains on the stored features.
+        # (Cached features are of un-augmented images, so augmentation only applies when fine-tuning.)
+        base_model = build_backbone(img_width, img_height)
+        store = EmbeddingStore(embedding_store_dir, 'resnet50_imagenet', img_width, img_height,
+                               base_model.output_shape[-1])
+        train_hashes = extract_embeddings(train_paths, store, base_model, img_width, img_height, batch_size)
+        val_hashes = extract_embeddings(val_paths, store, base_model, img_width, img_height, batch_size)
+
+        head = build_head(num_classes, store.dim)
+        compile_model(head, training_config, Adam(learning_rate=0.0001),
+                      loss='sparse_categorical_crossentropy',
+                      metrics=['accuracy'])
+        head.fit(
+            store.get(train_hashes), np.array(train_labels),
+            batch_size=batch_size,
+            epochs=epochs,
+            validation_data=(store.get(val_hashes), np.array(val_labels)),
+            callbacks=[early_stopping, reduce_lr, throughput_logger],
+            class_weight=class_weights
+        )
+
+        model = attach_head(base_model, head)
+        if fine_tune_blocks:
+            print("Fine-tuning blocks:", unfreeze_top_blocks(base_model, fine_tune_blocks))
+            compile_model(model, training_config, Adam(learning_rate=0.00001),
+                          loss='sparse_categorical_crossentropy',
+                          metrics=['accuracy'])
+            history = model.fit(
+                train_generator,
+                epochs=fine_tune_epochs,
+                validation_data=validation_generator,
+                callbacks=[early_stopping, reduce_lr, model_checkpoint, throughput_logger],
+                class_weight=class_weights
+            )
+        else:
+            compile_model(model, training_config, Adam(learning_rate=0.0001),
+                          loss='sparse_categorical_crossentropy',
+                          metrics=['accuracy'])
+            model.save(best_model_path)
+    else:
+        # Load pre-trained ResNet50
+        base_model = ResNet50(weights='imagenet', include_top=False, input_shape=(img_width, img_height, 3))
+
+        # Add custom classification layers
+        x = base_model.output
+        x = GlobalAveragePooling2D()(x)
+        x = Dropout(0.5)(x)
+        x = Dense(1024, activation='relu')(x)
+        x = Dropout(0.5)(x)
+        predictions = Dense(num_classes, activation='softmax', dtype='float32')(x)  # float32 under mixed precision
+
+        model = Model(inputs=base_model.input, outputs=predictions)
+
+        # Compile the model
+        compile_model(model, training_config, Adam(learning_rate=0.0001),
+                      loss='sparse_categorical_crossentropy',
+                      metrics=['accuracy'])
+
+        if checkpoint_dir:
+            # The batch order must not change between restarts, so an unseeded run keeps the seed it started with
+            saved_settings = saved_run_settings(checkpoint_dir)
+            run_seed = seed if seed is not None else (saved_settings or {}).get('seed', int(np.random.randint(2**31)))
+            checkpointer = TrainingCheckpointer(
+                checkpoint_dir, checkpoint_every_steps, keep_checkpoints,
+                callbacks=[early_stopping, reduce_lr, model_checkpoint],
+                run_settings={'seed': run_seed, 'batch_size': batch_size, 'train_files': len(train_paths),
+                              'epochs': epochs, **model_run_settings(model)})
+
+            def make_train_dataset(start_epoch, start_step):
+                return resumable_dataset(train_paths, train_labels, img_width, img_height, batch_size, run_seed,
+                                         start_epoch, start_step, augment=default_augmentation)[0]
+
+            # Train the model with class weights and ModelCheckpoint, resuming from the latest checkpoint
+            history = fit_resumable(
+                model, checkpointer, make_train_dataset,
+                epochs=epochs,
+                steps_per_epoch=-(-len(train_paths) // batch_size),
+                validation_data=validation_generator,
+                callbacks=[early_stopping, reduce_lr, model_checkpoint, throughput_logger],
+                class_weight=class_weights
+            )
+        else:
+            # Train the model with class weights and ModelCheckpoint
+            history = model.fit(
+                train_generator,
+                epochs=epochs,
+                validation_data=validation_generator,
+                callbacks=[early_stopping, reduce_lr, model_checkpoint, throughput_logger],
+                class_weight=class_weights
+            )
+
+    # Evaluate the model: loss, accuracy, confusion matrix, per-class precision/recall/F1 and
+    # calibration all come from one pass over the test split (see evaluation.py)
+    report = evaluate_model(KerasBackend(model), test_generator, class_names)
+    print_report(report)
+    write_report(report, evaluation_report_path)
+    save_plots(report, evaluation_plot_dir)  # PNGs, no window
+
+    # Load treatment data
+    with open("treatments.json", "r") as f:
+        treatment_data = json.load(f)
+
+    similarity_index = None
+    if similarity_index_path:
+        # Built from the saved model (the best epoch, which is what gets served) and tagged with its
+        # fingerprint, so loading the index next to any other model fails
+        model = load_model(best_model_path)
+        similarity_index = build_index(model, train_paths, train_labels, class_names, similarity_index_path,
+                                       val_paths, model_version=model_fingerprint(best_model_path),
+                                       img_width=img_width, img_height=img_height, batch_size=batch_size)
 
-# Example usage (after training)
-image_path = "path/to/your/test/image.jpg"  # Replace with your image path.
-predict_and_advise(image_path, model, img_width, img_height, treatment_data, class_names)
\ No newline at end of file
+    # Example usage (after training)
+    image_path = "path/to/your/test/image.jpg"  # Replace with your image path.
+    predict_and_advise(image_path, model, img_width, img_height, treatment_data, class_names, index=similarity_index)
\ No newline at end of file
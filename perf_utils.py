@@ -0,0 +1,20 @@
+import sys
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process in MB, or None if the platform
+    doesn't expose it (Windows without psutil).
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 2**20  # bytes on macOS
+    return peak / 2**10  # kilobytes on Linux
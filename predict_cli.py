@@ -0,0 +1,195 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Only the standard library is imported up front so --help and argument errors return instantly.
+# numpy, TensorFlow and the model are imported/loaded once, after the arguments have been checked.
+_process_start = time.perf_counter()
+
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+def expand_inputs(inputs):
+    """Image paths for a mix of files, directories (searched recursively) and glob patterns, sorted and de-duplicated."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(image_extensions))
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            matches = [path for path in glob.glob(item, recursive=True)
+                       if os.path.isfile(path) and path.lower().endswith(image_extensions)]
+            if not matches:
+                print(f"Warning: no images match {item}", file=sys.stderr)
+            paths.extend(matches)
+    return sorted(set(paths))
+
+class Timings:
+    def __init__(self):
+        self.startup = 0.0
+        self.decode = 0.0  # summed over the decode threads
+        self.inference = 0.0
+        self.input_wait = 0.0  # time the model sat idle waiting for decoded batches
+        self.scoring = 0.0
+        self.images = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def add_decode(self, seconds):
+        with self._lock:
+            self.decode += seconds
+
+def _timed_load(path, img_width, img_height, timings):
+    from prediction_model import load_image_array
+
+    start_time = time.perf_counter()
+    try:
+        return load_image_array(path, img_width, img_height), None
+    except Exception as e:
+        return None, str(e)
+    finally:
+        timings.add_decode(time.perf_counter() - start_time)
+
+def prefetch_batches(paths, batch_size, img_width, img_height, timings, num_threads=None, prefetch=2):
+    """
+    Decodes images on a thread pool into a bounded queue of batches, so disk reads and JPEG
+    decoding overlap with the model working on earlier batches.
+    Yields:
+        (paths, arrays, errors) per batch, with None in arrays for images that failed to load.
+    """
+    batches = queue.Queue(maxsize=prefetch)
+    done = object()
+
+    def producer():
+        with ThreadPoolExecutor(max_workers=num_threads or os.cpu_count()) as pool:
+            for start in range(0, len(paths), batch_size):
+                chunk = paths[start:start + batch_size]
+                loaded = list(pool.map(lambda path: _timed_load(path, img_width, img_height, timings), chunk))
+                batches.put((chunk, [array for array, _ in loaded], [error for _, error in loaded]))
+        batches.put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    while True:
+        wait_start = time.perf_counter()
+        item = batches.get()
+        timings.input_wait += time.perf_counter() - wait_start
+        if item is done:
+            break
+        yield item
+    thread.join()
+
+class ResultWriter:
+    """Writes one row per image as JSON Lines or CSV (one probability column per class)."""
+
+    def __init__(self, stream, output_format, class_names):
+        self.stream = stream
+        self.output_format = output_format
+        self.class_names = class_names
+        if output_format == 'csv':
+            self.writer = csv.writer(stream)
+            self.writer.writerow(['path', 'prediction', 'confidence'] + class_names + ['error'])
+
+    def write(self, path, probabilities, error=None):
+        if self.output_format == 'csv':
+            if probabilities is None:
+                self.writer.writerow([path, '', ''] + [''] * len(self.class_names) + [error])
+            else:
+                predicted_class = int(probabilities.argmax())
+                self.writer.writerow([path, self.class_names[predicted_class], f'{probabilities[predicted_class]:.6f}']
+                                     + [f'{p:.6f}' for p in probabilities] + [''])
+        else:
+            if probabilities is None:
+                record = {'path': path, 'prediction': None, 'error': error}
+            else:
+                predicted_class = int(probabilities.argmax())
+                record = {'path': path, 'prediction': self.class_names[predicted_class],
+                          'confidence': float(probabilities[predicted_class]),
+                          'probabilities': {name: float(p) for name, p in zip(self.class_names, probabilities)}}
+            self.stream.write(json.dumps(record) + '\n')
+
+def run(paths, out_stream, output_format, batch_size=32, num_threads=None, prefetch=2):
+    import numpy as np
+    import prediction_model
+
+    timings = Timings()
+    backend = prediction_model.get_model()
+    class_names = prediction_model.get_class_names()
+    img_width, img_height = prediction_model.img_width, prediction_model.img_height
+    batch = np.zeros((batch_size, img_height, img_width, 3), dtype=np.float32)
+    backend.predict(batch)  # trace/allocate once so the first real batch isn't charged for it
+    timings.startup = time.perf_counter() - _process_start
+
+    writer = ResultWriter(out_stream, output_format, class_names)
+    run_start = time.perf_counter()
+    for chunk, arrays, errors in prefetch_batches(paths, batch_size, img_width, img_height, timings,
+                                                  num_threads, prefetch):
+        for row, img_array in enumerate(arrays):
+            batch[row] = img_array if img_array is not None else 0.0  # padded to one shape, like predict_images
+
+        start_time = time.perf_counter()
+        probabilities = backend.predict(batch)
+        timings.inference += time.perf_counter() - start_time
+
+        for row, path in enumerate(chunk):
+            if arrays[row] is None:
+                writer.write(path, None, errors[row])
+                timings.failed += 1
+            else:
+                writer.write(path, probabilities[row])
+                timings.images += 1
+    timings.scoring = time.perf_counter() - run_start
+    return timings
+
+def print_summary(timings, num_threads):
+    total = time.perf_counter() - _process_start
+    scored = timings.images + timings.failed
+    print(f"Scored {timings.images} images ({timings.failed} failed)", file=sys.stderr)
+    print(f"  startup (imports + model load): {timings.startup:.2f} s", file=sys.stderr)
+    print(f"  decode:    {timings.decode:.2f} s of thread time on {num_threads or os.cpu_count()} threads", file=sys.stderr)
+    print(f"  inference: {timings.inference:.2f} s", file=sys.stderr)
+    print(f"  waiting on input: {timings.input_wait:.2f} s", file=sys.stderr)
+    if scored:
+        print(f"  scoring: {scored / timings.scoring:.1f} images/sec, "
+              f"total: {scored / total:.1f} images/sec over {total:.2f} s", file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score a batch of leaf images with one model load")
+    parser.add_argument('inputs', nargs='+', help="Image files, directories (recursive) or glob patterns")
+    parser.add_argument('--model', help="A .keras, .tflite or .bundle model (defaults to prediction_model.model_path)")
+    parser.add_argument('--out', help="Output file (defaults to stdout)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        help="Output format (defaults to csv for a .csv --out, otherwise jsonl)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None, help="Decode threads (defaults to the number of CPUs)")
+    parser.add_argument('--prefetch', type=int, default=2, help="Decoded batches to keep ready ahead of the model")
+    args = parser.parse_args()
+
+    if args.batch_size < 1 or args.prefetch < 1:
+        parser.error("--batch-size and --prefetch must be at least 1")
+    if args.model and not os.path.isfile(args.model):
+        parser.error(f"model not found: {args.model}")
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("no images found")
+    output_format = args.format or ('csv' if args.out and args.out.lower().endswith('.csv') else 'jsonl')
+
+    import prediction_model
+    if args.model:
+        prediction_model.model_path = args.model
+
+    out_stream = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        timings = run(paths, out_stream, output_format, args.batch_size, args.threads, args.prefetch)
+    finally:
+        if args.out:
+            out_stream.close()
+    print_summary(timings, args.threads)
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from image_io import DECODE_PARAMS
+
+def model_fingerprint(model_path, chunk_size=1 << 20):
+    """Version string for a model file: a hash of its bytes, so retrained weights never hit stale entries."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return f'{os.path.basename(model_path)}:{digest.hexdigest()}'
+
+class PredictionCache:
+    """
+    Caches class probabilities by a hash of the raw image bytes plus the model version and the image
+    decode (image_io.DECODE_PARAMS), so a changed decode never serves probabilities of the old pixels.
+    Lookups go to an in-process LRU first, then (if db_path is set) to a SQLite file that
+    survives restarts. Both tiers honour ttl_seconds. Expired rows are deleted from the SQLite file
+    when it is opened and again every ttl_seconds (SQLite reuses the freed pages, so the file stops
+    growing). The file can be shared by servers of different model versions; rows of a version no
+    longer served are only deleted once they expire, so without a ttl they stay. Safe to share between threads.
+    """
+
+    def __init__(self, model_version, max_entries=10000, ttl_seconds=None, db_path=None):
+        self.model_version = model_version
+        self.version = f'{model_version} {json.dumps(DECODE_PARAMS, sort_keys=True)}'
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()  # key -> (stored_at, probabilities)
+        self._lock = threading.Lock()
+        self._db = None
+        self._pruned_at = time.time()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                             '(key TEXT PRIMARY KEY, probabilities BLOB, stored_at REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS predictions_stored_at ON predictions (stored_at)')
+            self._db.commit()
+            self.prune()
+
+    def key(self, image_bytes):
+        digest = hashlib.blake2b(image_bytes, digest_size=16, person=b'apple-predict')
+        digest.update(self.version.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _expired(self, stored_at, now):
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def _remember(self, key, stored_at, probabilities):
+        """Adds to the LRU tier, evicting the least recently used entries. Caller holds the lock."""
+        self._memory[key] = (stored_at, probabilities)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _prune(self, now):
+        """Deletes expired rows from the SQLite tier. Caller holds the lock."""
+        self._pruned_at = now
+        if self._db is None or self.ttl_seconds is None:
+            return 0
+        deleted = self._db.execute('DELETE FROM predictions WHERE stored_at < ?', (now - self.ttl_seconds,)).rowcount
+        self._db.commit()
+        return deleted
+
+    def prune(self):
+        """Deletes expired rows from the SQLite tier. Returns how many were deleted."""
+        with self._lock:
+            return self._prune(time.time())
+
+    def get(self, image_bytes):
+        """Returns the cached probabilities for these image bytes, or None."""
+        key = self.key(image_bytes)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute('SELECT probabilities, stored_at FROM predictions WHERE key = ?',
+                                       (key,)).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    probabilities = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, row[1], probabilities)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return probabilities
+
+            self.misses += 1
+            return None
+
+    def put(self, image_bytes, probabilities):
+        key = self.key(image_bytes)
+        probabilities = np.asarray(probabilities, dtype=np.float32).copy()
+        probabilities.setflags(write=False)  # shared with every later hit
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, probabilities)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)',
+                                 (key, probabilities.tobytes(), now))
+                self._db.commit()
+                if self.ttl_seconds is not None and now - self._pruned_at >= self.ttl_seconds:
+                    self._prune(now)
+
+    def get_or_compute(self, image_bytes, compute):
+        """Returns cached probabilities, or calls compute() and caches its result."""
+        probabilities = self.get(image_bytes)
+        if probabilities is None:
+            probabilities = compute()
+            self.put(image_bytes, probabilities)
+        return probabilities
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self._memory), 'evictions': self.evictions}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
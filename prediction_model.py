@@ -1,80 +1,156 @@
 import os
 import json
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+from inference_backend import load_backend
+from model_bundle import BUNDLE_EXTENSION, compile_treatments, default_class_names, load_bundle
+
 # Define image dimensions
 img_width = 224
 img_height = 224
 
-# Load the trained model
+# TensorFlow and the trained model are loaded on first use, so importing this module stays cheap.
+# A .tflite file exported by model_export.py runs on the TFLite interpreter instead of Keras, and a
+# .bundle file from model_bundle.py also carries its own class names and treatment table.
 model_path = 'apple_disease_model.keras'  # Correct path
-model = load_model(model_path)
+model = None  # an inference_backend backend: model.predict(images) -> probabilities
+bundle = None  # the model_bundle.ModelBundle when model_path is a bundle
+treatment_table = None
 
-# Load treatment data
+# Treatment data (only read when the model isn't a bundle)
 treatments_file = 'treatments.json'  # Correct path
-with open(treatments_file, "r") as f:
-    treatment_data = json.load(f)
+
+def get_model():
+    global model, bundle
+    if model is None:
+        if model_path.endswith(BUNDLE_EXTENSION):
+            bundle = load_bundle(model_path)
+            model = bundle.backend
+        else:
+            model = load_backend(model_path)
+    return model
+
+def get_class_names():
+    """Class names in model output order: baked into a bundle, otherwise the flow_from_directory order."""
+    get_model()
+    return bundle.class_names if bundle is not None else default_class_names
+
+def get_treatment_table():
+    """Advice payloads indexed by class index (see model_bundle.compile_treatments)."""
+    global treatment_table
+    if treatment_table is None:
+        get_model()
+        if bundle is not None:
+            treatment_table = bundle.treatments
+        else:
+            try:
+                with open(treatments_file, "r") as f:
+                    treatment_data = json.load(f)
+            except FileNotFoundError:
+                print(f"Error: Treatment data not found at {treatments_file}")
+                treatment_data = {}
+            treatment_table = compile_treatments(treatment_data, get_class_names())
+    return treatment_table
+
+def load_image_array(image_path, img_width, img_height):
+    """
+    Loads an image (a path or a binary file object) as a normalized (img_height, img_width, 3) float32
+    array, decoded exactly as the training data was (image_io.decode_and_resize).
+    """
+    from image_io import decode_and_resize
+
+    img_array = decode_and_resize(image_path, (img_width, img_height)).astype(np.float32)
+    img_array /= 255.0  # Normalize
+    return img_array
 
 def predict_image(image_path, img_width, img_height):
     try:
-        img = image.load_img(image_path, target_size=(img_width, img_height))
-        img_array = image.img_to_array(img)
+        img_array = load_image_array(image_path, img_width, img_height)
         img_array = np.expand_dims(img_array, axis=0)  # Add a batch dimension
-        img_array /= 255.0  # Normalize
 
-        prediction = model.predict(img_array)
+        prediction = get_model().predict(img_array)
         predicted_class = np.argmax(prediction)  # Get the class with the highest probability
         return predicted_class
     except Exception as e:
         print(f"Error processing image {image_path}: {e}")
         return None  # Or handle the error as needed
 
+def predict_image_tiled(image_path, **options):
+    """
+    Scores a high-resolution photo as overlapping 224x224 leaf tiles in one batch instead of
+    squashing it to 224x224 (see tiled_inference.predict_tiled for the options and result).
+    """
+    from tiled_inference import predict_tiled
+
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    return predict_tiled(image_bytes, get_model(), get_class_names(), **options)
+
+def _load_or_none(image_path, img_width, img_height):
+    try:
+        return load_image_array(image_path, img_width, img_height)
+    except Exception as e:
+        print(f"Error processing image {image_path}: {e}")
+        return None
+
+def predict_images(image_paths, batch_size=32, img_width=img_width, img_height=img_height, num_threads=None):
+    """
+    Scores many images with one model call per batch.
+    Images are decoded by a thread pool while the previous batch is in the model. Every batch is
+    padded to batch_size so the backend only ever sees one input shape.
+    Args:
+        image_paths: Paths of the images to score.
+        batch_size: Number of images per model call.
+        img_width: Width the images are resized to.
+        img_height: Height the images are resized to.
+        num_threads: Decoding threads (defaults to the number of CPUs).
+    Yields:
+        One dict per input path, in input order: {'path', 'class_index', 'probabilities'}.
+        Images that fail to load get class_index None and an 'error' key.
+    """
+    image_paths = list(image_paths)
+    backend = get_model()
+    batch = np.zeros((batch_size, img_height, img_width, 3), dtype=np.float32)
+
+    with ThreadPoolExecutor(max_workers=num_threads or os.cpu_count()) as pool:
+        def submit(start):
+            return [pool.submit(_load_or_none, path, img_width, img_height)
+                    for path in image_paths[start:start + batch_size]]
+
+        pending = submit(0)
+        for start in range(0, len(image_paths), batch_size):
+            arrays = [future.result() for future in pending]
+            pending = submit(start + batch_size)  # decode the next batch while this one runs
+
+            for row, img_array in enumerate(arrays):
+                batch[row] = img_array if img_array is not None else 0.0
+            probabilities = backend.predict(batch)
+
+            for row, img_array in enumerate(arrays):
+                path = image_paths[start + row]
+                if img_array is None:
+                    yield {'path': path, 'class_index': None, 'probabilities': None, 'error': 'could not load image'}
+                else:
+                    yield {'path': path, 'class_index': int(np.argmax(probabilities[row])),
+                           'probabilities': probabilities[row].tolist()}
+
+if __name__ == '__main__':
+    # Example usage:
+    image_path = r'C:\Users\siddh\Projects\New folder\prediction_image_for_model_test/images3.jpg'  # Correct path
+
+    if os.path.exists(image_path):
+        predicted_class = predict_image(image_path, img_width, img_height)
+
+        if predicted_class is not None:
+            try:
+                advice = get_treatment_table()[predicted_class]
+                print(f"Predicted class: {advice['class_name']}")
+                print(advice['text'])
 
-# Example usage:
-image_path = r'C:\Users\siddh\Projects\New folder\prediction_image_for_model_test/images3.jpg'  # Correct path
-
-if os.path.exists(image_path):
-    predicted_class = predict_image(image_path, img_width, img_height)
-
-    if predicted_class is not None:
-        try:
-            train_dir = r'C:\Users\siddh\Projects\New folder\preprocessed_data\train'  # Correct path
-            class_names = os.listdir(train_dir)
-            predicted_class_name = class_names[predicted_class]
-
-            if predicted_class_name in treatment_data:
-                treatments = treatment_data[predicted_class_name]["treatments"]
-                general_advice = treatment_data[predicted_class_name].get("general_advice", [])
-
-                print(f"Predicted class: {predicted_class_name}")
-                print("\nTreatment Suggestions:")
-                for treatment in treatments:
-                    print(f"- {treatment['name']}: {treatment['description']}")
-                    print(f"  Long-term Effectiveness: {treatment['long_term_effectiveness']}")
-                    print("  Sources:")
-                    for source in treatment['sources']:
-                        print(f"    - {source}")
-                    print()
-
-                if general_advice:
-                    print("General Advice:")
-                    for advice_item in general_advice:
-                        print(f"- {advice_item['advice']}")
-                        if "links" in advice_item:
-                            for link in advice_item["links"]:
-                                print(f"  - Learn more: {link}")
-                        print()
-
-            else:
-                print(f"No treatment information found for {predicted_class_name}")
-
-        except IndexError:
-            print(f"Error: Predicted class index {predicted_class} is out of range.")
-        except FileNotFoundError:
-            print(f"Error: Training directory not found at {train_dir} or {treatments_file}")  # Include treatments file
+            except IndexError:
+                print(f"Error: Predicted class index {predicted_class} is out of range.")
+        else:
+            print("Prediction failed. Check image processing errors.")
     else:
-        print("Prediction failed. Check image processing errors.")
-else:
-    print(f"Error: Image file not found at {image_path}")
\ No newline at end of file
+        print(f"Error: Image file not found at {image_path}")
\ No newline at end of file
@@ -1,6 +1,6 @@
-import cv2
 import numpy as np
 import os
+from image_io import decode_and_resize
 
 def preprocess_single_image(image_path, target_size=(224, 224), save_dir=None):
     """
@@ -13,12 +13,12 @@ def preprocess_single_image(image_path, target_size=(224, 224), save_dir=None):
         A NumPy array representing the preprocessed image, or None if there was an error.
     """
     try:
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"Error: Could not load image at {image_path}")
+        try:
+            image = decode_and_resize(image_path, target_size)  # same decode as training and serving
+        except ValueError as e:
+            print(f"Error: Could not load image at {image_path}: {e}")
             return None
 
-        image = cv2.resize(image, target_size)
         image = image.astype('float32') / 255.0  # Normalize to [0, 1]
         
         if save_dir:
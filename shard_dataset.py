@@ -0,0 +1,171 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from data_preprocessing import load_resized_image
+from image_io import DECODE_PARAMS
+
+# Packed dataset layout (one directory per split):
+#   shard-00000.bin, shard-00001.bin, ...  raw uint8 images, fixed-size records back to back
+#   index.npz                               shard/offset/label/path per image + class names, image shape
+#                                           and the image decode the records were made with
+INDEX_NAME = 'index.npz'
+SHARD_PATTERN = 'shard-{:05d}.bin'
+
+# ***CORRECT PATHS TO THE SPLIT IMAGES AND TO THE PACKED OUTPUT***
+base_dir = r'C:\Users\siddh\Projects\New folder\apple_disease_split'
+packed_base_dir = r'C:\Users\siddh\Projects\New folder\packed_data'  # Parent folder of packed train, val, test
+
+def _load_worker(task):
+    """Runs in a pool process: decodes and resizes one image to uint8."""
+    image_path, target_size = task
+    return load_resized_image(image_path, target_size)
+
+def is_packed(data_dir):
+    """True if data_dir holds a packed shard dataset rather than class folders."""
+    return os.path.exists(os.path.join(data_dir, INDEX_NAME))
+
+def write_shards(data_dir, save_dir, target_size=(224, 224), images_per_shard=4096, workers=None):
+    """
+    Packs every image under data_dir/<class>/ into a few large uint8 shard files.
+    Args:
+        data_dir: Directory with one sub-folder of images per class.
+        save_dir: Directory to write the shards and index to.
+        target_size: The desired size of the images (width, height).
+        images_per_shard: Number of images per shard file (4096 images of 224x224x3 = ~600 MB).
+        workers: Number of worker processes used for decoding (defaults to the number of CPUs).
+    Returns:
+        The number of images packed.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    start_time = time.perf_counter()
+
+    # Sorted so class indices match flow_from_directory's
+    class_names = sorted(name for name in os.listdir(data_dir)
+                         if os.path.isdir(os.path.join(data_dir, name)))
+    image_paths = []
+    labels = []
+    for class_index, class_name in enumerate(class_names):
+        class_path = os.path.join(data_dir, class_name)
+        for image_name in sorted(os.listdir(class_path)):
+            image_paths.append(os.path.join(class_path, image_name))
+            labels.append(class_index)
+
+    image_shape = (target_size[1], target_size[0], 3)  # cv2 sizes are (width, height)
+    record_bytes = int(np.prod(image_shape))
+    shard_ids, offsets, kept_labels, kept_paths, shard_files = [], [], [], [], []
+    shard_file = None
+
+    workers = workers or os.cpu_count() or 1
+    tasks = [(image_path, target_size) for image_path in image_paths]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_load_worker, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+            for image_path, label, image in zip(image_paths, labels, results):
+                if image is None:
+                    print(f"Warning: Image {image_path} could not be preprocessed. Skipping.")
+                    continue
+                if shard_file is None or len(kept_paths) % images_per_shard == 0:
+                    if shard_file is not None:
+                        shard_file.close()
+                    shard_files.append(SHARD_PATTERN.format(len(shard_files)))
+                    shard_file = open(os.path.join(save_dir, shard_files[-1]), 'wb')
+                shard_ids.append(len(shard_files) - 1)
+                offsets.append(shard_file.tell())
+                shard_file.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+                kept_labels.append(label)
+                kept_paths.append(os.path.relpath(image_path, data_dir))
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+
+    # The index goes last, so a crashed run never looks like a complete dataset
+    np.savez(os.path.join(save_dir, INDEX_NAME),
+             shard=np.array(shard_ids, dtype=np.int32),
+             offset=np.array(offsets, dtype=np.int64),
+             label=np.array(kept_labels, dtype=np.int32),
+             path=np.array(kept_paths, dtype=str),
+             shards=np.array(shard_files, dtype=str),
+             class_names=np.array(class_names, dtype=str),
+             image_shape=np.array(image_shape, dtype=np.int64),
+             record_bytes=np.array(record_bytes, dtype=np.int64),
+             decode=np.array(json.dumps(DECODE_PARAMS, sort_keys=True)))
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Packed {len(kept_paths)} images from {data_dir} into {len(shard_files)} shard(s) "
+          f"in {elapsed:.1f}s ({len(kept_paths) / max(elapsed, 1e-9):.1f} images/sec)")
+    return len(kept_paths)
+
+class ShardDataset:
+    """
+    Read-only view of a packed split. Images stay as uint8 in memory-mapped shard files
+    and are only converted to normalized float32 when a batch is assembled.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        with np.load(os.path.join(data_dir, INDEX_NAME)) as index:
+            self.shard_ids = index['shard']
+            self.offsets = index['offset']
+            self.labels = index['label']
+            self.paths = index['path']
+            self.shard_files = [str(name) for name in index['shards']]
+            self.class_names = [str(name) for name in index['class_names']]
+            self.image_shape = tuple(int(dim) for dim in index['image_shape'])
+            self.record_bytes = int(index['record_bytes'])
+            decode = json.loads(str(index['decode'])) if 'decode' in index.files else None
+        if decode != DECODE_PARAMS:
+            raise ValueError(f"{data_dir} was packed from images decoded differently ({decode}); "
+                             f"repack it with write_shards so training sees the pixels the model is served")
+        self.rows = self.offsets // self.record_bytes
+        self.shards = [np.memmap(os.path.join(data_dir, name), dtype=np.uint8, mode='r').reshape((-1,) + self.image_shape)
+                       for name in self.shard_files]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def image(self, i):
+        """The raw uint8 image (a view into the shard, no copy)."""
+        return self.shards[self.shard_ids[i]][self.rows[i]]
+
+    def batch(self, indices):
+        """Gathers the given images into one normalized float32 batch."""
+        images = np.empty((len(indices),) + self.image_shape, dtype=np.float32)
+        for out_row, i in enumerate(indices):
+            images[out_row] = self.image(i)
+        images /= 255.0
+        return images, self.labels[indices]
+
+    def batches(self, batch_size, shuffle=False, seed=None):
+        """Yields (images, labels) batches, optionally in a seeded random order."""
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for start in range(0, len(order), batch_size):
+            yield self.batch(order[start:start + batch_size])
+
+    def to_tf_dataset(self, batch_size, shuffle=True, seed=None):
+        """Wraps batches() in a tf.data.Dataset that the Keras loaders can consume."""
+        import tensorflow as tf
+
+        output_signature = (
+            tf.TensorSpec(shape=(None,) + self.image_shape, dtype=tf.float32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        )
+        epochs = iter(range(1 << 30))
+
+        def generator():
+            # A new (but still reproducible) order every time the dataset is iterated
+            epoch_seed = None if seed is None else seed + next(epochs)
+            return self.batches(batch_size, shuffle=shuffle, seed=epoch_seed)
+
+        dataset = tf.data.Dataset.from_generator(generator, output_signature=output_signature)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+if __name__ == '__main__':
+    for split_name in ['train', 'val', 'test']:
+        write_shards(os.path.join(base_dir, split_name), os.path.join(packed_base_dir, split_name))
+
+    print("Finished packing")
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from image_io import DECODE_PARAMS
+
+# "Similar cases" and out-of-distribution rejection from the classifier's own features. Every labelled
+# training image is stored as its penultimate-layer embedding (the Dense(1024) output in new_model.py),
+# L2-normalised and compressed to float16 or int8. A query is matched by cosine similarity: exactly, with
+# blocked matrix products over the whole matrix, or through an IVF coarse index (k-means lists, only the
+# nprobe closest lists are scanned) for large sets. The cosine distance to the k-th nearest training image
+# is the OOD score: leaves of the four classes sit close to many training images, a photo of anything
+# else does not. The threshold is the distance that 95% of held-out in-distribution images stay under.
+#
+#   python similarity_index.py build --model apple_disease_model.keras --train-dir split/train --val-dir split/val
+#   python similarity_index.py query --model apple_disease_model.keras leaf.jpg
+
+index_path = 'similarity_index.npz'  # ***CORRECT PATH TO THE INDEX BUILT FROM THE TRAINING SET***
+default_k = 10  # neighbours used for the OOD score and returned as similar cases
+default_nprobe = 8  # IVF lists scanned per query
+ood_quantile = 0.95  # fraction of in-distribution validation images that must pass the OOD check
+search_block_rows = 16384  # rows decompressed to float32 at a time when the whole matrix isn't kept as float32
+float32_copy_mb = 256  # BLAS only multiplies float32, so indexes up to this size keep a float32 copy for searching
+
+def embedding_model(model):
+    """
+    A Keras model mapping images to [embeddings, probabilities]. The embeddings are the input of the final
+    softmax layer: the Dense(1024) output of new_model.py (the dropout in between is off at inference).
+    """
+    from tensorflow.keras.models import Model
+
+    last = model.layers[-1]
+    if isinstance(last, Model):  # embedding_cache.attach_head: backbone + nested head model
+        head = Model(last.input, [last.layers[-1].input, last.output])
+        return Model(model.input, head(model.layers[-2].output))
+    return Model(model.input, [last.input, model.output])
+
+class EmbeddingBackend:
+    """Like inference_backend.KerasBackend, but one forward pass also returns the embeddings."""
+
+    def __init__(self, keras_model):
+        import tensorflow as tf
+
+        self.model = keras_model
+        both = embedding_model(keras_model)
+        self._forward = tf.function(lambda x: both(x, training=False))
+
+    def predict_with_embeddings(self, images):
+        """Returns (probabilities, embeddings), both float32 (embeddings are float16 under mixed precision)."""
+        embeddings, probabilities = self._forward(np.asarray(images, dtype=np.float32))
+        return probabilities.numpy().astype(np.float32), embeddings.numpy().astype(np.float32)
+
+    def predict(self, images):
+        return self.predict_with_embeddings(images)[0]
+
+_backends = {}
+
+def embedding_backend(keras_model):
+    """One EmbeddingBackend per Keras model (each one traces its own function)."""
+    backend = _backends.get(id(keras_model))
+    if backend is None or backend.model is not keras_model:
+        backend = _backends[id(keras_model)] = EmbeddingBackend(keras_model)
+    return backend
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _quantize(vectors, dtype):
+    """Unit vectors -> (matrix, per-row scales): float16 as is, int8 scaled by each row's largest magnitude."""
+    if dtype == 'float16':
+        return vectors.astype(np.float16), None
+    if dtype == 'int8':
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"dtype must be 'float16' or 'int8', not {dtype!r}")
+
+def kmeans(vectors, num_lists, iterations=10, seed=0):
+    """Spherical k-means on unit vectors; returns (centroids, assignment of every vector)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.concatenate([np.argmax(vectors[start:start + search_block_rows] @ centroids.T, axis=1)
+                                     for start in range(0, len(vectors), search_block_rows)])
+        order = np.argsort(assignment, kind='stable')
+        present, starts = np.unique(assignment[order], return_index=True)
+        centroids[present] = _normalize(np.add.reduceat(vectors[order], starts))  # empty lists keep their centroid
+    return centroids, assignment
+
+class SimilarityIndex:
+    """
+    Compressed, L2-normalised embeddings of labelled images with top-k cosine search and an OOD score.
+    With an IVF index the rows are stored grouped by list, list i being rows list_offsets[i]:list_offsets[i + 1].
+    """
+
+    def __init__(self, matrix, scales, labels, class_names, paths, k=default_k, threshold=None,
+                 centroids=None, list_offsets=None, meta=None):
+        self.matrix = matrix
+        self.scales = scales
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.class_names = list(class_names)
+        self.paths = np.asarray(paths)
+        self.k = k
+        self.threshold = threshold
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.meta = meta or {}
+        # The compressed matrix is what is stored and shipped; a training set of a few thousand images
+        # (about 4 MB per 1000 images as float32) is searched from a float32 copy in one BLAS call
+        self._float32 = None
+        if matrix.size * 4 <= float32_copy_mb * 2**20:
+            self._float32 = self._rows(0, len(matrix))
+
+    @classmethod
+    def build(cls, embeddings, labels, class_names, paths, dtype='float16', num_lists=0, k=default_k, seed=0,
+              meta=None):
+        """
+        Args:
+            embeddings: (n, dim) float embeddings of the labelled images.
+            labels: Class index per image.
+            class_names: Class names in label order.
+            paths: Image path per row (returned with the similar cases).
+            dtype: 'float16' (2 bytes per value) or 'int8' (1 byte per value plus one scale per row).
+            num_lists: IVF lists (0: exact search only; about sqrt(n) for large sets).
+            k: Neighbours used for the OOD score.
+            seed: k-means seed.
+            meta: Extra JSON-able facts to store (e.g. the model fingerprint).
+        """
+        vectors = _normalize(embeddings)
+        labels, paths = np.asarray(labels), np.asarray(paths)
+        centroids = list_offsets = None
+        if num_lists:
+            centroids, assignment = kmeans(vectors, min(num_lists, len(vectors)), seed=seed)
+            order = np.argsort(assignment, kind='stable')
+            vectors, labels, paths = vectors[order], labels[order], paths[order]
+            list_offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        matrix, scales = _quantize(vectors, dtype)
+        meta = dict(meta or {}, dtype=dtype, dim=int(vectors.shape[1]), decode=DECODE_PARAMS)
+        return cls(matrix, scales, labels, class_names, paths, min(k, len(vectors)), None, centroids,
+                   list_offsets, meta)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def _rows(self, start, stop):
+        """Rows start:stop as float32."""
+        if self._float32 is not None:
+            return self._float32[start:stop]
+        block = self.matrix[start:stop].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:stop, None]
+        return block
+
+    def _exact(self, queries, k):
+        """Top-k over every row; without a float32 copy a block of rows at a time, so only one block is ever decompressed."""
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        block_rows = len(self.matrix) if self._float32 is not None else search_block_rows
+        for start in range(0, len(self.matrix), block_rows):
+            stop = min(start + block_rows, len(self.matrix))
+            scores = np.concatenate([best_scores, queries @ self._rows(start, stop).T], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, stop), (len(queries), stop - start))],
+                                  axis=1)
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k] if scores.shape[1] > k else np.argsort(-scores, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+        return best_scores, best_rows
+
+    def _ivf(self, queries, k, nprobe):
+        """Top-k over the rows of the nprobe lists whose centroids are closest to each query."""
+        nearest_lists = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), k), dtype=np.int64)
+        for i, lists in enumerate(nearest_lists):
+            ranges = [(self.list_offsets[j], self.list_offsets[j + 1]) for j in lists]  # each list is contiguous
+            rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+            scores = np.concatenate([self._rows(start, stop) @ queries[i] for start, stop in ranges])
+            keep = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            best_scores[i, :len(keep)] = scores[keep]
+            best_rows[i, :len(keep)] = rows[keep]
+        return best_scores, best_rows
+
+    def search(self, embeddings, k=None, nprobe=default_nprobe):
+        """
+        Cosine top-k of each query embedding.
+        Returns:
+            (similarities, rows): (queries, k) arrays, most similar first. Rows index labels/paths.
+        """
+        k = min(k or self.k, len(self.matrix))
+        queries = _normalize(np.atleast_2d(embeddings))
+        if self.centroids is not None and nprobe < len(self.centroids):
+            scores, rows = self._ivf(queries, k, nprobe)
+        else:
+            scores, rows = self._exact(queries, k)
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+    def ood_scores(self, similarities):
+        """Cosine distance to the k-th nearest labelled image (0: identical, up to 2)."""
+        return 1.0 - similarities[:, min(self.k, similarities.shape[1]) - 1]
+
+    def calibrate(self, embeddings, quantile=ood_quantile, exclude_self=False):
+        """
+        Sets the OOD threshold so that quantile of the given in-distribution embeddings pass. Use held-out
+        images; with exclude_self the indexed images themselves can be used (each one's own row is skipped).
+        Returns the threshold.
+        """
+        similarities, _ = self.search(embeddings, self.k + 1 if exclude_self else self.k)
+        if exclude_self:
+            similarities = similarities[:, 1:]
+        self.threshold = float(np.quantile(self.ood_scores(similarities), quantile))
+        return self.threshold
+
+    def query(self, embeddings, k=None, nprobe=default_nprobe):
+        """
+        Similar cases and OOD verdict of each query embedding.
+        Returns:
+            A list of JSON-able dicts: ood_score, ood_threshold, is_ood, and 'similar', the k nearest labelled
+            images (class_name, similarity, path), most similar first.
+        """
+        similarities, rows = self.search(embeddings, max(k or self.k, self.k), nprobe)
+        scores = self.ood_scores(similarities)
+        k = k or self.k
+        results = []
+        for query_similarities, query_rows, score in zip(similarities, rows, scores):
+            results.append({
+                'ood_score': float(score),
+                'ood_threshold': self.threshold,
+                'is_ood': bool(self.threshold is not None and score > self.threshold),
+                'similar': [{'class_name': self.class_names[self.labels[row]], 'similarity': float(similarity),
+                             'path': str(self.paths[row])}
+                            for similarity, row in zip(query_similarities[:k], query_rows[:k])
+                            if np.isfinite(similarity)],  # an IVF probe may find fewer than k rows
+            })
+        return results
+
+    def save(self, path):
+        """Writes the index to one .npz file."""
+        arrays = {'matrix': self.matrix, 'labels': self.labels, 'paths': self.paths.astype(str),
+                  'class_names': np.array(self.class_names)}
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        if self.centroids is not None:
+            arrays['centroids'] = self.centroids
+            arrays['list_offsets'] = self.list_offsets
+        settings = dict(self.meta, k=self.k, threshold=self.threshold)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, meta=np.array(json.dumps(settings)), **arrays)
+        os.replace(tmp_path, path)  # never leave a half-written index behind
+        return path
+
+def load_index(path, model_path=None):
+    """
+    Loads an index written by SimilarityIndex.save.
+    Raises:
+        ValueError: If model_path is given and is not the model the index was built with (or the index
+            doesn't record its model).
+    """
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        index = SimilarityIndex(data['matrix'], data['scales'] if 'scales' in data else None, data['labels'],
+                                [str(name) for name in data['class_names']], data['paths'], meta.pop('k'),
+                                meta.pop('threshold'), data['centroids'] if 'centroids' in data else None,
+                                data['list_offsets'] if 'list_offsets' in data else None, meta)
+    if model_path is not None:
+        from prediction_cache import model_fingerprint
+
+        if 'model' not in index.meta:
+            raise ValueError(f"{path} doesn't record the model it was built with; rebuild it with build_index("
+                             f"..., model_version=model_fingerprint(model_path))")
+        # Compare the weights' hash only, so a renamed copy of the same model still matches
+        if model_fingerprint(model_path).split(':')[-1] != index.meta['model'].split(':')[-1]:
+            raise ValueError(f"{path} was built with a different model ({index.meta['model']}); rebuild it "
+                             f"for {model_path}")
+    if index.meta.get('decode') != DECODE_PARAMS:
+        raise ValueError(f"{path} was built from images decoded differently; rebuild it")
+    return index
+
+def embed_files(backend, paths, img_width=224, img_height=224, batch_size=32):
+    """(probabilities, embeddings) of image files, decoded like the training data (augmentation.image_dataset)."""
+    from augmentation import image_dataset
+
+    probabilities, embeddings = [], []
+    for images, _ in image_dataset(paths, [0] * len(paths), img_width, img_height, batch_size):
+        batch_probabilities, batch_embeddings = backend.predict_with_embeddings(images)
+        probabilities.append(batch_probabilities)
+        embeddings.append(batch_embeddings)
+    return np.concatenate(probabilities), np.concatenate(embeddings)
+
+def build_index(keras_model, train_paths, train_labels, class_names, out_path=index_path, val_paths=None,
+                dtype='float16', num_lists=0, k=default_k, model_version=None, img_width=224, img_height=224,
+                batch_size=32):
+    """
+    Embeds the labelled training images with the trained model, indexes them and calibrates the OOD
+    threshold on the validation images (or, without them, leave-one-out on the training images).
+    model_version (prediction_cache.model_fingerprint of the model file) lets load_index refuse a different model.
+    Returns the SimilarityIndex (also saved to out_path).
+    """
+    backend = embedding_backend(keras_model)
+    start_time = time.perf_counter()
+    _, embeddings = embed_files(backend, train_paths, img_width, img_height, batch_size)
+    print(f"Embedded {len(train_paths)} training images in {time.perf_counter() - start_time:.1f}s")
+    meta = {'input': [img_width, img_height]}
+    if model_version:
+        meta['model'] = model_version
+    index = SimilarityIndex.build(embeddings, train_labels, class_names, train_paths, dtype, num_lists, k, meta=meta)
+    if val_paths:
+        index.calibrate(embed_files(backend, val_paths, img_width, img_height, batch_size)[1])
+    else:
+        index.calibrate(embeddings, exclude_self=True)
+    index.save(out_path)
+    print(f"Wrote {out_path}: {len(index)} x {index.meta['dim']} {dtype} "
+          f"({index.matrix.nbytes / 2**20:.1f} MB), OOD threshold {index.threshold:.3f}")
+    return index
+
+if __name__ == '__main__':
+    from augmentation import list_image_files
+
+    parser = argparse.ArgumentParser(description="Similar-case index and OOD check over the model's embeddings")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Index the training images")
+    build_parser.add_argument('--model', required=True, help="Trained .keras model")
+    build_parser.add_argument('--train-dir', required=True, help="Labelled images in <class>/ folders")
+    build_parser.add_argument('--val-dir', help="Held-out images for calibrating the OOD threshold")
+    build_parser.add_argument('--out', default=index_path)
+    build_parser.add_argument('--dtype', choices=['float16', 'int8'], default='float16')
+    build_parser.add_argument('--lists', type=int, default=0, help="IVF lists (0: exact search; ~sqrt(n) for large sets)")
+    build_parser.add_argument('--k', type=int, default=default_k)
+    query_parser = subparsers.add_parser('query', help="Similar cases and OOD scores of images")
+    query_parser.add_argument('images', nargs='+')
+    query_parser.add_argument('--model', required=True)
+    query_parser.add_argument('--index', default=index_path)
+    query_parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+    from prediction_cache import model_fingerprint
+
+    if args.command == 'build':
+        train_paths, train_labels, class_names = list_image_files(args.train_dir)
+        val_paths = list_image_files(args.val_dir)[0] if args.val_dir else None
+        build_index(load_model(args.model), train_paths, train_labels, class_names, args.out, val_paths, args.dtype,
+                    args.lists, args.k, model_fingerprint(args.model))
+    else:
+        index = load_index(args.index, args.model)
+        probabilities, embeddings = embed_files(EmbeddingBackend(load_model(args.model)), args.images)
+        start_time = time.perf_counter()
+        results = index.query(embeddings, args.k)
+        search_ms = 1000 * (time.perf_counter() - start_time) / len(args.images)
+        for image_path, image_probabilities, result in zip(args.images, probabilities, results):
+            verdict = 'REJECTED (not like any training image)' if result['is_ood'] else \
+                index.class_names[int(np.argmax(image_probabilities))]
+            print(f"{image_path}: {verdict}, OOD score {result['ood_score']:.3f} (threshold {result['ood_threshold']:.3f})")
+            for case in result['similar']:
+                print(f"  {case['similarity']:.3f} {case['class_name']}: {case['path']}")
+        print(f"Search: {search_ms:.2f} ms per image over {len(index)} indexed images")
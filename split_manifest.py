@@ -0,0 +1,176 @@
+import os
+import csv
+import random
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Splits are rows in a CSV instead of files moved between folders. The images stay in the cleaned
+# dataset (<root>/<class>/<name>) and every row says which split (and cross-validation fold) the
+# image belongs to, so re-splitting or switching folds never touches the image files.
+#
+#   path,class,split,fold,sha1
+#   apple_scab/0a5e9323.jpg,apple_scab,train,3,5f1c...
+#
+# path is relative to the folder the manifest is in. fold is -1 for test images.
+
+# ***CORRECT PATH TO THE CLEANED DATASET***
+cleaned_dataset_path = r'C:\Users\siddh\Projects\New folder\apple_disease_cleaned'
+manifest_path = os.path.join(cleaned_dataset_path, 'split_manifest.csv')
+
+split_ratio = (0.7, 0.15, 0.15)  # train, val, test
+manifest_fields = ['path', 'class', 'split', 'fold', 'sha1']
+
+def _file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_dataset(root, num_threads=None):
+    """Lists <root>/<class>/<file> with content hashes (hashed on a thread pool). Returns records sorted by path."""
+    records = []
+    for class_name in sorted(os.listdir(root)):
+        class_path = os.path.join(root, class_name)
+        if not os.path.isdir(class_path):
+            continue
+        for image_name in sorted(os.listdir(class_path)):
+            records.append({'path': class_name + '/' + image_name, 'class': class_name})
+
+    with ThreadPoolExecutor(max_workers=num_threads or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        hashes = pool.map(_file_sha1, [os.path.join(root, record['path']) for record in records])
+        for record, sha1 in zip(records, hashes):
+            record['sha1'] = sha1
+    return records
+
+def assign_splits(records, seed=0, split_ratio=split_ratio, folds=5):
+    """
+    Stratified, seeded assignment of records to train/val/test and to cross-validation folds.
+    Each class is shuffled on its own, so every split keeps the class proportions. Identical files
+    (same sha1) are kept together so a duplicate can never end up in both train and test.
+    The same records, seed, ratio and folds always give the same assignment.
+    Args:
+        records: Dicts with 'path', 'class' and 'sha1' (from scan_dataset or read_manifest).
+        seed: Random seed.
+        split_ratio: (train, val, test) fractions.
+        folds: Number of folds the non-test images are divided into for cross-validation.
+    Returns:
+        New records with 'split' and 'fold' set, sorted by path.
+    """
+    rng = random.Random(seed)
+    by_class = {}
+    for record in sorted(records, key=lambda r: r['path']):
+        by_class.setdefault(record['class'], {}).setdefault(record['sha1'], []).append(record)
+
+    assigned = []
+    for class_name in sorted(by_class):
+        groups = [by_class[class_name][sha1] for sha1 in sorted(by_class[class_name])]
+        rng.shuffle(groups)
+
+        # Same rounding as data_split.divide_dataset, but over unique images
+        train_count = int(len(groups) * split_ratio[0])
+        val_count = int(len(groups) * (split_ratio[0] + split_ratio[1]))
+        for index, group in enumerate(groups):
+            if index < train_count:
+                split = 'train'
+            elif index < val_count:
+                split = 'val'
+            else:
+                split = 'test'
+            # Folds are dealt round-robin over the shuffled non-test images, so they are stratified too
+            fold = index % folds if split != 'test' else -1
+            for record in group:
+                assigned.append({'path': record['path'], 'class': record['class'],
+                                 'split': split, 'fold': fold, 'sha1': record['sha1']})
+    return sorted(assigned, key=lambda r: r['path'])
+
+def write_manifest(manifest_path, records):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=manifest_fields)
+        writer.writeheader()
+        writer.writerows(records)
+    os.replace(tmp_path, manifest_path)
+
+def read_manifest(manifest_path):
+    with open(manifest_path, 'r', newline='') as f:
+        records = list(csv.DictReader(f))
+    for record in records:
+        record['fold'] = int(record['fold'])
+    return records
+
+def select(records, split, fold=None):
+    """
+    The records of one split. With fold=k, 'val' is fold k of the non-test images and 'train' is
+    every other non-test image (k-fold cross-validation); 'test' is always the held-out test split.
+    """
+    if split not in ('train', 'val', 'test'):
+        raise ValueError(f"Unknown split {split!r}")
+    if fold is None or split == 'test':
+        return [record for record in records if record['split'] == split]
+    if split == 'val':
+        return [record for record in records if record['split'] != 'test' and record['fold'] == fold]
+    return [record for record in records if record['split'] != 'test' and record['fold'] != fold]
+
+def class_names_of(records):
+    """Class names in sorted order (the order flow_from_directory uses), taken from the whole manifest."""
+    return sorted({record['class'] for record in records})
+
+def manifest_files(manifest_path, split, data_dir=None, extension=None, fold=None):
+    """
+    Paths and class indices of one split, for the loaders.
+    Args:
+        manifest_path: Manifest written by this script.
+        split: 'train', 'val' or 'test'.
+        data_dir: Tree the files are read from (defaults to the manifest's folder). Pass the
+            preprocessed tree of the whole cleaned dataset to load the .npy files instead.
+        extension: Replaces the file extension, e.g. '.npy' for preprocessed data.
+        fold: Cross-validation fold (see select).
+    Returns:
+        (paths, labels, class_names)
+    """
+    records = read_manifest(manifest_path)
+    class_names = class_names_of(records)
+    class_index = {name: index for index, name in enumerate(class_names)}
+    data_dir = data_dir or os.path.dirname(os.path.abspath(manifest_path))
+
+    paths = []
+    labels = []
+    for record in select(records, split, fold):
+        relative_path = record['path']
+        if extension:
+            relative_path = os.path.splitext(relative_path)[0] + extension
+        paths.append(os.path.join(data_dir, *relative_path.split('/')))
+        labels.append(class_index[record['class']])
+    return paths, labels, class_names
+
+def summarize(records):
+    counts = {}
+    for record in records:
+        key = (record['split'], record['class'])
+        counts[key] = counts.get(key, 0) + 1
+    for split in ('train', 'val', 'test'):
+        per_class = ", ".join(f"{name}: {counts.get((split, name), 0)}" for name in class_names_of(records))
+        print(f"{split}: {per_class}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a seeded, stratified train/val/test split manifest")
+    parser.add_argument('--root', default=cleaned_dataset_path, help="Cleaned dataset with one folder per class")
+    parser.add_argument('--out', default=None, help="Manifest path (defaults to <root>/split_manifest.csv)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ratio', type=float, nargs=3, default=split_ratio, metavar=('TRAIN', 'VAL', 'TEST'))
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--resplit', action='store_true',
+                        help="Reassign splits using the hashes already in the manifest (no file reads)")
+    args = parser.parse_args()
+
+    out_path = args.out or os.path.join(args.root, 'split_manifest.csv')
+    if args.resplit:
+        records = read_manifest(out_path)
+    else:
+        records = scan_dataset(args.root)
+    records = assign_splits(records, args.seed, args.ratio, args.folds)
+    write_manifest(out_path, records)
+    summarize(records)
+    print(f"Wrote {len(records)} rows to {out_path}")
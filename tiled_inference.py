@@ -0,0 +1,226 @@
+import os
+import time
+import argparse
+import numpy as np
+
+# Tiled inference for high-resolution field photos. Squashing a 20-megapixel photo to 224x224 erases
+# small scab and rust lesions, so instead the photo is decoded once at a working resolution, cut into
+# overlapping 224x224 tiles, background tiles are dropped with a colour mask, and all remaining tiles
+# go through the model as one batch. Tile scores are aggregated into one verdict plus a heatmap.
+
+tile_size = 224  # the model input size
+working_size = 1120  # long side of the image the tiles are cut from (a tile then spans 1/5 of the photo)
+tile_overlap = 0.25  # fraction of a tile shared with its neighbour
+min_leaf_fraction = 0.2  # tiles with less leaf (green/yellow/brown) area than this are skipped
+disease_threshold = 0.5  # a disease is reported if any tile is at least this sure of it
+healthy_class = 'healthy'
+
+def decode_working_image(image_bytes, max_side=working_size):
+    """
+    Decodes an image to RGB uint8 with its long side at most max_side. JPEGs are shrunk by the
+    decoder itself (1/2, 1/4 or 1/8 DCT scaling) as far as possible first, so a large photo is never
+    fully decoded.
+    Returns:
+        (image, original (width, height))
+    """
+    import cv2
+    from image_io import read_image_header, decode_at_least
+
+    try:
+        _, width, height, _ = read_image_header(image_bytes)
+    except ValueError:
+        width = height = 0  # let the decoder have a go at it in full
+    # Only the long side has to stay at least max_side
+    image, (width, height) = decode_at_least(image_bytes, max_side if width >= height else 0,
+                                             max_side if height > width else 0)
+
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, (round(image.shape[1] * scale), round(image.shape[0] * scale)),
+                           interpolation=cv2.INTER_AREA)
+    return image, (width, height)
+
+def tile_origins(length, size, overlap):
+    """Top/left offsets of tiles covering [0, length); the last tile is aligned to the far edge."""
+    if length <= size:
+        return [0]
+    stride = max(1, int(size * (1 - overlap)))
+    origins = list(range(0, length - size, stride))
+    return origins + [length - size]
+
+def leaf_mask(image):
+    """
+    Vectorized leaf-pixel mask of an RGB uint8 image: saturated, not too dark pixels with a green,
+    yellow or brown hue (healthy and diseased leaf tissue), which excludes sky, shadows and grey background.
+    """
+    import cv2
+
+    hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)  # hue in [0, 180)
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    return (hue >= 5) & (hue <= 90) & (saturation >= 40) & (value >= 40)
+
+def cut_tiles(image, size=tile_size, overlap=tile_overlap, min_leaf=min_leaf_fraction):
+    """
+    Cuts overlapping size x size tiles and keeps the ones with enough leaf in them.
+    Returns:
+        (tiles, positions, leaf_fraction, origins): the kept tiles as a (n, size, size, 3) float32 [0, 1]
+        batch, their (row, col) grid positions, the (rows, cols) grid of leaf fractions of all tiles,
+        and the (y, x) pixel offsets of the grid rows and columns.
+    """
+    height, width = image.shape[:2]
+    if height < size or width < size:  # pad small images up to one tile
+        padded = np.zeros((max(height, size), max(width, size), 3), dtype=image.dtype)
+        padded[:height, :width] = image
+        image, height, width = padded, padded.shape[0], padded.shape[1]
+
+    ys, xs = tile_origins(height, size, overlap), tile_origins(width, size, overlap)
+    # Summed-area table: the leaf fraction of every tile in O(1) each
+    integral = np.pad(leaf_mask(image).astype(np.int32).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    y0, x0 = np.array(ys)[:, None], np.array(xs)[None, :]
+    leaf_pixels = (integral[y0 + size, x0 + size] - integral[y0, x0 + size]
+                   - integral[y0 + size, x0] + integral[y0, x0])
+    leaf_fraction = leaf_pixels / float(size * size)
+
+    positions = [tuple(p) for p in np.argwhere(leaf_fraction >= min_leaf)]
+    if not positions:  # no leaf found: score the tile most likely to hold one rather than nothing
+        positions = [np.unravel_index(np.argmax(leaf_fraction), leaf_fraction.shape)]
+    tiles = np.empty((len(positions), size, size, 3), dtype=np.float32)
+    for i, (row, col) in enumerate(positions):
+        tiles[i] = image[ys[row]:ys[row] + size, xs[col]:xs[col] + size]
+    tiles /= 255.0
+    return tiles, positions, leaf_fraction, (ys, xs)
+
+def aggregate(tile_probabilities, class_names, threshold=disease_threshold):
+    """
+    Image-level verdict from tile probabilities. Lesions usually cover only a few tiles, so averaging
+    would hide them: a disease is reported if any tile gives it at least threshold (the disease with
+    the most confident tile wins); otherwise the image gets the class with the highest mean probability.
+    Returns:
+        (class_index, image-level probabilities: the per-class maximum over tiles for a disease verdict,
+        else the mean)
+    """
+    mean = tile_probabilities.mean(axis=0)
+    peak = tile_probabilities.max(axis=0)
+    diseases = [i for i, name in enumerate(class_names) if name != healthy_class]
+    best_disease = max(diseases, key=lambda i: peak[i]) if diseases else None
+    if best_disease is not None and peak[best_disease] >= threshold:
+        return best_disease, peak
+    return int(np.argmax(mean)), mean
+
+def predict_tiled(image_bytes, backend, class_names, max_side=working_size, overlap=tile_overlap,
+                  min_leaf=min_leaf_fraction, threshold=disease_threshold, max_batch_size=64):
+    """
+    Scores one photo tile by tile.
+    Args:
+        image_bytes: The encoded image.
+        backend: Anything with predict(images) -> probabilities (inference_backend / model_bundle).
+        class_names: Class names in model output order.
+        max_side: Working resolution (long side) the tiles are cut from.
+        overlap: Tile overlap fraction.
+        min_leaf: Minimum leaf fraction for a tile to be scored.
+        threshold: Tile confidence needed to report a disease.
+        max_batch_size: Tiles per model call (all of them in one call for typical photos).
+    Returns:
+        A JSON-able dict: class_index, class_name, confidence, probabilities, tile counts and grid,
+        and 'heatmap', a {class name: rows x cols grid} of tile probabilities (None for skipped tiles).
+    """
+    start_time = time.perf_counter()
+    image, original_size = decode_working_image(image_bytes, max_side)
+    tiles, positions, leaf_fraction, (ys, xs) = cut_tiles(image, tile_size, overlap, min_leaf)
+    decode_seconds = time.perf_counter() - start_time
+
+    probabilities = np.concatenate([backend.predict(tiles[start:start + max_batch_size])
+                                    for start in range(0, len(tiles), max_batch_size)])
+    class_index, image_probabilities = aggregate(probabilities, class_names, threshold)
+
+    rows, cols = leaf_fraction.shape
+    heatmap = {}
+    for class_position, name in enumerate(class_names):
+        grid = [[None] * cols for _ in range(rows)]
+        for (row, col), tile_probabilities in zip(positions, probabilities):
+            grid[row][col] = float(tile_probabilities[class_position])
+        heatmap[name] = grid
+
+    return {
+        'class_index': int(class_index),
+        'class_name': class_names[class_index],
+        'confidence': float(image_probabilities[class_index]),
+        'probabilities': {name: float(p) for name, p in zip(class_names, image_probabilities)},
+        'tiles': {'rows': int(rows), 'cols': int(cols), 'scored': len(positions),
+                  'skipped': int(rows * cols - len(positions)), 'tile_size': tile_size,
+                  'origins_y': [int(y) for y in ys], 'origins_x': [int(x) for x in xs],
+                  'working_size': [int(image.shape[1]), int(image.shape[0])],
+                  'original_size': [int(original_size[0]), int(original_size[1])]},
+        'heatmap': heatmap,
+        'timings_ms': {'decode_and_tile': 1000 * decode_seconds,
+                       'total': 1000 * (time.perf_counter() - start_time)},
+    }
+
+def save_heatmap_overlay(image_bytes, result, out_path, max_side=working_size):
+    """
+    Writes the photo at working resolution with the disease heatmap blended over it (red: the tile is
+    sure of a disease, blue: healthy; skipped tiles are left as they are). Needs no display.
+    """
+    import cv2
+
+    image, _ = decode_working_image(image_bytes, max_side)
+    class_names = list(result['heatmap'])
+    diseases = [name for name in class_names if name != healthy_class] or class_names
+    rows, cols = result['tiles']['rows'], result['tiles']['cols']
+    ys, xs = result['tiles']['origins_y'], result['tiles']['origins_x']
+    height, width = max(image.shape[0], tile_size), max(image.shape[1], tile_size)
+
+    score = np.zeros((height, width), dtype=np.float32)
+    weight = np.zeros((height, width), dtype=np.float32)
+    for row in range(rows):
+        for col in range(cols):
+            values = [result['heatmap'][name][row][col] for name in diseases]
+            if values[0] is None:
+                continue
+            score[ys[row]:ys[row] + tile_size, xs[col]:xs[col] + tile_size] += max(values)
+            weight[ys[row]:ys[row] + tile_size, xs[col]:xs[col] + tile_size] += 1
+    scored = weight > 0
+    score[scored] /= weight[scored]
+
+    colours = cv2.applyColorMap((score * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    overlay = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    canvas[:overlay.shape[0], :overlay.shape[1]] = overlay
+    blended = cv2.addWeighted(canvas, 0.6, colours, 0.4, 0)
+    canvas[scored] = blended[scored]
+    cv2.imwrite(out_path, canvas[:image.shape[0], :image.shape[1]])
+    return out_path
+
+if __name__ == '__main__':
+    import json
+    import prediction_model
+
+    parser = argparse.ArgumentParser(description="Tiled inference for high-resolution photos")
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--model', default=prediction_model.model_path, help=".keras, .tflite or .bundle model")
+    parser.add_argument('--working-size', type=int, default=working_size,
+                        help="Long side (pixels) the tiles are cut from; larger means smaller regions per tile")
+    parser.add_argument('--overlap', type=float, default=tile_overlap)
+    parser.add_argument('--min-leaf', type=float, default=min_leaf_fraction)
+    parser.add_argument('--threshold', type=float, default=disease_threshold)
+    parser.add_argument('--heatmap-dir', help="Also write <name>_heatmap.jpg overlays here")
+    args = parser.parse_args()
+
+    prediction_model.model_path = args.model
+    backend = prediction_model.get_model()
+    class_names = prediction_model.get_class_names()
+    for image_path in args.images:
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+        result = predict_tiled(image_bytes, backend, class_names, args.working_size, args.overlap, args.min_leaf,
+                               args.threshold)
+        tiles = result['tiles']
+        print(f"{image_path}: {result['class_name']} ({result['confidence']:.2f}), "
+              f"{tiles['scored']} of {tiles['rows'] * tiles['cols']} tiles scored, "
+              f"{result['timings_ms']['total']:.0f} ms")
+        if args.heatmap_dir:
+            os.makedirs(args.heatmap_dir, exist_ok=True)
+            out_path = os.path.join(args.heatmap_dir, os.path.splitext(os.path.basename(image_path))[0] + '_heatmap.jpg')
+            save_heatmap_overlay(image_bytes, result, out_path, args.working_size)
+            print(f"  heatmap: {out_path}")
+        print(json.dumps(result['probabilities']))
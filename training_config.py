@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import tensorflow as tf
+
+# Performance knobs shared by model_building.py, data_loader.py and new_model.py. They are read
+# from training_config.json in the working directory (or the file named by $TRAINING_CONFIG), so
+# each machine can use its fastest setting without code changes. Missing keys keep these defaults.
+default_training_config = {
+    'jit_compile': False,  # XLA-compile the train step
+    'steps_per_execution': 1,  # train steps run per call into the compiled function
+    'mixed_precision': None,  # None, 'mixed_bfloat16', 'mixed_float16' or 'auto' (bfloat16 if the CPU has it)
+    'batch_size': None,  # None keeps the script's own batch_size
+    'throughput_log': 'training_throughput.jsonl',  # per-epoch timings are appended here (None: don't log)
+}
+
+def cpu_supports_bf16():
+    """True if the CPU has native bfloat16 instructions (AVX512_BF16 or AMX); otherwise bf16 is emulated and slow."""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def load_training_config(path=None, **overrides):
+    config = dict(default_training_config)
+    path = path or os.environ.get('TRAINING_CONFIG', 'training_config.json')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        unknown = set(saved) - set(default_training_config)
+        if unknown:
+            raise ValueError(f"{path}: unknown training config keys {sorted(unknown)}")
+        config.update(saved)
+    config.update(overrides)
+
+    if config['mixed_precision'] == 'auto':
+        config['mixed_precision'] = 'mixed_bfloat16' if cpu_supports_bf16() else None
+    return config
+
+def apply_precision_policy(config):
+    """
+    Sets the global Keras dtype policy. Must run before the model is built. Softmax outputs should be
+    built with dtype='float32' so the probabilities (and the loss) stay in full precision.
+    """
+    tf.keras.mixed_precision.set_global_policy(config['mixed_precision'] or 'float32')
+
+def compile_model(model, config, optimizer, loss='sparse_categorical_crossentropy', metrics=('accuracy',)):
+    """model.compile with the config's XLA and steps_per_execution settings (mixed_float16 gets loss scaling automatically)."""
+    model.compile(optimizer=optimizer, loss=loss, metrics=list(metrics),
+                  jit_compile=config['jit_compile'], steps_per_execution=config['steps_per_execution'])
+    return model
+
+class ThroughputLogger(tf.keras.callbacks.Callback):
+    """Prints and records each epoch's wall time and training images/sec, tagged with the config that produced it."""
+
+    def __init__(self, config, batch_size, run_name=None):
+        super().__init__()
+        self.config = config
+        self.batch_size = batch_size
+        self.run_name = run_name or os.path.basename(sys.argv[0])
+        self.records = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._steps = 0
+        self._start_time = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps = batch + 1  # with steps_per_execution > 1 this is only called every N steps
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self._start_time  # includes validation, as a user waiting for the epoch sees it
+        images = self._steps * self.batch_size  # the last batch may be partial, so this is a slight overestimate
+        record = {'run': self.run_name, 'epoch': epoch + 1, 'seconds': seconds,
+                  'images_per_sec': images / seconds if seconds > 0 else 0.0,
+                  'batch_size': self.batch_size,
+                  'config': {key: self.config[key] for key in ('jit_compile', 'steps_per_execution', 'mixed_precision')}}
+        self.records.append(record)
+        print(f"Epoch {epoch + 1}: {seconds:.1f}s, {record['images_per_sec']:.1f} images/sec "
+              f"(jit={self.config['jit_compile']}, steps_per_execution={self.config['steps_per_execution']}, "
+              f"precision={self.config['mixed_precision'] or 'float32'})")
+
+        if self.config.get('throughput_log'):
+            with open(self.config['throughput_log'], 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+def _build_sweep_model(img_width, img_height, num_classes):
+    """The model_building.py CNN, for comparing settings on synthetic data."""
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout, Input
+
+    return Sequential([
+        Input(shape=(img_height, img_width, 3)),
+        Conv2D(32, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Conv2D(64, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Conv2D(128, (3, 3), activation='relu'),
+        MaxPooling2D((2, 2)),
+        Flatten(),
+        Dense(512, activation='relu'),
+        Dropout(0.5),
+        Dense(num_classes, activation='softmax', dtype='float32')
+    ])
+
+def sweep(batch_size=32, num_images=512, epochs=2, img_width=224, img_height=224, num_classes=4,
+          jit_options=(False, True), steps_options=(1, 8), precision_options=(None, 'mixed_bfloat16')):
+    """
+    Trains the same small model on synthetic in-memory data under every combination of settings
+    and returns the images/sec of the last epoch for each (the first epoch includes tracing/compiling).
+    """
+    rng = tf.random.Generator.from_seed(0)
+    images = rng.uniform((num_images, img_height, img_width, 3))
+    labels = rng.uniform((num_images,), maxval=num_classes, dtype=tf.int32)
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels)).batch(batch_size).cache().prefetch(tf.data.AUTOTUNE)
+
+    results = []
+    for jit_compile, steps_per_execution, mixed_precision in itertools.product(jit_options, steps_options,
+                                                                               precision_options):
+        config = dict(default_training_config, jit_compile=jit_compile, steps_per_execution=steps_per_execution,
+                      mixed_precision=mixed_precision, throughput_log=None)
+        apply_precision_policy(config)
+        model = compile_model(_build_sweep_model(img_width, img_height, num_classes), config,
+                              tf.keras.optimizers.Adam(learning_rate=0.0001))
+        logger = ThroughputLogger(config, batch_size, run_name='sweep')
+        model.fit(dataset, epochs=epochs, callbacks=[logger], verbose=0)
+        results.append(dict(logger.records[-1]['config'], images_per_sec=logger.records[-1]['images_per_sec']))
+        tf.keras.backend.clear_session()
+    apply_precision_policy(default_training_config)
+
+    results.sort(key=lambda result: -result['images_per_sec'])
+    print("Fastest first:")
+    for result in results:
+        print(f"  jit={result['jit_compile']!s:<5} steps_per_execution={result['steps_per_execution']:<3} "
+              f"precision={result['mixed_precision'] or 'float32':<15} {result['images_per_sec']:.1f} images/sec")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare training settings on this machine and save the fastest")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-images', type=int, default=512)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--img-size', type=int, default=224, help="Smaller sizes give a quicker (rougher) comparison")
+    parser.add_argument('--save', metavar='PATH', help="Write the fastest setting to this config file (e.g. training_config.json)")
+    args = parser.parse_args()
+
+    precision_options = (None, 'mixed_bfloat16') if cpu_supports_bf16() else (None,)
+    results = sweep(args.batch_size, args.num_images, args.epochs, args.img_size, args.img_size,
+                    precision_options=precision_options)
+    if args.save:
+        best = {key: results[0][key] for key in ('jit_compile', 'steps_per_execution', 'mixed_precision')}
+        with open(args.save, 'w') as f:
+            json.dump(best, f, indent=2)
+        print(f"Saved {best} to {args.save}")